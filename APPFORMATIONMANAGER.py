@@ -4,13 +4,36 @@ import pandas as pd
 import time
 import os
 import base64
+import html
+import json
+import random
+import functools
 from datetime import date, datetime
-from fpdf import FPDF
-import requests
 import altair as alt
+import assets
+import parametres
+import partitions
+import recherche
+import recommandations
+import sauvegarde
+import analytique
+import archive
+import cache
+import tableau_de_bord
+import jobs
+import operations
+import certificats
+import prerequis
+import entonnoir
+import images
+import notifications
+import memoire
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # --- Configuration de la page ---
 st.set_page_config(layout="wide", page_title="Formation Manager")
+# Profilage mémoire du rerun (sans effet tant qu'il n'est pas activé, cf. memoire.py)
+memoire.debut()
 
 st.markdown(
     """
@@ -42,33 +65,9 @@ def t(fr, en, es):
         return es
     return fr
 
-# --- BDD Système pour paramètres ---
-def get_conn_settings():
-    conn = sqlite3.connect("system.db", check_same_thread=False)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS system_settings (
-            param TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    conn.commit()
-    return conn
-
-conn_sys = get_conn_settings()
-cursor_sys = conn_sys.cursor()
-
-def save_param(param, value):
-    cursor_sys.execute("""
-        INSERT INTO system_settings(param,value) VALUES(?,?)
-        ON CONFLICT(param) DO UPDATE SET value=excluded.value
-    """, (param, str(value)))
-    conn_sys.commit()
-
-def get_param(param, default=None):
-    cursor_sys.execute("SELECT value FROM system_settings WHERE param=?", (param,))
-    row = cursor_sys.fetchone()
-    return row[0] if row else default
+# --- Paramètres système et utilisateur (cache en mémoire, voir parametres.py) ---
+save_param = parametres.save_param
+get_param = parametres.get_param
 
 # --- Initialise la langue depuis la BDD ---
 if "lang" not in st.session_state:
@@ -77,6 +76,7 @@ if "lang" not in st.session_state:
 # --- BDD Utilisateurs ---
 def get_conn_users():
     conn = sqlite3.connect("users.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")   # lecteurs (sauvegardes, tableaux de bord) sans bloquer les écritures
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS utilisateurs (
@@ -85,6 +85,10 @@ def get_conn_users():
             nom TEXT, prenom TEXT, fonction TEXT, genre TEXT, photo_path TEXT
         )
     """)
+    # Site OCP de l'utilisateur (sert au partitionnement progress/tests)
+    cols = [r[1] for r in c.execute("PRAGMA table_info(utilisateurs)")]
+    if "site" not in cols:
+        c.execute("ALTER TABLE utilisateurs ADD COLUMN site TEXT")
     conn.commit()
     return conn
 
@@ -108,6 +112,8 @@ def get_conn_employes():
 @st.cache_resource
 def get_conn_formations():
     conn = sqlite3.connect("formations.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS formations (
@@ -122,29 +128,32 @@ def get_conn_formations():
             formation_id INTEGER, titre TEXT NOT NULL,
             type_contenu TEXT NOT NULL, contenu TEXT NOT NULL,
             ordre INTEGER NOT NULL,
-            FOREIGN KEY(formation_id) REFERENCES formations(id)
-        )
-    """)
-    conn.commit()
-    return conn
-
-@st.cache_resource
-def get_conn_progress():
-    conn = sqlite3.connect("progress.db", check_same_thread=False)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS progress (
-            email TEXT, formation_id INTEGER,
-            chapter_id INTEGER, timestamp TEXT,
-            PRIMARY KEY(email,formation_id,chapter_id)
+            FOREIGN KEY(formation_id) REFERENCES formations(id) ON DELETE CASCADE
         )
     """)
+    # Révision du contenu : incrémentée à chaque réinitialisation des indicateurs
+    cols = [r[1] for r in c.execute("PRAGMA table_info(formations)")]
+    if "revision" not in cols:
+        c.execute("ALTER TABLE formations ADD COLUMN revision INTEGER NOT NULL DEFAULT 1")
     conn.commit()
+    # Bases créées avant ON DELETE CASCADE : reconstruction de chapitres (voir operations.py)
+    operations.ajouter_cascade(conn, "chapitres", "formations")
+    # Index de recherche plein texte des chapitres (voir recherche.py)
+    recherche.preparer(conn)
+    if recherche.a_indexer(conn):
+        jobs.lancer("indexer_chapitres")
+    # Prérequis entre formations et leur fermeture transitive (voir prerequis.py)
+    prerequis.preparer(conn)
+    recommandations.preparer(conn)
+    if not conn.execute("SELECT 1 FROM recommandations LIMIT 1").fetchone():
+        jobs.lancer("recommandations")
     return conn
 
 @st.cache_resource
 def get_conn_tests():
     conn = sqlite3.connect("tests.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS tests (
@@ -164,21 +173,276 @@ def get_conn_tests():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             question_id INTEGER, option_text TEXT NOT NULL,
             is_correct INTEGER NOT NULL,
-            FOREIGN KEY(question_id) REFERENCES questions(id)
+            FOREIGN KEY(question_id) REFERENCES questions(id) ON DELETE CASCADE
         )
     """)
     conn.commit()
+    operations.ajouter_cascade(conn, "options", "questions")
     return conn
 
+# --- Sauvegardes planifiées (une tâche "sauvegarde" toujours en attente, voir sauvegarde.py) ---
+@st.cache_resource
+def planifier_sauvegardes():
+    sauvegarde.programmer()
+    return True
+
+planifier_sauvegardes()
+
+# --- Instantané analytique des tableaux de bord (voir analytique.py) ---
+@st.cache_resource
+def planifier_analytique():
+    analytique.programmer()
+    return True
+
+planifier_analytique()
+
 conn_emp = get_conn_employes()
 cur_emp = conn_emp.cursor()
 conn_form = get_conn_formations()
 cur_form = conn_form.cursor()
-conn_prog = get_conn_progress()
-cur_prog = conn_prog.cursor()
 conn_test = get_conn_tests()
 cur_test = conn_test.cursor()
 
+# --- Données de référence en cache (voir cache.py) : chaque écriture appelle cache.invalider(...) ---
+@cache.reference("formations")
+def liste_formations():
+    """(id, titre, date, duree, formateur, revision), les plus récentes d'abord."""
+    return tuple(conn_form.execute(
+        "SELECT id, titre, date, duree, formateur, revision FROM formations ORDER BY date DESC"
+    ).fetchall())
+
+@cache.reference("chapitres")
+def liste_chapitres(fid):
+    """(id, titre, type_contenu, contenu, ordre) d'une formation, dans l'ordre de lecture."""
+    return tuple(conn_form.execute(
+        "SELECT id, titre, type_contenu, contenu, ordre FROM chapitres WHERE formation_id=? ORDER BY ordre, id", (fid,)
+    ).fetchall())
+
+@cache.reference("prerequis")
+def fermeture_prerequis():
+    """{formation_id: frozenset des prérequis directs et indirects}."""
+    return prerequis.fermeture(conn_form)
+
+@cache.reference("questions")
+def liste_questions(fid):
+    """Ids des questions notables du test d'une formation.
+
+    Une question sans option ne peut pas être répondue et serait comptée juste (ensemble vide =
+    ensemble vide), à choix unique comme multiple : elle est écartée du test et du score.
+    """
+    return tuple(r[0] for r in conn_test.execute("""
+        SELECT id FROM questions q
+        WHERE formation_id = ? AND EXISTS (SELECT 1 FROM options o WHERE o.question_id = q.id)
+        ORDER BY id
+    """, (fid,)))
+
+@cache.reference("employes")
+def liste_employes():
+    """(id, nom, prenom, fonction) triés par nom."""
+    return tuple(conn_emp.execute("SELECT id, nom, prenom, fonction FROM employes ORDER BY nom").fetchall())
+
+# --- Statistiques apprenant (une connexion avec la partition progress/tests attachée) ---
+@st.cache_resource
+def get_conn_stats(cle):
+    partitions.connexion("progress", cle)
+    partitions.connexion("tests", cle)
+    conn = sqlite3.connect("formations.db", check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS prog", (partitions.chemin("progress", cle),))
+    conn.execute("ATTACH DATABASE ? AS tst", (partitions.chemin("tests", cle),))
+    return conn
+
+def calculer_stats_utilisateur(email):
+    conn = get_conn_stats(partitions.cle_partition(email))
+    total_chap, total_forms, total_tests, passed_tests = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM chapitres),
+               (SELECT COUNT(*) FROM formations),
+               (SELECT COUNT(*) FROM tst.tests WHERE email=?),
+               (SELECT COUNT(*) FROM tst.tests WHERE email=? AND passed=1)
+    """, (email, email)).fetchone()
+    # Chapitres lus groupés par formation et type de contenu
+    rows = conn.execute("""
+        SELECT p.formation_id, f.titre, c.type_contenu, COUNT(*)
+        FROM prog.progress p
+        LEFT JOIN chapitres c ON c.id = p.chapter_id
+        LEFT JOIN formations f ON f.id = p.formation_id
+        WHERE p.email = ?
+        GROUP BY p.formation_id, c.type_contenu
+    """, (email,)).fetchall()
+    # Lectures archivées (archive.py) : formations réussies depuis longtemps ou retirées
+    arch = archive.lire_archive("progress", email=email, colonnes=["formation_id", "chapter_id"])
+    if len(arch):
+        # Un chapitre relu depuis l'archivage est déjà compté côté vivant
+        vivants = set(conn.execute("SELECT formation_id, chapter_id FROM prog.progress WHERE email = ?", (email,)))
+        arch = arch[[(f, c) not in vivants for f, c in zip(arch["formation_id"], arch["chapter_id"])]]
+        titres = dict(conn.execute("SELECT id, titre FROM formations"))
+        types = dict(conn.execute("SELECT id, type_contenu FROM chapitres"))
+        arch["type"] = arch["chapter_id"].map(types)
+        rows += [(int(fid), titres.get(fid), None if pd.isna(type_c) else type_c, int(n))
+                 for (fid, type_c), n in arch.groupby(["formation_id", "type"], dropna=False).size().items()]
+    par_format = {}
+    par_formation = {}
+    for fid, titre, type_c, n in rows:
+        if type_c is not None:
+            par_format[type_c] = par_format.get(type_c, 0) + n
+        _, deja = par_formation.get(fid, (titre, 0))
+        par_formation[fid] = (titre, deja + n)
+    return {
+        "total_chap": total_chap,
+        "total_forms": total_forms,
+        "total_tests": total_tests,
+        "passed_tests": passed_tests,
+        "chap_lus": sum(n for _, _, _, n in rows),
+        "form_started": len(par_formation),
+        "par_format": par_format,
+        "par_formation": list(par_formation.values()),
+    }
+
+def stats_utilisateur(email):
+    """Statistiques d'un apprenant, dans la zone LRU par utilisateur de cache.py (tous process confondus)."""
+    return cache.lire(
+        ("stats_utilisateur", email), ("formations", "chapitres", "progress", f"progress:{email}"),
+        lambda: calculer_stats_utilisateur(email), zone="utilisateurs"
+    )
+
+def invalider_stats(email=None):
+    # Sans email : une écriture admin (formations, chapitres) touche tout le monde
+    cache.invalider("progress" if email is None else f"progress:{email}")
+
+# --- Messages flash : conservés dans la session et affichés après st.rerun(), sans attente côté serveur ---
+def flash(message, niveau="success"):
+    st.session_state.setdefault("flash", []).append((niveau, message))
+
+def afficher_flash():
+    for niveau, message in st.session_state.pop("flash", []):
+        st.toast(message, icon={"success": "✅", "info": "ℹ️"}.get(niveau, "⚠️"))
+
+# --- Recherche plein texte dans les chapitres ---
+def afficher_resultats_recherche(resultats, ouvrir=False):
+    for i, r in enumerate(resultats):
+        st.markdown(
+            f"**{html.escape(r['formation'])}** › {r['chapitre']}<br><small>{r['extrait']}</small>",
+            unsafe_allow_html=True
+        )
+        if ouvrir:
+            # Sélectionne la formation dans "Parcourir Formation" (avant le rendu du selectbox)
+            st.button(
+                t("Ouvrir","Open","Abrir"), key=f"rech_ouvrir_{i}",
+                on_click=st.session_state.update, kwargs={"view_form": r["formation"]}
+            )
+
+# --- Lecteur de chapitres (Parcourir Formation) ---
+# Stepper : un seul élément SVG, limité aux chapitres autour du chapitre courant
+FENETRE_STEPPER = 4
+
+def stepper_svg(total, idx, lus):
+    """SVG des étapes ; lus(i) -> chapitre i déjà lu. Coût constant quel que soit le nombre de chapitres."""
+    debut, fin = max(0, idx - FENETRE_STEPPER), min(total, idx + FENETRE_STEPPER + 1)
+    etapes = ([0, None] if debut > 1 else list(range(debut))) + list(range(debut, fin)) \
+        + ([None, total - 1] if fin < total - 1 else list(range(fin, total)))
+    elements = []
+    for n, i in enumerate(etapes):
+        x = 22 + n * 46
+        if i is None:
+            elements.append(f'<text x="{x}" y="27" text-anchor="middle" fill="#888" font-size="18">…</text>')
+            continue
+        couleur = "#e47157" if i == idx else "#2c6e49" if lus(i) else "#cfcfcf"
+        taille = 14 if i < 99 else 11
+        elements.append(
+            f'<circle cx="{x}" cy="22" r="18" fill="{couleur}"/>'
+            f'<text x="{x}" y="22" dy="0.35em" text-anchor="middle" fill="white" font-size="{taille}">{i + 1}</text>'
+        )
+    largeur = len(etapes) * 46
+    return (
+        f'<svg width="{largeur}" height="44" viewBox="0 0 {largeur} 44" role="img" '
+        f'aria-label="{idx + 1} / {total}" style="font-family:sans-serif">{"".join(elements)}</svg>'
+        f'<span style="margin-left:12px;color:#555">{idx + 1} / {total}</span>'
+    )
+
+# Fragment : ◀️ / ▶️ ne réexécutent que le lecteur, avec la liste de chapitres déjà chargée
+def aller_au_chapitre(idx):
+    st.session_state.ch_idx = idx
+    st.session_state.formation_finie = False
+
+@st.fragment
+def lecteur_chapitres(user_email, fid, chs):
+    total = len(chs)
+    conn_prog = partitions.conn_progress(user_email)
+    # Initialisation de l’index de chapitre et de l’état de fin de formation
+    if st.session_state.get("last_fid") != fid:
+        st.session_state.ch_idx = 0
+        st.session_state.last_fid = fid
+        st.session_state.formation_finie = False
+    if "formation_finie" not in st.session_state:
+        st.session_state.formation_finie = False
+
+    idx = min(max(st.session_state.get("ch_idx", 0), 0), total - 1)
+    st.session_state.ch_idx = idx
+
+    # Affichage du stepper : chapitres lus en une requête
+    lus = {r[0] for r in conn_prog.execute(
+        "SELECT chapter_id FROM progress WHERE email = ? AND formation_id = ?", (user_email, fid)
+    )}
+    st.markdown(
+        f"<div style='display:flex;align-items:center'>{stepper_svg(total, idx, lambda i: chs[i][0] in lus)}</div>",
+        unsafe_allow_html=True
+    )
+
+    # ----------- Si la formation est finie ----------- #
+    if st.session_state.formation_finie:
+        st.success(
+            t(
+                "🎉 Vous avez terminé la formation ! Vous pouvez passer le test.",
+                "🎉 You have finished the training! You can now take the test.",
+                "🎉 ¡Has terminado la formación! Ahora puedes realizar la prueba."
+            )
+        )
+        st.button(
+            t("🔁 Recommencer la lecture depuis le début", "🔁 Restart reading from the beginning", "🔁 Volver a empezar desde el principio"),
+            key="restart_reading", on_click=aller_au_chapitre, args=(0,)
+        )
+    else:
+        # Récupérer le chapitre courant
+        cid, titre_chap, type_c, cont = chs[idx]
+
+        # Marquer le chapitre comme lu
+        cur_prog = conn_prog.execute(
+            "INSERT OR IGNORE INTO progress(email, formation_id, chapter_id, timestamp) VALUES(?,?,?,?)",
+            (user_email, fid, cid, datetime.now().isoformat())
+        )
+        conn_prog.commit()
+        if cur_prog.rowcount:
+            invalider_stats(user_email)
+
+        # Affichage du contenu du chapitre courant
+        if type_c == "texte":
+            st.markdown(cont)
+        elif type_c == "pdf":
+            b64 = base64.b64encode(open(cont, "rb").read()).decode()
+            st.markdown(
+                f"<embed src='data:application/pdf;base64,{b64}' width='100%' height='400px'/>",
+                unsafe_allow_html=True
+            )
+        elif type_c == "video":
+            st.video(cont)
+        else:  # ppt
+            st.download_button(
+                t("Télécharger PPT", "Download PPT", "Descargar PPT"),
+                open(cont, "rb"),
+                file_name=os.path.basename(cont)
+            )
+
+        # Boutons navigation
+        prev_col, _, next_col = st.columns([1, 6, 1])
+        with prev_col:
+            st.button("◀️", key="nav_prev", on_click=aller_au_chapitre, args=(max(idx - 1, 0),))
+        with next_col:
+            if idx < total - 1:
+                st.button("▶️", key="nav_next", on_click=aller_au_chapitre, args=(idx + 1,))
+            elif st.button("▶️", key="nav_fin"):
+                # Si on clique “suivant” au dernier chapitre : FIN, et rerun complet (l'onglet test devient accessible)
+                st.session_state.formation_finie = True
+                st.rerun()
+
 # --- Mapping fonctions OCP (nécessaire pour la gestion employés) ---
 fonctions_ocp = {
     "Opérateur de production": "operateur_production",
@@ -201,42 +465,42 @@ for key in ["authenticated", "email", "login_email", "login_password"]:
 
 # --- Page de connexion ---
 def login_page():
-    st.markdown("""
+    st.markdown(f"""
     <style>
-    html, body, .stApp {
+    html, body, .stApp {{
         background-color: #ffffff !important;
-        background-image: url('https://upload.wikimedia.org/wikipedia/commons/thumb/1/1c/OCP_Group.svg/1606px-OCP_Group.svg.png') !important;
+        background-image: url('{assets.url("logo_ocp.svg")}') !important;
         background-repeat: no-repeat;
         background-position: center center;
         background-size: contain;
         height: 100vh;
-    }
-    h1 {
+    }}
+    h1 {{
         text-align: center !important;
         font-size: 48px !important;
         margin-bottom: 20px !important;
         color: black !important;
-    }
-    .stTextInput>div, .stPasswordInput>div {
+    }}
+    .stTextInput>div, .stPasswordInput>div {{
         max-width: 300px;
         margin: 0 auto 10px;
-    }
-    .stTextInput label, .stPasswordInput label {
+    }}
+    .stTextInput label, .stPasswordInput label {{
         display: block !important;
         text-align: center !important;
         margin-bottom: 5px !important;
         color: black !important;
-    }
-    .stTextInput input, .stPasswordInput input {
+    }}
+    .stTextInput input, .stPasswordInput input {{
         color: black !important;
-    }
-    .stButton>button {
+    }}
+    .stButton>button {{
         display: block !important;
         margin: 20px auto !important;
         background-color: #e47157 !important;
         color: white !important;
         border: none !important;
-    }
+    }}
     </style>
     """, unsafe_allow_html=True)
 
@@ -256,117 +520,20 @@ def login_page():
         if row and row[0] == pwd:
             st.session_state.authenticated = True
             st.session_state.email = email
-            st.success(t("Connexion réussie !","Login successful!","¡Inicio de sesión exitoso!"))
-            time.sleep(1)
+            st.session_state.lang = parametres.get(email, "lang", st.session_state.lang)
+            flash(t("Connexion réussie !","Login successful!","¡Inicio de sesión exitoso!"))
             st.rerun()
         else:
             st.error(t("Identifiants incorrects.","Incorrect credentials.","Credenciales incorrectas."))
 
-# URL du logo
-LOGO_URL = "https://start-up-bucket.s3.eu-west-3.amazonaws.com/wp-content/uploads/2025/04/15175542/OCP-Group-l-Start-Up-1-1-1-1-1-1-1-300x300.png"
-
-# Fonction pour télécharger le logo temporairement
-def download_logo(path="logo_temp.png"):
-    try:
-        r = requests.get(LOGO_URL, timeout=5)
-        r.raise_for_status()
-        with open(path, "wb") as f:
-            f.write(r.content)
-        return path
-    except Exception as e:
-        print(f"Erreur téléchargement logo : {e}")
-        return None
-
-# Génération de certificat PDF avec logo
-def creer_certificat(nom, formation, date_certif):
-    # Téléchargement et insertion du logo
-    logo_path = download_logo()
-
-    pdf = FPDF()
-    pdf.add_page()
-
-    if logo_path and os.path.exists(logo_path):
-        logo_w = 50  # largeur du logo en mm
-        x_center = (pdf.w - logo_w) / 2
-        y_logo = 18
-        pdf.image(logo_path, x=x_center, y=y_logo, w=logo_w)
-        os.remove(logo_path)
-
-    # Titre principal
-    pdf.set_font("Arial", "B", 26)
-    pdf.set_text_color(44, 110, 73)
-    pdf.ln(45)
-    pdf.cell(
-        0, 18,
-        t("CERTIFICAT DE FORMATION", "TRAINING CERTIFICATE", "CERTIFICADO DE FORMACIÓN"),
-        ln=1, align="C"
-    )
-    pdf.ln(5)
-
-    # Cadre
-    pdf.set_draw_color(44, 110, 73)
-    pdf.set_line_width(1)
-    pdf.rect(10, 30, 190, 240)
-
-    # Texte central
-    pdf.set_xy(20, 60)
-    pdf.set_font("Arial", "", 14)
-    pdf.set_text_color(0, 0, 0)
-
-    texte = f'''
-    {t("Ce certificat est décerné à :",
-    "This certificate is awarded to:",
-    "Este certificado se otorga a:")}
-
-    {nom}
-
-    {t("Pour avoir suivi avec succès la formation :",
-    "For successfully completing the training:",
-    "Por haber completado con éxito la formación:")}
-
-    "{formation}"
-
-    {t("Délivré le :",
-    "Issued on:",
-    "Emitido el:")} {date_certif.strftime("%d/%m/%Y")}
-
-    {t("Ce certificat atteste de la participation active, de l'assiduité et de l'engagement",
-    "This certificate certifies active participation, regular attendance, and commitment",
-    "Este certificado certifica la participación activa, la asistencia regular y el compromiso")}
-
-    {t("dans le cadre d'un programme de développement professionnel.",
-    "as part of a professional development program.",
-    "como parte de un programa de desarrollo profesional.")}
-    '''
-
-    # —————— Correction Unicode pour FPDF ——————
-    # Remplace les apostrophes typographiques ’ par '
-    texte = texte.replace("’", "'")
-
-    pdf.multi_cell(0, 10, texte, align="C")
-
-    # Signature RH
-    pdf.set_xy(120, 220)
-    pdf.set_font("Arial", "I", 12)
-    pdf.cell(0, 10, t("Signature RH","HR Signature","Firma RRHH"), ln=1)
-    pdf.set_xy(120, 230)
-    pdf.set_font("Arial", "", 16)
-    pdf.set_text_color(100, 100, 100)
-    pdf.cell(0, 10, t("/ abdelkebir RH /","/ abdelkebir HR /","/ abdelkebir RRHH /"), ln=1)
-
-    filename = f"Certificat_{nom.replace(' ', '_')}.pdf"
-    pdf.output(filename)
-    return filename
-
-
 # --- Application principale ---
 def main():
-    st.markdown("""
+    st.markdown(f"""
         <style>
-        [data-testid="stAppViewContainer"] .block-container {
-            background: url("https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTzhCewsH_PSebAXk5yOFJF6wp_Qoq-Y_fHbg&s")
+        [data-testid="stAppViewContainer"] .block-container {{
+            background: url("{assets.url('fond.svg')}")
                         center/cover no-repeat fixed !important;
-        }
+        }}
         </style>
     """, unsafe_allow_html=True)
 
@@ -385,29 +552,37 @@ def main():
     cur_users.execute("SELECT fonction FROM utilisateurs WHERE email=?", (user_email,))
     row = cur_users.fetchone()
     if row is None:
-        st.error("Utilisateur introuvable – déconnexion en cours.")
+        flash(t("Utilisateur introuvable – déconnexion en cours.","User not found – logging out.","Usuario no encontrado – cerrando sesión."), "error")
         st.session_state.authenticated = False
         st.rerun()
     role = row[0]
+
+    # Partition progress/tests de l'utilisateur connecté
+    conn_prog = partitions.conn_progress(user_email)
+    cur_prog = conn_prog.cursor()
+    conn_res = partitions.conn_tests(user_email)
+    cur_res = conn_res.cursor()
 # Création des onglets
     if role == "Admin":
-        tabs = st.tabs([
+        noms_onglets = [
             t(" Gestion Formations"," Training Mgmt"," Gestión Formaciones"),
             t(" Gestion Employés"," Employee Mgmt"," Gestión Empleados"),
             t(" Chapitres"," Chapters"," Capítulos"),
             t(" Utilisateurs"," Users"," Usuarios"),
             t("⚙️Paramètres","⚙️Settings","⚙️Configuración"),
             t("📈dashbord"," 📈dashbord"," 📈dashbord"),
-          
-        ])
+            t("🧵 Tâches","🧵 Jobs","🧵 Tareas"),
+            t("🔻 Parcours","🔻 Drop-off","🔻 Recorridos"),
+        ]
     else:
-        tabs = st.tabs([
+        noms_onglets = [
             t(" Parcourir Formation"," Browse Training"," Navegar Formación"),
             t(" Passer le test"," Take Test"," Realizar Prueba"),
             t(" Mes certificats"," My Certificates"," Mis Certificados"),
             t('⚙️ Paramètres','⚙️ Settings','⚙️ Ajustes'),
             t("📈 Mon Dashboard", "📈 My Dashboard","📈 Mi Panel")
-        ])
+        ]
+    tabs = memoire.onglets(st.tabs(noms_onglets), noms_onglets)
 
     # ------------------------------------------------------------------------------------------------
     # 1️⃣ Admin / RH : Gestion Formations, Employés, Chapitres, Utilisateurs, Paramètres, Dashboard Admin
@@ -439,8 +614,14 @@ def main():
                             (titre, date_f.strftime("%Y-%m-%d"), duree, formateur)
                         )
                         conn_form.commit()
-                        st.success(t("Formation ajoutée ✅","Training added ✅","Formación agregada ✅"))
-                        time.sleep(1)
+                        cache.invalider("formations")
+                        invalider_stats()
+                        recommandations.programmer()
+                        notifications.emettre(
+                            "formation", f"Nouvelle formation : {titre}",
+                            f"{titre} — {date_f.strftime('%d/%m/%Y')}, {duree} h, {formateur}"
+                        )
+                        flash(t("Formation ajoutée ✅","Training added ✅","Formación agregada ✅"))
                         st.rerun()
                     else:
                         st.warning(t("Veuillez remplir tous les champs.","Please fill all fields.","Por favor complete todos los campos."))
@@ -449,8 +630,7 @@ def main():
                     f"<h2 style='text-align:center;font-size:18px; margin:0px 0;'>{t('🛠 Modifier / Supprimer','🛠 Edit / Delete','🛠 Editar / Eliminar')}</h2>",
                     unsafe_allow_html=True
                 )
-                cur_form.execute("SELECT id, titre, date, duree, formateur FROM formations ORDER BY date DESC")
-                data = cur_form.fetchall()
+                data = [row[:5] for row in liste_formations()]
                 if data:
                     choix = [f"{row[1]} — {row[2]}" for row in data]
                     sel = st.selectbox(t("Sélection formation","Select Training","Seleccione Formación"), choix, key="mod_form_select")
@@ -469,38 +649,29 @@ def main():
                     with c_mod:
                         if st.button(t("Modifier","Edit","Editar"), key="mod_form_btn"):
                             cur_form.execute(
-                                "UPDATE formations SET titre=?, date=?, duree=?, formateur=? WHERE id=?",
+                                "UPDATE formations SET titre=?, date=?, duree=?, formateur=?, revision=revision+1 WHERE id=?",
                                 (new_t, new_d.strftime("%Y-%m-%d"), new_du, new_fr, fid)
                             )
                             conn_form.commit()
+                            cache.invalider("formations")
                             # Réinitialiser les progressions et tests pour cette formation
-                            cur_prog.execute("DELETE FROM progress WHERE formation_id=?", (fid,))
-                            conn_prog.commit()
-                            cur_test.execute("DELETE FROM tests WHERE formation_id=?", (fid,))
-                            conn_test.commit()
-                            st.success(t("Formation modifiée  — indicateurs réinitialisés","Training updated  — metrics reset","Formación actualizada  — indicadores reiniciados"))
-                            time.sleep(1)
+                            jobs.lancer("reinitialiser_indicateurs", {"formation_id": fid})
+                            invalider_stats()
+                            flash(t("Formation modifiée  — indicateurs réinitialisés","Training updated  — metrics reset","Formación actualizada  — indicadores reiniciados"))
                             st.rerun()
                     with c_del:
                         if st.button(t("Supprimer","Delete","Eliminar"), key="del_form_btn"):
-                            cur_form.execute("DELETE FROM formations WHERE id=?", (fid,))
-                            conn_form.commit()
-                            # Supprimer chapitres, progressions et tests associés
-                            cur_form.execute("DELETE FROM chapitres WHERE formation_id=?", (fid,))
-                            conn_form.commit()
-                            cur_prog.execute("DELETE FROM progress WHERE formation_id=?", (fid,))
-                            conn_prog.commit()
-                            cur_test.execute("DELETE FROM tests WHERE formation_id=?", (fid,))
-                            conn_test.commit()
-                            st.warning(t("Formation supprimée  — indicateurs supprimés","Training deleted  — metrics removed","Formación eliminada  — indicadores eliminados"))
-                            time.sleep(1)
+                            # Formation, chapitres, progressions et tests associés : tâche de fond
+                            jobs.lancer("supprimer_formation", {"formation_id": fid})
+                            cache.invalider("formations", "chapitres")
+                            invalider_stats()
+                            flash(t("Formation supprimée  — indicateurs supprimés","Training deleted  — metrics removed","Formación eliminada  — indicadores eliminados"), "warning")
                             st.rerun()
                 else:
                     st.info(t("Aucune formation disponible.","No training available.","No hay formación disponible."))
             st.subheader(t(" Liste des formations"," Training List"," Lista de Formación"))
-            cur_form.execute("SELECT titre, date, duree, formateur FROM formations ORDER BY date DESC")
             df_forms = pd.DataFrame(
-                cur_form.fetchall(),
+                [row[1:5] for row in liste_formations()],
                 columns=[
                     t("Titre","Title","Título"),
                     t("Date","Date","Fecha"),
@@ -513,6 +684,37 @@ def main():
             else:
                 st.info(t("Aucune formation enregistrée.","No trainings recorded.","No hay formaciones registradas."))
 
+            # Parcours : prérequis entre formations (graphe sans cycle, fermeture tenue par prerequis.py)
+            st.subheader(t("🔗 Prérequis & parcours","🔗 Prerequisites & paths","🔗 Requisitos previos & itinerarios"))
+            titres_p = {row[0]: row[1] for row in liste_formations()}
+            if len(titres_p) > 1:
+                fid_p = st.selectbox(t("Formation","Training","Formación"), list(titres_p), format_func=titres_p.get, key="prereq_form")
+                actuels = prerequis.directs(conn_form, fid_p)
+                choisis = st.multiselect(
+                    t("Doit d'abord réussir","Must first pass","Debe aprobar primero"),
+                    [f for f in titres_p if f != fid_p], default=actuels, format_func=titres_p.get, key=f"prereq_requis_{fid_p}"
+                )
+                if st.button(t("💾 Enregistrer","💾 Save","💾 Guardar"), key="prereq_save"):
+                    try:
+                        # Tout ou rien : aucun arc n'est écrit si l'un d'eux ferme un cycle
+                        prerequis.remplacer(conn_form, fid_p, choisis)
+                    except ValueError:
+                        st.error(t("Cycle : cette formation est elle-même un prérequis (direct ou indirect) de la formation choisie.",
+                                   "Cycle: this training is itself a (direct or indirect) prerequisite of the chosen one.",
+                                   "Ciclo: esta formación ya es un requisito (directo o indirecto) de la formación elegida."))
+                    else:
+                        flash(t("Prérequis enregistrés ✅","Prerequisites saved ✅","Requisitos guardados ✅"))
+                        st.rerun()
+                    finally:
+                        cache.invalider("prerequis")
+                fermeture_p = fermeture_prerequis()
+                if fermeture_p:
+                    st.dataframe(pd.DataFrame(
+                        [(titres_p.get(f, f), ", ".join(sorted(titres_p.get(r, str(r)) for r in requis)))
+                         for f, requis in fermeture_p.items()],
+                        columns=[t("Formation","Training","Formación"), t("Prérequis (tous)","Prerequisites (all)","Requisitos (todos)")]
+                    ), use_container_width=True, hide_index=True)
+
         # --- 2) Gestion Employés ---
         with tabs[1]:
             st.markdown(
@@ -530,15 +732,14 @@ def main():
                     if nom and prenom:
                         cur_emp.execute("INSERT INTO employes(nom,prenom,fonction) VALUES(?,?,?)", (nom, prenom, func_val))
                         conn_emp.commit()
-                        st.success(t("Employé ajouté ✅","Employee added ✅","Empleado agregado ✅"))
-                        time.sleep(1)
+                        cache.invalider("employes")
+                        flash(t("Employé ajouté ✅","Employee added ✅","Empleado agregado ✅"))
                         st.rerun()
                     else:
                         st.warning(t("Veuillez remplir tous les champs.","Please fill all fields.","Por favor complete todos los campos."))
             with col2:
                 st.subheader(t("🛠 Modifier / Supprimer","🛠 Edit / Delete","🛠 Editar / Eliminar"))
-                cur_emp.execute("SELECT id, nom, prenom, fonction FROM employes ORDER BY nom")
-                emp_data = cur_emp.fetchall()
+                emp_data = liste_employes()
                 if emp_data:
                     opts = [f"{e[1]} {e[2]} — {e[3].replace('_',' ').title()}" for e in emp_data]
                     sel2 = st.selectbox(t("Sélection employé","Select Employee","Seleccione Empleado"), opts, key="mod_emp_select")
@@ -558,22 +759,21 @@ def main():
                         if st.button(t("Modifier","Edit","Editar"), key="mod_emp_btn"):
                             cur_emp.execute("UPDATE employes SET nom=?, prenom=?, fonction=? WHERE id=?", (n_n, n_p, n_f, eid))
                             conn_emp.commit()
-                            st.success(t("Employé modifié ","Employee updated ","Empleado actualizado "))
-                            time.sleep(1)
+                            cache.invalider("employes")
+                            flash(t("Employé modifié ","Employee updated ","Empleado actualizado "))
                             st.rerun()
                     with c_del2:
                         if st.button(t("Supprimer","Delete","Eliminar"), key="del_emp_btn"):
                             cur_emp.execute("DELETE FROM employes WHERE id=?", (eid,))
                             conn_emp.commit()
-                            st.warning(t("Employé supprimé ","Employee deleted ","Empleado eliminado "))
-                            time.sleep(1)
+                            cache.invalider("employes")
+                            flash(t("Employé supprimé ","Employee deleted ","Empleado eliminado "), "warning")
                             st.rerun()
                 else:
                     st.info(t("Aucun employé enregistré.","No employees recorded.","No hay empleados registrados."))
             st.subheader(t("📋 Liste des employés","📋 Employee List","📋 Lista de Empleados"))
-            cur_emp.execute("SELECT nom, prenom, fonction FROM employes ORDER BY nom")
             df_emp = pd.DataFrame(
-                cur_emp.fetchall(),
+                [row[1:] for row in liste_employes()],
                 columns=[t("Nom","Last Name","Apellido"), t("Prénom","First Name","Nombre"), t("Fonction","Role","Rol")]
             )
             df_emp[t("Fonction","Role","Rol")] = df_emp[t("Fonction","Role","Rol")].apply(lambda x: x.replace("_"," ").title())
@@ -595,7 +795,7 @@ def main():
             )
 
             if mode == t("Ajouter Chapitre","Add Chapter","Agregar Capítulo"):
-                fms2 = cur_form.execute("SELECT id, titre FROM formations ORDER BY date DESC").fetchall()
+                fms2 = [row[:2] for row in liste_formations()]
                 if not fms2:
                     st.info(t(
                         "Créez d'abord une formation avant d'ajouter un chapitre.",
@@ -637,32 +837,28 @@ def main():
                             ch_content = path
                     if st.button(t("Ajouter","Add","Agregar"), key="add2_ch_btn"):
                         if ch_title and ch_content:
-                            cur_form.execute(
-                                "SELECT COUNT(*) FROM chapitres WHERE formation_id=? AND titre=?",
-                                (fid2, ch_title)
-                            )
-                            if cur_form.fetchone()[0] > 0:
+                            if any(ch[1] == ch_title for ch in liste_chapitres(fid2)):
                                 st.error(t("Chapitre déjà existant.","Chapter already exists.","Capítulo ya existe."))
                             else:
                                 cur_form.execute(
                                     "INSERT INTO chapitres(formation_id,titre,type_contenu,contenu,ordre) VALUES(?,?,?,?,?)",
                                     (fid2, ch_title, ch_type, ch_content, ch_order)
                                 )
+                                nouveau_cid = cur_form.lastrowid
+                                cur_form.execute("UPDATE formations SET revision=revision+1 WHERE id=?", (fid2,))
                                 conn_form.commit()
+                                cache.invalider("formations", "chapitres")
                                 # À chaque ajout de chapitre, on réinitialise indicateurs de cette formation
-                                cur_prog.execute("DELETE FROM progress WHERE formation_id=?", (fid2,))
-                                conn_prog.commit()
-                                cur_test.execute("DELETE FROM tests WHERE formation_id=?", (fid2,))
-                                conn_test.commit()
-                                st.success(t("Chapitre ajouté ✅ — indicateurs réinitialisés","Chapter added ✅ — metrics reset","Capítulo agregado ✅ — indicadores reiniciados"))
-                                time.sleep(1)
+                                jobs.lancer("reinitialiser_indicateurs", {"formation_id": fid2})
+                                jobs.lancer("indexer_chapitres", {"chapter_ids": [nouveau_cid]})
+                                invalider_stats()
+                                flash(t("Chapitre ajouté ✅ — indicateurs réinitialisés","Chapter added ✅ — metrics reset","Capítulo agregado ✅ — indicadores reiniciados"))
                                 st.rerun()
                         else:
                             st.warning(t("Remplissez tous les champs.","Fill all fields.","Complete todos los campos."))
                     st.markdown("---")
                     st.subheader(t(" Modifier /  Supprimer un chapitre"," Edit /  Delete Chapter"," Editar /  Eliminar Capítulo"))
-                    cur_form.execute("SELECT id, titre, type_contenu, contenu, ordre FROM chapitres WHERE formation_id=? ORDER BY ordre", (fid2,))
-                    chap_list = cur_form.fetchall()
+                    chap_list = liste_chapitres(fid2)
                     if chap_list:
                         opts = [f"{ordr} – {tit}" for (_, tit, _, _, ordr) in chap_list]
                         sel3 = st.selectbox(t("Chapitre","Chapter","Capítulo"), opts, key="mod2_ch_select")
@@ -700,33 +896,32 @@ def main():
                                     "UPDATE chapitres SET titre=?, type_contenu=?, contenu=?, ordre=? WHERE id=?",
                                     (new_t3, new_type3, new_cont3, new_ord3, cid3)
                                 )
+                                cur_form.execute("UPDATE formations SET revision=revision+1 WHERE id=?", (fid2,))
                                 conn_form.commit()
+                                cache.invalider("formations", "chapitres")
                                 # À chaque modification de chapitre, on réinitialise indicateurs de cette formation
-                                cur_prog.execute("DELETE FROM progress WHERE formation_id=?", (fid2,))
-                                conn_prog.commit()
-                                cur_test.execute("DELETE FROM tests WHERE formation_id=?", (fid2,))
-                                conn_test.commit()
-                                st.success(t("Chapitre modifié ✅ — indicateurs réinitialisés","Chapter updated ✅ — metrics reset","Capítulo actualizado ✅ — indicadores reiniciados"))
-                                time.sleep(1)
+                                jobs.lancer("reinitialiser_indicateurs", {"formation_id": fid2})
+                                jobs.lancer("indexer_chapitres", {"chapter_ids": [cid3]})
+                                invalider_stats()
+                                flash(t("Chapitre modifié ✅ — indicateurs réinitialisés","Chapter updated ✅ — metrics reset","Capítulo actualizado ✅ — indicadores reiniciados"))
                                 st.rerun()
                         with c2:
                             if st.button(t("Supprimer","Delete","Eliminar"), key="del2_ch_btn"):
                                 cur_form.execute("DELETE FROM chapitres WHERE id=?", (cid3,))
+                                cur_form.execute("UPDATE formations SET revision=revision+1 WHERE id=?", (fid2,))
                                 conn_form.commit()
+                                cache.invalider("formations", "chapitres")
                                 # À chaque suppression de chapitre, on réinitialise indicateurs de cette formation
-                                cur_prog.execute("DELETE FROM progress WHERE formation_id=?", (fid2,))
-                                conn_prog.commit()
-                                cur_test.execute("DELETE FROM tests WHERE formation_id=?", (fid2,))
-                                conn_test.commit()
-                                st.warning(t("Chapitre supprimé  — indicateurs réinitialisés","Chapter deleted  — metrics reset","Capítulo eliminado  — indicadores reiniciados"))
-                                time.sleep(1)
+                                jobs.lancer("reinitialiser_indicateurs", {"formation_id": fid2})
+                                invalider_stats()
+                                flash(t("Chapitre supprimé  — indicateurs réinitialisés","Chapter deleted  — metrics reset","Capítulo eliminado  — indicadores reiniciados"), "warning")
                                 st.rerun()
                     else:
                         st.info(t("Aucun chapitre à modifier.","No chapter to modify.","Ningún capítulo para modificar."))
             else:
                 # --- Ajouter une question de test ---
                 st.subheader(t(" Ajouter une question de test"," Add Test Question"," Agregar Pregunta de Prueba"))
-                fms = cur_form.execute("SELECT id, titre FROM formations").fetchall()
+                fms = [row[:2] for row in liste_formations()]
                 if not fms:
                     st.info(t("Créez d'abord une formation.","Please create a training first.","Por favor cree una formación primero."))
                 else:
@@ -746,19 +941,42 @@ def main():
                         c_opt = st.checkbox(t("Correct?","Correct?","¿Correcta?"), key=f"opt_corr_{i}")
                         opts.append(t_opt)
                         corrs.append(c_opt)
+                    # Options laissées vides : ignorées ; il en faut au moins deux
+                    remplies = [(t_opt.strip(), c_opt) for t_opt, c_opt in zip(opts, corrs) if t_opt.strip()]
                     if st.button(t("Ajouter","Add","Agregar"), key="add_q_btn"):
-                        cur_test.execute(
-                            "INSERT INTO questions(formation_id, question_text, allow_multiple) VALUES(?,?,?)",
-                            (fid_test, q_text, int(allow_multi))
-                        )
-                        qid = cur_test.lastrowid
-                        for t_opt, c_opt in zip(opts, corrs):
+                        if not q_text.strip() or len(remplies) < 2:
+                            st.error(t("Saisissez la question et au moins deux options.",
+                                       "Enter the question and at least two options.",
+                                       "Ingrese la pregunta y al menos dos opciones."))
+                        else:
                             cur_test.execute(
-                                "INSERT INTO options(question_id, option_text, is_correct) VALUES(?,?,?)",
-                                (qid, t_opt, int(c_opt))
+                                "INSERT INTO questions(formation_id, question_text, allow_multiple) VALUES(?,?,?)",
+                                (fid_test, q_text, int(allow_multi))
                             )
-                        conn_test.commit()
-                        st.success(t("Question ajoutée ✅","Question added ✅","Pregunta agregada ✅"))
+                            qid = cur_test.lastrowid
+                            for t_opt, c_opt in remplies:
+                                cur_test.execute(
+                                    "INSERT INTO options(question_id, option_text, is_correct) VALUES(?,?,?)",
+                                    (qid, t_opt, int(c_opt))
+                                )
+                            conn_test.commit()
+                            cache.invalider("questions")
+                            st.success(t("Question ajoutée ✅","Question added ✅","Pregunta agregada ✅"))
+
+                st.markdown("---")
+                st.subheader(t(" Passage des tests"," Test delivery"," Realización de pruebas"))
+                par_page = st.number_input(
+                    t("Questions par page","Questions per page","Preguntas por página"),
+                    min_value=1, max_value=50, value=int(get_param("test_par_page", "10")), step=1, key="test_par_page"
+                )
+                nb_questions = st.number_input(
+                    t("Questions tirées au hasard (0 = toutes)","Random questions drawn (0 = all)","Preguntas al azar (0 = todas)"),
+                    min_value=0, value=int(get_param("test_nb_questions", "0")), step=1, key="test_nb_questions"
+                )
+                if st.button(t("💾 Sauvegarder","💾 Save","💾 Guardar"), key="save_test_params"):
+                    save_param("test_par_page", par_page)
+                    save_param("test_nb_questions", nb_questions)
+                    st.success(t("Paramètres sauvegardés!","Settings saved!","¡Ajustes guardados!"))
 
         # --- 4) Gestion Utilisateur ---
         with tabs[3]:
@@ -776,6 +994,12 @@ def main():
                     t("Rôle","Role","Rol"),
                     [t("Admin","Admin","Admin"), t("Employé","User","Usuario")]
                 )
+                # Site actuel pré-rempli : une modification de profil ne change pas la partition par mégarde
+                site_actuel = cur_users.execute(
+                    "SELECT COALESCE(site, '') FROM utilisateurs WHERE email = ?", (email_input.strip(),)
+                ).fetchone()
+                site_input = st.text_input(t("Site","Site","Sitio"), site_actuel[0] if site_actuel else "",
+                                           key=f"user_site_{email_input.strip().lower()}")
                 photo = st.file_uploader(t("Changer la photo de profil","Change profile photo","Cambiar foto de perfil"), type=["png","jpg","jpeg"])
             with col2:
                 genre = st.selectbox(
@@ -784,14 +1008,9 @@ def main():
                     key="update_genre"
                 )
                 if photo:
-                    st.image(photo, width=200)
+                    st.image(images.apercu(photo.getvalue(), 200), width=200)
                 else:
-                    img_url = (
-                        "https://img.freepik.com/vecteurs-libre/illustration-homme-affaires_53876-5856.jpg?w=740"
-                        if genre == t("Homme","Male","Hombre")
-                        else "https://img.freepik.com/vecteurs-libre/illustration-femme-affaires_53876-5857.jpg?w=740"
-                    )
-                    st.image(img_url, width=200)
+                    st.image(images.avatar(genre == t("Homme","Male","Hombre")), width=200)
 
                 if st.button(t("Mettre à jour","Update","Actualizar"), key="update_user"):
                     if not all([
@@ -810,23 +1029,21 @@ def main():
                     else:
                         photo_path = None
                         if photo:
-                            os.makedirs("user_photos", exist_ok=True)
-                            path = os.path.join("user_photos", photo.name)
-                            with open(path, "wb") as f:
-                                f.write(photo.read())
-                            photo_path = path
+                            photo_path = images.enregistrer_photo(photo.getvalue(), email_input)
+                        ancienne_cle = partitions.cle_partition(email_input)
 
                         cur_users.execute("""
                             INSERT INTO utilisateurs(
-                                email, mot_de_passe, nom, prenom, fonction, genre, photo_path
-                            ) VALUES(?,?,?,?,?,?,?)
+                                email, mot_de_passe, nom, prenom, fonction, genre, photo_path, site
+                            ) VALUES(?,?,?,?,?,?,?,?)
                             ON CONFLICT(email) DO UPDATE SET
                                 mot_de_passe=excluded.mot_de_passe,
                                 nom=excluded.nom,
                                 prenom=excluded.prenom,
                                 fonction=excluded.fonction,
                                 genre=excluded.genre,
-                                photo_path=excluded.photo_path
+                                photo_path=excluded.photo_path,
+                                site=excluded.site
                         """, (
                             email_input,
                             mot_de_passe,
@@ -834,10 +1051,15 @@ def main():
                             prenom,
                             role_input,
                             genre,
-                            photo_path
+                            photo_path,
+                            site_input.strip()
                         ))
                         conn_users.commit()
-                        st.success(t("Profil mis à jour ✅","Profile updated ✅","Perfil actualizado ✅"))
+                        cache.invalider("utilisateurs")
+                        # Nouveau site : progressions et tests suivent l'utilisateur dans sa partition
+                        if partitions.deplacer_utilisateur(email_input, ancienne_cle):
+                            invalider_stats(email_input)
+                        flash(t("Profil mis à jour ✅","Profile updated ✅","Perfil actualizado ✅"))
                         st.rerun()
 
             # — Tableau & suppression —
@@ -861,7 +1083,11 @@ def main():
                 st.subheader(t("📋 Liste des utilisateurs","📋 User List","📋 Lista Usuarios"))
                 col_table, col_delete = st.columns([3, 1])
                 with col_table:
-                    st.dataframe(df_users, use_container_width=True, hide_index=True)
+                    df_users["Photo"] = df_users["Photo"].map(images.data_uri)
+                    st.dataframe(
+                        df_users, use_container_width=True, hide_index=True,
+                        column_config={"Photo": st.column_config.ImageColumn("Photo", width="small")}
+                    )
                 with col_delete:
                     st.subheader(t(" Supprimer un utilisateur"," Delete a user"," Eliminar usuario"))
                     email_to_delete = st.selectbox(
@@ -875,11 +1101,12 @@ def main():
                             (email_to_delete,)
                         )
                         conn_users.commit()
-                        st.success(t(
+                        cache.invalider("utilisateurs")
+                        flash(t(
                             f"Utilisateur {email_to_delete} supprimé ✅",
                             f"User {email_to_delete} deleted ✅",
                             f"Usuario {email_to_delete} eliminado ✅"
-                        ))
+                        ), "warning")
                         st.rerun()
             else:
                 st.info(t("Aucun utilisateur enregistré.","No users recorded.","No hay usuarios registrados."))
@@ -899,7 +1126,10 @@ def main():
                     index=["Français","English","Español"].index(st.session_state.lang)
                 )
                 search = st.text_input(t(" Recherche"," Search"," Buscar"), key="search_param")
-                if search.strip():
+                resultats = recherche.rechercher(conn_form, search, limite=5) if search.strip() else []
+                if resultats:
+                    afficher_resultats_recherche(resultats)
+                elif search.strip():
                     q = search.lower()
                     if "formation" in q:
                         st.info(t("Onglet Parcourir Formation","Browse Training tab","Pestaña Navegar Formación"))
@@ -911,9 +1141,9 @@ def main():
                         st.warning(t("Aucun résultat.","No result.","Ningún resultado."))
 
                 st.markdown("### " + t("Notifications","Notifications","Notificaciones"))
-                notif_form = st.checkbox(t("Formations","Trainings","Formaciones"), value=(get_param("notif_form","True")=="True"))
-                notif_test = st.checkbox(t("Tests","Tests","Pruebas"), value=(get_param("notif_test","True")=="True"))
-                notif_cert = st.checkbox(t("Certificats","Certificates","Certificados"), value=(get_param("notif_cert","True")=="True"))
+                notif_form = st.checkbox(t("Formations","Trainings","Formaciones"), value=parametres.get(user_email, "notif_form", True))
+                notif_test = st.checkbox(t("Tests","Tests","Pruebas"), value=parametres.get(user_email, "notif_test", True))
+                notif_cert = st.checkbox(t("Certificats","Certificates","Certificados"), value=parametres.get(user_email, "notif_cert", True))
 
                 if st.button(t("💾 Sauvegarder","💾 Save","💾 Guardar")):
                     if ancien and nouveau:
@@ -924,12 +1154,10 @@ def main():
                             st.success(t("Mot de passe mis à jour.","Password updated.","Contraseña actualizada."))
                         else:
                             st.error(t("Ancien mot de passe incorrect.","Old password incorrect.","Contraseña antigua incorrecta."))
-                    save_param("notif_form", notif_form)
-                    save_param("notif_test", notif_test)
-                    save_param("notif_cert", notif_cert)
-                    if lang != st.session_state.lang:
-                        st.session_state.lang = lang
-                        save_param("lang", lang)
+                    parametres.enregistrer(user_email, {
+                        "lang": lang, "notif_form": notif_form, "notif_test": notif_test, "notif_cert": notif_cert
+                    })
+                    st.session_state.lang = lang
                     st.success(t("Paramètres sauvegardés!","Settings saved!","¡Ajustes guardados!"))
 
             st.title(t("❔ À propos & Aide","❔ About & Help","❔ Acerca & Ayuda"))
@@ -972,127 +1200,56 @@ def main():
                 unsafe_allow_html=True
             )
 
-            # KPI calculations
-            total_form = cur_form.execute("SELECT COUNT(*) FROM formations").fetchone()[0]
-            total_emp = cur_emp.execute("SELECT COUNT(*) FROM employes").fetchone()[0]
-            total_usr = cur_users.execute("SELECT COUNT(*) FROM utilisateurs").fetchone()[0]
-            total_chap = cur_form.execute("SELECT COUNT(*) FROM chapitres").fetchone()[0]
-            total_prog = cur_prog.execute("SELECT COUNT(*) FROM progress").fetchone()[0]
-            total_tests = cur_test.execute("SELECT COUNT(*) FROM tests").fetchone()[0]
-            passed_tests = cur_test.execute("SELECT COUNT(*) FROM tests WHERE passed=1").fetchone()[0]
-            failed_tests = total_tests - passed_tests
-            global_rate = int(passed_tests / total_tests * 100) if total_tests > 0 else 0
-            active_emp = cur_prog.execute("SELECT COUNT(DISTINCT email) FROM progress").fetchone()[0]
-            active_rate = int(active_emp / total_emp * 100) if total_emp > 0 else 0
-            passed_emp = cur_test.execute("SELECT COUNT(DISTINCT email) FROM tests WHERE passed=1").fetchone()[0]
-            passed_emp_rate = int(passed_emp / total_emp * 100) if total_emp > 0 else 0
-
-            df_monthly = pd.DataFrame(
-                cur_form.execute(
-                    "SELECT substr(date,1,7) AS mois, COUNT(*) AS n FROM formations GROUP BY mois ORDER BY mois"
-                ).fetchall(),
-                columns=["mois","n"]
-            )
-            df_by_role = pd.DataFrame(
-                cur_emp.execute("SELECT fonction, COUNT(*) AS n FROM employes GROUP BY fonction").fetchall(),
-                columns=["fonction","n"]
+            # Source des données : instantané ou lecture seule, jamais les connexions des apprenants
+            with st.expander(t("⚙️ Source des données","⚙️ Data source","⚙️ Fuente de datos")):
+                modes_a = {"instantane": t("Instantané périodique","Periodic snapshot","Instantánea periódica"),
+                           "direct": t("Direct (lecture seule)","Live (read-only)","Directo (solo lectura)")}
+                col_m, col_i = st.columns(2)
+                mode_a = col_m.radio(t("Mode","Mode","Modo"), list(modes_a), format_func=modes_a.get,
+                                     index=list(modes_a).index(analytique.mode()), key="analytique_mode")
+                intervalle_a = col_i.number_input(t("Rafraîchir toutes les (s)","Refresh every (s)","Actualizar cada (s)"),
+                                                  min_value=30, step=30, value=analytique.intervalle(), key="analytique_intervalle")
+                col_s, col_r = st.columns(2)
+                if col_s.button(t("💾 Enregistrer","💾 Save","💾 Guardar"), key="analytique_save"):
+                    save_param("analytique_mode", mode_a)
+                    save_param("analytique_intervalle", int(intervalle_a))
+                    st.success(t("Paramètres sauvegardés !","Settings saved!","¡Configuración guardada!"))
+                if col_r.button(t("🔄 Rafraîchir maintenant","🔄 Refresh now","🔄 Actualizar ahora"), key="analytique_refresh",
+                                disabled=analytique.mode() == "direct"):
+                    analytique.rafraichir()
+            mode_a, donnees_du = analytique.fraicheur()
+            st.caption(
+                (t("Instantané du","Snapshot of","Instantánea del") if mode_a != "direct"
+                 else t("Données en direct,","Live data,","Datos en directo,"))
+                + " " + datetime.fromtimestamp(donnees_du).strftime("%d/%m/%Y %H:%M:%S")
             )
-            df_test_rate = pd.DataFrame([
-                { "cat": t("Passés","Passed","Aprobados"), "n": passed_tests },
-                { "cat": t("Échoués","Failed","Fallidos"), "n": failed_tests }
-            ])
-            df_active = pd.DataFrame([
-                { "cat": t("Actifs","Active","Activos"), "n": active_emp },
-                { "cat": t("Inactifs","Inactive","Inactivos"), "n": total_emp - active_emp }
-            ])
-            df_passed_emp = pd.DataFrame([
-                { "cat": t("Ont testé","Tested","Probados"), "n": passed_emp },
-                { "cat": t("Non testés","Untested","Sin probar"), "n": total_emp - passed_emp }
-            ])
 
+            # Indicateurs et graphiques agrégés côté serveur, en cache par version des données (tableau_de_bord.py)
+            kpi = tableau_de_bord.donnees()
+            graphiques = tableau_de_bord.specs(st.session_state.lang, t)
+            taux = lambda n, d: f"{int(n / d * 100) if d > 0 else 0}%"
             items = [
-                {
-                    "title": t("Formations","Trainings","Formaciones"),
-                    "value": total_form,
-                    "chart_title": t("Formations mensuelles","Monthly trainings","Form mens."),
-                    "chart": alt.Chart(df_monthly)
-                                .mark_line(color="#2E4053", interpolate="monotone", strokeWidth=3)
-                                .encode(x="mois:T", y="n:Q")
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Employés","Employees","Empleados"),
-                    "value": total_emp,
-                    "chart_title": t("Employés par rôle","Employees by role","Empleados por rol"),
-                    "chart": alt.Chart(df_by_role)
-                                .mark_bar(color="#2E4053", cornerRadiusTopLeft=3, cornerRadiusTopRight=3)
-                                .encode(x=alt.X("fonction:N", sort="-y"), y="n:Q")
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Utilisateurs","Users","Usuarios"),
-                    "value": total_usr,
-                    "chart_title": t("Évolution utilisateurs","User growth","Crecimiento usr"),
-                    "chart": alt.Chart(df_monthly)
-                                .mark_area(opacity=0.3, color="#2E4053")
-                                .encode(x="mois:T", y="n:Q")
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Chapitres","Chapters","Capítulos"),
-                    "value": total_chap,
-                    "chart_title": t("Chapitres par rôle","Chapters by role","Capítulos por rol"),
-                    "chart": alt.Chart(df_by_role)
-                                .mark_circle(size=100, color="#2E4053")
-                                .encode(x="fonction:N", y="n:Q")
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Progressions","Progress","Progresos"),
-                    "value": total_prog,
-                    "chart_title": t("Progression mensuelle","Monthly progress","Progreso mens."),
-                    "chart": alt.Chart(df_monthly)
-                                .mark_bar(opacity=0.5, color="#2E4053")
-                                .encode(x="mois:T", y="n:Q")
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Succès tests","Test success","Éxito pruebas"),
-                    "value": f"{global_rate}%",
-                    "chart_title": t("Réussite vs échec","Success vs Failure","Éxito vs Falla"),
-                    "chart": alt.Chart(df_test_rate)
-                                .mark_arc(innerRadius=50, outerRadius=100)
-                                .encode(theta="n:Q", color=alt.Color("cat:N", legend=None))
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Taux actifs","Active rate","Tasa activos"),
-                    "value": f"{active_rate}%",
-                    "chart_title": t("Actifs vs inactifs","Active vs Inactive","Activos vs Inact."),
-                    "chart": alt.Chart(df_active)
-                                .mark_arc(innerRadius=50, outerRadius=100)
-                                .encode(theta="n:Q", color=alt.Color("cat:N", legend=None))
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Taux test-passed","Passed rate","Tasa aprobados"),
-                    "value": f"{passed_emp_rate}%",
-                    "chart_title": t("Passé vs non-passé","Passed vs Untested","Aprob. vs Sin"),
-                    "chart": alt.Chart(df_passed_emp)
-                                .mark_arc(innerRadius=50, outerRadius=100)
-                                .encode(theta="n:Q", color=alt.Color("cat:N", legend=None))
-                                .properties(width=250, height=250)
-                },
-                {
-                    "title": t("Tests totaux","Total tests","Total pruebas"),
-                    "value": total_tests,
-                    "chart_title": t("Répartition tests","Test breakdown","Desglose pruebas"),
-                    "chart": alt.Chart(df_test_rate)
-                                .mark_bar(color="#2E4053")
-                                .encode(x=alt.X("cat:N", title=None), y="n:Q")
-                                .properties(width=250, height=250)
-                },
+                {"title": t("Formations","Trainings","Formaciones"), "value": kpi["formations"],
+                 "chart_title": t("Formations mensuelles","Monthly trainings","Form mens.")},
+                {"title": t("Employés","Employees","Empleados"), "value": kpi["employes"],
+                 "chart_title": t("Employés par rôle","Employees by role","Empleados por rol")},
+                {"title": t("Utilisateurs","Users","Usuarios"), "value": kpi["utilisateurs"],
+                 "chart_title": t("Utilisateurs par rôle","Users by role","Usuarios por rol")},
+                {"title": t("Chapitres","Chapters","Capítulos"), "value": kpi["chapitres"],
+                 "chart_title": t("Chapitres par type","Chapters by type","Capítulos por tipo")},
+                {"title": t("Progressions","Progress","Progresos"), "value": kpi["progressions"],
+                 "chart_title": t("Lectures mensuelles","Monthly reads","Lecturas mens.")},
+                {"title": t("Succès tests","Test success","Éxito pruebas"), "value": taux(kpi["reussis"], kpi["tests"]),
+                 "chart_title": t("Réussite vs échec","Success vs Failure","Éxito vs Falla")},
+                {"title": t("Taux actifs","Active rate","Tasa activos"), "value": taux(kpi["actifs"], kpi["employes"]),
+                 "chart_title": t("Actifs vs inactifs","Active vs Inactive","Activos vs Inact.")},
+                {"title": t("Taux test-passed","Passed rate","Tasa aprobados"), "value": taux(kpi["employes_reussis"], kpi["employes"]),
+                 "chart_title": t("Réussi vs non réussi","Passed vs Not passed","Aprob. vs Sin")},
+                {"title": t("Tests totaux","Total tests","Total pruebas"), "value": kpi["tests"],
+                 "chart_title": t("Tentatives mensuelles","Monthly attempts","Intentos mensuales")},
             ]
+            for item, spec in zip(items, graphiques):
+                item["chart"] = spec
 
             for i in range(0, 9, 3):
                 cols = st.columns(3, gap="large")
@@ -1105,161 +1262,284 @@ def main():
                         </div>
                         """, unsafe_allow_html=True)
                         st.markdown(f"<div class='chart-title'>{item['chart_title']}</div>", unsafe_allow_html=True)
-                        st.altair_chart(item["chart"], use_container_width=False)
+                        st.vega_lite_chart(item["chart"], use_container_width=False)
 
             st.markdown("</div>", unsafe_allow_html=True)
 
+        # --- 7) Tâches de fond ---
+        with tabs[6]:
+            st.markdown(
+                f"<h1 style='text-align:center;font-size:28px; margin:0px;padding:0px'>{t('🧵 Tâches de fond','🧵 Background jobs','🧵 Tareas en segundo plano')}</h1>",
+                unsafe_allow_html=True
+            )
+            nb_workers = jobs.workers_actifs()
+            if nb_workers:
+                st.success(t(f"{nb_workers} worker(s) actif(s)",f"{nb_workers} active worker(s)",f"{nb_workers} worker(s) activo(s)"))
+            else:
+                st.warning(t(
+                    "Aucun worker actif : les tâches s'exécutent dans la session (lancer `python jobs.py`).",
+                    "No active worker: jobs run inside the session (start `python jobs.py`).",
+                    "Ningún worker activo: las tareas se ejecutan en la sesión (iniciar `python jobs.py`)."
+                ))
+            resume_jobs = jobs.resume()
+            cols = st.columns(4)
+            for col, (statut, libelle) in zip(cols, [
+                ("en_attente", t("En attente","Queued","En espera")),
+                ("en_cours", t("En cours","Running","En curso")),
+                ("termine", t("Terminées","Done","Terminadas")),
+                ("echec", t("En échec","Failed","Fallidas")),
+            ]):
+                col.metric(libelle, resume_jobs.get(statut, 0))
+            df_jobs = pd.DataFrame(
+                jobs.dernieres(),
+                columns=["id", "type", t("Statut","Status","Estado"), t("Essais","Attempts","Intentos"),
+                         t("Créée","Created","Creada"), t("Mise à jour","Updated","Actualizada"), "worker",
+                         t("Erreur","Error","Error")]
+            )
+            if not df_jobs.empty:
+                st.dataframe(df_jobs, use_container_width=True, hide_index=True)
+                en_echec = df_jobs[df_jobs[t("Statut","Status","Estado")] == "echec"]["id"].tolist()
+                if en_echec:
+                    job_sel = st.selectbox(t("Tâche en échec","Failed job","Tarea fallida"), en_echec, key="job_relance")
+                    if st.button(t("🔁 Relancer","🔁 Retry","🔁 Reintentar"), key="job_relance_btn"):
+                        jobs.relancer(job_sel)
+                        st.rerun()
+            else:
+                st.info(t("Aucune tâche enregistrée.","No jobs recorded.","No hay tareas registradas."))
+            if st.button(t("🗄️ Archiver les données froides","🗄️ Archive cold data","🗄️ Archivar datos fríos"), key="job_archiver"):
+                jobs.lancer("archiver", {"horizon_jours": int(get_param("archive_horizon", "365"))})
+                st.success(t("Archivage programmé.","Archiving scheduled.","Archivado programado."))
+            a_indexer = recherche.a_indexer(conn_form)
+            if a_indexer:
+                st.info(t(f"{a_indexer} chapitre(s) hors de l'index de recherche.",
+                          f"{a_indexer} chapter(s) missing from the search index.",
+                          f"{a_indexer} capítulo(s) fuera del índice de búsqueda."))
+            erreurs_index = recherche.erreurs(conn_form)
+            if erreurs_index:
+                st.warning(t(f"Texte non extrait pour {len(erreurs_index)} chapitre(s), indexé(s) par leur titre seulement :",
+                             f"Text not extracted for {len(erreurs_index)} chapter(s), indexed by title only:",
+                             f"Texto no extraído para {len(erreurs_index)} capítulo(s), indexado(s) solo por su título:"))
+                st.dataframe(pd.DataFrame(erreurs_index, columns=["id", t("Chapitre","Chapter","Capítulo"), t("Erreur","Error","Error")]),
+                             use_container_width=True, hide_index=True)
+            if st.button(t("🔎 Mettre à jour l'index de recherche","🔎 Update search index","🔎 Actualizar índice de búsqueda"), key="job_indexer"):
+                jobs.lancer("indexer_chapitres")
+                st.success(t("Indexation programmée.","Indexing scheduled.","Indexación programada."))
+            if st.button(t("⭐ Recalculer les recommandations","⭐ Refresh recommendations","⭐ Recalcular recomendaciones"), key="job_reco"):
+                jobs.lancer("recommandations")
+                st.success(t("Recalcul programmé.","Refresh scheduled.","Recálculo programado."))
+
+            st.subheader(t("💾 Sauvegardes","💾 Backups","💾 Copias de seguridad"))
+            retard = None if nb_workers else sauvegarde.en_retard()
+            if retard is not None:
+                heures = "∞" if retard == float("inf") else round(retard / 3600, 1)
+                st.warning(t(
+                    f"Sauvegardes planifiées à l'arrêt faute de worker (dernière : il y a {heures} h).",
+                    f"Scheduled backups stalled, no worker running (last one: {heures} h ago).",
+                    f"Copias programadas detenidas sin worker (última: hace {heures} h)."
+                ))
+            jeux = sauvegarde.liste()
+            if jeux:
+                lignes_jeux = []
+                for nom_jeu in jeux:
+                    m = sauvegarde.manifest(nom_jeu)
+                    lignes_jeux.append((
+                        datetime.fromtimestamp(m["cree_le"]).strftime("%d/%m/%Y %H:%M"), nom_jeu, len(m["fichiers"]),
+                        round(sum(f["taille"] for f in m["fichiers"].values()) / 1e6, 1),
+                        round(sum(f["secondes"] for f in m["fichiers"].values()), 1),
+                    ))
+                st.dataframe(
+                    pd.DataFrame(lignes_jeux, columns=[t("Date","Date","Fecha"), t("Jeu","Set","Juego"), t("Bases","Databases","Bases"), "Mo", t("Durée (s)","Duration (s)","Duración (s)")]),
+                    use_container_width=True, hide_index=True
+                )
+            else:
+                st.info(t("Aucune sauvegarde pour l'instant.","No backup yet.","Ninguna copia por ahora."))
+            if st.button(t("💾 Sauvegarder maintenant","💾 Back up now","💾 Copiar ahora"), key="job_sauvegarde"):
+                jobs.lancer("sauvegarde")
+                st.success(t("Sauvegarde programmée.","Backup scheduled.","Copia programada."))
+
+            # Profilage mémoire (tracemalloc) : coûteux, activé à la demande (memoire.py)
+            st.subheader(t("🧠 Mémoire","🧠 Memory","🧠 Memoria"))
+            profilage = st.toggle(t("Profilage mémoire (tracemalloc)","Memory profiling (tracemalloc)","Perfilado de memoria (tracemalloc)"),
+                                  value=memoire.actif(), key="memoire_profilage")
+            if profilage != memoire.actif():
+                save_param("memoire_profilage", profilage)
+                st.rerun()
+            vivantes = profilage and st.checkbox(
+                t("Inclure les allocations vivantes (instantané complet, lent)","Include live allocations (full snapshot, slow)","Incluir asignaciones vivas (instantánea completa, lenta)"),
+                key="memoire_vivantes")
+            etat_memoire = memoire.rapport(vivantes)
+            mo = lambda n: round(n / 1e6, 2) if n is not None else None
+            cols = st.columns(4)
+            cols[0].metric(t("RSS (Mo)","RSS (MB)","RSS (MB)"), mo(etat_memoire["rss"]))
+            cols[1].metric(t("Pic RSS (Mo)","Peak RSS (MB)","Pico RSS (MB)"), mo(etat_memoire["rss_pic"]))
+            cols[2].metric(t("Tracé (Mo)","Traced (MB)","Trazado (MB)"), mo(etat_memoire["trace"]))
+            cols[3].metric(t("Pic tracé (Mo)","Traced peak (MB)","Pico trazado (MB)"), mo(etat_memoire["trace_pic"]))
+            if etat_memoire["actif"]:
+                if etat_memoire["sessions"]:
+                    st.caption(t("Sessions (taille estimée de st.session_state)","Sessions (estimated st.session_state size)","Sesiones (tamaño estimado de st.session_state)"))
+                    st.dataframe(pd.DataFrame([
+                        (s["email"], s["reruns"], mo(s["etat"]), mo(s["etat_max"]), mo(s["rerun_octets"]), s["duree_ms"],
+                         datetime.fromtimestamp(s["derniere"]).strftime("%H:%M:%S"))
+                        for s in etat_memoire["sessions"]
+                    ], columns=["email", "reruns", t("État (Mo)","State (MB)","Estado (MB)"), t("État max (Mo)","Max state (MB)","Estado máx (MB)"),
+                                t("Dernier rerun (Mo)","Last rerun (MB)","Último rerun (MB)"), "ms", t("Vu à","Seen at","Visto a las")]),
+                        use_container_width=True, hide_index=True)
+                if etat_memoire["onglets"]:
+                    st.caption(t("Onglets (mémoire allouée pendant le rendu)","Tabs (memory allocated while rendering)","Pestañas (memoria asignada durante el renderizado)"))
+                    st.dataframe(pd.DataFrame([
+                        (o["onglet"], o["rendus"], mo(o["retenu"]), mo(o["pic_max"])) for o in etat_memoire["onglets"]
+                    ], columns=[t("Onglet","Tab","Pestaña"), t("Rendus","Renders","Renderizados"),
+                                t("Retenu (Mo)","Retained (MB)","Retenido (MB)"), t("Pic (Mo)","Peak (MB)","Pico (MB)")]),
+                        use_container_width=True, hide_index=True)
+                st.caption(t("Lignes qui allouent le plus par rerun","Top allocating lines per rerun","Líneas que más asignan por rerun"))
+                st.dataframe(pd.DataFrame(etat_memoire["lignes_rerun"], columns=["ligne", "reruns", "octets", "max"]),
+                             use_container_width=True, hide_index=True)
+                if vivantes:
+                    st.caption(t("Lignes qui retiennent le plus de mémoire","Lines retaining the most memory","Líneas que retienen más memoria"))
+                    st.dataframe(pd.DataFrame(etat_memoire["lignes_vivantes"], columns=["ligne", "octets", "blocs"]),
+                                 use_container_width=True, hide_index=True)
+            st.download_button(t("⬇️ Rapport JSON","⬇️ JSON report","⬇️ Informe JSON"),
+                               json.dumps(etat_memoire, ensure_ascii=False, indent=2),
+                               file_name=f"memoire_{int(time.time())}.json", mime="application/json", key="memoire_json")
+
+        # --- 8) Parcours : entonnoir d'abandon par chapitre ---
+        with tabs[7]:
+            st.markdown(
+                f"<h1 style='text-align:center;font-size:28px; margin:0px;padding:0px'>{t('🔻 Parcours des apprenants','🔻 Learner drop-off','🔻 Recorrido de los alumnos')}</h1>",
+                unsafe_allow_html=True
+            )
+            fms_p = [row[:2] for row in liste_formations()]
+            if not fms_p:
+                st.info(t("Aucune formation.","No training.","Ninguna formación."))
+            else:
+                titres_p = {titre: fid for fid, titre in fms_p}
+                sel_p = st.selectbox(t("Formation","Training","Formación"), list(titres_p), key="parcours_form")
+                if st.button(t("🔄 Recalculer","🔄 Recompute","🔄 Recalcular"), key="parcours_refresh"):
+                    entonnoir.invalider()
+                calcule_le, analyses = entonnoir.analyses()
+                st.caption(t("Calculé le","Computed at","Calculado el") + " " + datetime.fromtimestamp(calcule_le).strftime("%d/%m/%Y %H:%M"))
+                analyse = analyses.get(titres_p[sel_p])
+                if analyse is None or analyse["entonnoir"]["atteints"].sum() == 0:
+                    st.info(t("Aucune lecture enregistrée pour cette formation.","No reads recorded for this training.","Ninguna lectura registrada para esta formación."))
+                else:
+                    ent = analyse["entonnoir"].assign(chapitre=lambda d: d["ordre"].astype(str) + " – " + d["titre"])
+                    st.subheader(t("Apprenants ayant atteint chaque chapitre","Learners reaching each chapter","Alumnos que alcanzaron cada capítulo"))
+                    st.altair_chart(
+                        alt.Chart(ent).mark_bar(color="#2E4053").encode(
+                            x=alt.X("atteints:Q", title=t("Apprenants","Learners","Alumnos")),
+                            y=alt.Y("chapitre:N", sort=None, title=None),
+                            tooltip=["chapitre", "atteints", "lus", alt.Tooltip("part:Q", format=".0%")]
+                        ),
+                        use_container_width=True
+                    )
+                    dl = analyse["delais"].assign(chapitre=ent["chapitre"]).dropna(subset=["minutes_mediane"])
+                    if not dl.empty:
+                        st.subheader(t("Délai médian avant chaque chapitre (minutes)","Median time before each chapter (minutes)","Tiempo mediano antes de cada capítulo (minutos)"))
+                        st.altair_chart(
+                            alt.Chart(dl).mark_bar(color="#2c6e49").encode(
+                                x=alt.X("minutes_mediane:Q", title="minutes"),
+                                y=alt.Y("chapitre:N", sort=None, title=None),
+                                tooltip=["chapitre", alt.Tooltip("minutes_mediane:Q", format=".1f")]
+                            ),
+                            use_container_width=True
+                        )
+                    carte = analyse["carte"].assign(chapitre=lambda d: d["ordre"].astype(str) + " – " + d["titre"])
+                    st.subheader(t("Lectures par chapitre et par semaine","Reads per chapter and week","Lecturas por capítulo y semana"))
+                    st.altair_chart(
+                        alt.Chart(carte).mark_rect().encode(
+                            x=alt.X("yearmonthdate(semaine):O", title=t("Semaine","Week","Semana")),
+                            y=alt.Y("chapitre:N", sort=alt.EncodingSortField("ordre", op="min"), title=None),
+                            color=alt.Color("lectures:Q", scale=alt.Scale(scheme="greens")),
+                            tooltip=["chapitre", alt.Tooltip("semaine:T", format="%d/%m/%Y"), "lectures"]
+                        ),
+                        use_container_width=True
+                    )
+
     # ------------------------------------------------------------------------------------------------
     # 2️⃣ Utilisateur standard : Parcourir Formation, Passer le test, Mes certificats, Paramètres, Dashboard
     # ------------------------------------------------------------------------------------------------
     else:
+        # Formations réussies : une formation est débloquée quand tous ses prérequis (fermeture) le sont
+        reussies = {r[0] for r in cur_res.execute(
+            "SELECT formation_id FROM tests WHERE email = ? AND passed = 1", (user_email,)
+        )}
+        fermeture = fermeture_prerequis()
+        titres_formations = {fid: titre for fid, titre, *_ in liste_formations()}
+
         # --- Parcourir Formation ---
         with tabs[0]:
             st.header(t("🎓 Parcourir Formation", "🎓 Browse Training", "🎓 Navegar Formación"))
 
+            requete = st.text_input(
+                t("🔎 Rechercher dans les formations", "🔎 Search trainings", "🔎 Buscar en las formaciones"),
+                key="learner_search"
+            )
+            if requete.strip():
+                resultats = recherche.rechercher(conn_form, requete, limite=10)
+                if resultats:
+                    afficher_resultats_recherche(resultats, ouvrir=True)
+                else:
+                    st.info(t("Aucun résultat.", "No result.", "Ningún resultado."))
+                st.markdown("---")
+
+            # Recommandations précalculées (recommandations.py) : une lecture indexée, sans passer par
+            # cache.py (une entrée par apprenant en évincerait les données de référence)
+            commencees = frozenset(r[0] for r in cur_prog.execute(
+                "SELECT DISTINCT formation_id FROM progress WHERE email = ?", (user_email,)
+            )) | reussies
+            recos = recommandations.pour(conn_form, user_email, commencees)
+            if recos:
+                st.subheader(t("⭐ Recommandé pour vous", "⭐ Recommended for you", "⭐ Recomendado para ti"))
+                cols_reco = st.columns(len(recos))
+                for i, (col, (_rfid, rtitre)) in enumerate(zip(cols_reco, recos)):
+                    col.button(
+                        rtitre, key=f"reco_{i}", use_container_width=True,
+                        on_click=st.session_state.update, kwargs={"view_form": rtitre}
+                    )
+
             # Récupérer toutes les formations
-            cur_form.execute("SELECT id, titre FROM formations ORDER BY date DESC")
-            forms = cur_form.fetchall()
+            forms = [row[:2] for row in liste_formations()]
             if not forms:
                 st.info(t("Aucune formation disponible.", "No training available.", "No hay formación disponible."))
             else:
                 choix = [titre for (_fid, titre) in forms]
+                verrouillees = {titre for (fid, titre) in forms if not fermeture.get(fid, frozenset()) <= reussies}
                 sel = st.selectbox(
                     t("Choisissez une formation", "Select a training", "Seleccione una formación"),
                     choix,
+                    format_func=lambda titre: f"🔒 {titre}" if titre in verrouillees else titre,
                     key="view_form"
                 )
                 fid = [fid for (fid, titre) in forms if titre == sel][0]
 
                 # Charger les chapitres pour cette formation
-                cur_form.execute(
-                    "SELECT id, titre, type_contenu, contenu FROM chapitres WHERE formation_id = ? ORDER BY ordre",
-                    (fid,)
-                )
-                chs = cur_form.fetchall()
+                chs = [ch[:4] for ch in liste_chapitres(fid)]
                 total = len(chs)
 
-                if total == 0:
+                manquants = fermeture.get(fid, frozenset()) - reussies
+                if manquants:
+                    st.warning(t("🔒 Formation verrouillée. Réussissez d'abord : ",
+                                 "🔒 Locked training. First pass: ",
+                                 "🔒 Formación bloqueada. Apruebe primero: ")
+                               + ", ".join(sorted(titres_formations.get(r, str(r)) for r in manquants)))
+                elif total == 0:
                     st.info(t("Pas de chapitres disponibles.", "No chapters available.", "No hay capítulos disponibles."))
                 else:
-                    # Initialisation de l’index de chapitre et de l’état de fin de formation
-                    if "last_fid" not in st.session_state or st.session_state.get("last_fid") != fid:
-                        st.session_state.ch_idx = 0
-                        st.session_state.last_fid = fid
-                        st.session_state.formation_finie = False
-                    if "formation_finie" not in st.session_state:
-                        st.session_state.formation_finie = False
-
-                    idx = st.session_state.get("ch_idx", 0)
-                    if idx < 0:
-                        idx = 0
-                        st.session_state.ch_idx = 0
-                    if idx >= total:
-                        idx = total - 1
-                        st.session_state.ch_idx = idx
-
-                    # Affichage du stepper (cercles d’étapes)
-                    cols = st.columns(total)
-                    for i in range(total):
-                        if i < idx:
-                            couleur = "#2c6e49"
-                        elif i == idx:
-                            couleur = "#e47157"
-                        else:
-                            couleur = "#cfcfcf"
-                        cols[i].markdown(
-                            f"""
-                            <div style="
-                                width:36px;
-                                height:36px;
-                                border-radius:50%;
-                                background-color:{couleur};
-                                display:flex;
-                                align-items:center;
-                                justify-content:center;
-                                color:white;
-                            ">{i+1}</div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-                    # ----------- Si la formation est finie ----------- #
-                    if st.session_state.formation_finie:
-                        st.success(
-                            t(
-                                "🎉 Vous avez terminé la formation ! Vous pouvez passer le test.",
-                                "🎉 You have finished the training! You can now take the test.",
-                                "🎉 ¡Has terminado la formación! Ahora puedes realizar la prueba."
-                            )
-                        )
-                        if st.button(t("🔁 Recommencer la lecture depuis le début", "🔁 Restart reading from the beginning", "🔁 Volver a empezar desde el principio"), key="restart_reading"):
-                            st.session_state.ch_idx = 0
-                            st.session_state.formation_finie = False
-                            st.rerun()
-                        
-                    else:
-                        # Récupérer le chapitre courant
-                        cid, titre_chap, type_c, cont = chs[idx]
-
-                        # Marquer le chapitre comme lu
-                        cur_prog.execute(
-                            "INSERT OR IGNORE INTO progress(email, formation_id, chapter_id, timestamp) VALUES(?,?,?,?)",
-                            (user_email, fid, cid, datetime.now().isoformat())
-                        )
-                        conn_prog.commit()
-
-                        # Affichage du contenu du chapitre courant
-                        if type_c == "texte":
-                            st.markdown(cont)
-                        elif type_c == "pdf":
-                            b64 = base64.b64encode(open(cont, "rb").read()).decode()
-                            st.markdown(
-                                f"<embed src='data:application/pdf;base64,{b64}' width='100%' height='400px'/>",
-                                unsafe_allow_html=True
-                            )
-                        elif type_c == "video":
-                            st.video(cont)
-                        else:  # ppt
-                            st.download_button(
-                                t("Télécharger PPT", "Download PPT", "Descargar PPT"),
-                                open(cont, "rb"),
-                                file_name=os.path.basename(cont)
-                            )
-
-                        # Boutons navigation
-                        prev_col, _, next_col = st.columns([1, 6, 1])
-                        with prev_col:
-                            if st.button("◀️", key="nav_prev") and idx > 0:
-                                st.session_state.ch_idx = idx - 1
-                                st.session_state.formation_finie = False
-                                st.rerun()
-                        with next_col:
-                            if st.button("▶️", key="nav_next"):
-                                if idx < total - 1:
-                                    st.session_state.ch_idx = idx + 1
-                                    st.session_state.formation_finie = False
-                                    st.rerun()
-                                else:
-                                    # Si on clique “suivant” au dernier chapitre : FIN
-                                    st.session_state.formation_finie = True
-                                    st.rerun()
+                    lecteur_chapitres(user_email, fid, chs)
 
         # --- Passer le test ---
         with tabs[1]:
             st.header(t(" Passer le test"," Take Test"," Realizar Prueba"))
             # Récupérer toutes les formations
-            cur_form.execute("SELECT id, titre FROM formations")
-            forms = cur_form.fetchall()
+            forms = [(fid, titre, rev) for fid, titre, _, _, _, rev in liste_formations()]
             dispo = []
-            for fid, ft in forms:
-                # Vérifier si l’utilisateur a déjà passé et réussi le test
-                cur_test.execute("SELECT passed FROM tests WHERE email = ? AND formation_id = ?", (user_email, fid))
-                tp = cur_test.fetchone()
-                if tp and tp[0] == 1:
+            revisions = {fid: rev for fid, _, rev in forms}
+            for fid, ft, _ in forms:
+                # Déjà réussie, ou prérequis non réussis
+                if fid in reussies or not fermeture.get(fid, frozenset()) <= reussies:
                     continue
                 # Nombre total de chapitres
-                cur_form.execute("SELECT COUNT(*) FROM chapitres WHERE formation_id = ?", (fid,))
-                tot = cur_form.fetchone()[0]
+                tot = len(liste_chapitres(fid))
                 # Nombre de chapitres lus
                 cur_prog.execute("SELECT COUNT(*) FROM progress WHERE email = ? AND formation_id = ?", (user_email, fid))
                 lus = cur_prog.fetchone()[0]
@@ -1271,65 +1551,170 @@ def main():
                 titres = [t for _, t in dispo]
                 sel_t = st.selectbox(t("Formation","Training","Formación"), titres, key="test_sel")
                 fidt = [f for f, t in dispo if t == sel_t][0]
-                # Charger les questions pour cette formation
-                cur_test.execute("SELECT id, question_text, allow_multiple FROM questions WHERE formation_id = ?", (fidt,))
-                qs = cur_test.fetchall()
-                if not qs:
+                q_ids = list(liste_questions(fidt))
+                if not q_ids:
                     st.info(t("Aucun test disponible.","No test available.","No hay prueba disponible."))
                 else:
-                    reps = {}
-                    for qid, qt, allow in qs:
-                        cur_test.execute("SELECT option_text FROM options WHERE question_id = ?", (qid,))
-                        opts = [o[0] for o in cur_test.fetchall()]
-                        if allow:
-                            reps[qid] = st.multiselect(qt, opts, key=f"rep_{qid}")
-                        else:
-                            reps[qid] = [st.radio(qt, opts, key=f"rep_{qid}")]
-                    if st.button(t("Valider le test","Submit Test","Enviar Prueba")):
-                        corr = 0
-                        for qid, ans in reps.items():
-                            cur_test.execute(
-                                "SELECT option_text FROM options WHERE question_id = ? AND is_correct = 1",
-                                (qid,)
+                    # Session de test persistée : tirage, page courante et réponses survivent à une reconnexion
+                    ses = cur_res.execute(
+                        "SELECT seed, debut, page FROM sessions_test WHERE email = ? AND formation_id = ?",
+                        (user_email, fidt)
+                    ).fetchone()
+                    if ses is None:
+                        ses = (random.randrange(2**31), int(time.time()), 0)
+                        cur_res.execute(
+                            "INSERT INTO sessions_test(email, formation_id, seed, debut, page) VALUES(?,?,?,?,?)",
+                            (user_email, fidt) + ses
+                        )
+                        conn_res.commit()
+                    seed, debut, page = ses
+                    nb_questions = int(get_param("test_nb_questions", "0"))
+                    par_page = max(1, int(get_param("test_par_page", "10")))
+                    if 0 < nb_questions < len(q_ids):
+                        q_ids = random.Random(seed).sample(q_ids, nb_questions)
+                    nb_pages = (len(q_ids) + par_page - 1) // par_page
+                    page = min(page, nb_pages - 1)
+                    page_ids = q_ids[page * par_page:(page + 1) * par_page]
+
+                    # Questions, options et réponses déjà saisies : uniquement pour la page courante
+                    ids_json = json.dumps(page_ids)
+                    qs = {qid: (qt, allow) for qid, qt, allow in cur_test.execute(
+                        "SELECT id, question_text, allow_multiple FROM questions WHERE id IN (SELECT value FROM json_each(?))",
+                        (ids_json,)
+                    )}
+                    opts = {}
+                    for qid, oid, otext in cur_test.execute(
+                        "SELECT question_id, id, option_text FROM options WHERE question_id IN (SELECT value FROM json_each(?)) ORDER BY id",
+                        (ids_json,)
+                    ):
+                        opts.setdefault(qid, {})[oid] = otext
+                    deja = {qid: json.loads(rep) for qid, rep in cur_res.execute(
+                        "SELECT question_id, reponse FROM reponses_en_cours WHERE email = ? AND formation_id = ? "
+                        "AND question_id IN (SELECT value FROM json_each(?))",
+                        (user_email, fidt, ids_json)
+                    )}
+
+                    st.caption(f"{t('Page','Page','Página')} {page + 1}/{nb_pages}")
+                    with st.form(f"test_{fidt}_{page}"):
+                        reps = {}
+                        for qid in page_ids:
+                            qt, allow = qs[qid]
+                            o = opts.get(qid, {})
+                            if allow:
+                                reps[qid] = st.multiselect(
+                                    qt, list(o), default=[x for x in deja.get(qid, []) if x in o],
+                                    format_func=o.get, key=f"rep_{fidt}_{qid}"
+                                )
+                            elif o:
+                                choix_o = list(o)
+                                prec = deja.get(qid, [choix_o[0]])
+                                idx_o = choix_o.index(prec[0]) if prec and prec[0] in o else 0
+                                reps[qid] = [st.radio(qt, choix_o, index=idx_o, format_func=o.get, key=f"rep_{fidt}_{qid}")]
+                        c_prev, _, c_next = st.columns([1, 4, 1])
+                        with c_prev:
+                            precedent = st.form_submit_button("◀️", disabled=page == 0)
+                        with c_next:
+                            if page < nb_pages - 1:
+                                suivant = st.form_submit_button("▶️")
+                                valider = False
+                            else:
+                                suivant = False
+                                valider = st.form_submit_button(t("Valider le test","Submit Test","Enviar Prueba"))
+
+                    if precedent or suivant or valider:
+                        cur_res.executemany(
+                            "INSERT OR REPLACE INTO reponses_en_cours(email, formation_id, question_id, reponse) VALUES(?,?,?,?)",
+                            [(user_email, fidt, qid, json.dumps(ans)) for qid, ans in reps.items()]
+                        )
+                        if precedent or suivant:
+                            cur_res.execute(
+                                "UPDATE sessions_test SET page = ? WHERE email = ? AND formation_id = ?",
+                                (page - 1 if precedent else page + 1, user_email, fidt)
                             )
-                            bonnes = [o[0] for o in cur_test.fetchall()]
-                            if set(ans) == set(bonnes):
-                                corr += 1
-                        score = corr / len(qs)
-                        st.write(f"{corr}/{len(qs)} ({score*100:.0f}%)")
+                        conn_res.commit()
+                        if precedent or suivant:
+                            st.rerun()
+
+                    if valider:
+                        # Correction en deux requêtes, quel que soit le nombre de questions
+                        reponses = {qid: set(json.loads(rep)) for qid, rep in cur_res.execute(
+                            "SELECT question_id, reponse FROM reponses_en_cours WHERE email = ? AND formation_id = ?",
+                            (user_email, fidt)
+                        )}
+                        bonnes = {}
+                        for qid, oid in cur_test.execute(
+                            "SELECT question_id, id FROM options WHERE is_correct = 1 AND question_id IN (SELECT value FROM json_each(?))",
+                            (json.dumps(q_ids),)
+                        ):
+                            bonnes.setdefault(qid, set()).add(oid)
+                        corr = sum(1 for qid in q_ids if reponses.get(qid, set()) == bonnes.get(qid, set()))
+                        score = corr / len(q_ids)
+                        st.write(f"{corr}/{len(q_ids)} ({score*100:.0f}%)")
+                        # Une seule insertion : les triggers tiennent à jour tests et tentatives_jour
+                        cur_res.execute(
+                            "INSERT INTO tentatives(email, formation_id, revision, score, duree, passed, ts) VALUES(?,?,?,?,?,?,?)",
+                            (user_email, fidt, revisions[fidt], round(score * 1000),
+                             int(time.time()) - debut, int(score >= 0.8), int(time.time()))
+                        )
+                        cur_res.execute("DELETE FROM reponses_en_cours WHERE email = ? AND formation_id = ?", (user_email, fidt))
+                        cur_res.execute("DELETE FROM sessions_test WHERE email = ? AND formation_id = ?", (user_email, fidt))
+                        conn_res.commit()
+                        invalider_stats(user_email)
+                        recommandations.programmer()
+                        titre_test = sel_t.strip()
+                        notifications.emettre(
+                            "test", f"Résultat du test : {titre_test}",
+                            f"{corr}/{len(q_ids)} ({score*100:.0f}%) — {'validé' if score >= 0.8 else 'non validé'}",
+                            email=user_email
+                        )
                         if score >= 0.8:
                             st.success(t("🎉 Test validé !","🎉 Test passed!","🎉 Prueba aprobada!"))
-                            cur_test.execute(
-                                "INSERT OR REPLACE INTO tests(email, formation_id, passed) VALUES(?, ?, 1)",
-                                (user_email, fidt)
+                            # Certificat délivré une fois pour toutes, daté du jour de réussite
+                            row_user = cur_users.execute("SELECT nom, prenom FROM utilisateurs WHERE email = ?", (user_email,)).fetchone()
+                            certificats.programmer(
+                                user_email, fidt, revisions[fidt], date.today().isoformat(),
+                                f"{row_user[0]} {row_user[1]}" if row_user else user_email,
+                                titre_test, st.session_state.lang
+                            )
+                            notifications.emettre(
+                                "certificat", f"Certificat disponible : {titre_test}",
+                                "Votre certificat est téléchargeable dans l'onglet « Mes certificats ».",
+                                email=user_email
                             )
-                            conn_test.commit()
                         else:
-                            st.error(t(
+                            # Affiché après le st.rerun() ci-dessous, avec le score
+                            flash(f"{corr}/{len(q_ids)} ({score*100:.0f}%) — " + t(
                                 "❌ Test non validé—vous devez relire la formation avant de repasser le test.",
                                 "❌ Test not passed—you must reread the training before retaking the test.",
                                 "❌ Prueba no aprobada; debes repasar la formación antes de volver a hacer la prueba."
-                            ))
+                            ), "error")
                             # Supprimer tous les chapitres lus pour forcer à tout relire
                             cur_prog.execute(
                                 "DELETE FROM progress WHERE email = ? AND formation_id = ?",
                                 (user_email, fidt)
                             )
                             conn_prog.commit()
+                            invalider_stats(user_email)
                             # Réinitialiser le chapitre courant à 0 pour que l'utilisateur relise depuis le début
                             st.session_state.ch_idx = 0
-                            st.success(t("Vous pouvez maintenant relire la formation depuis le début.","You can now reread the training from the beginning.","Ahora puedes repasar la formación desde el principio."))
+                            flash(t("Vous pouvez maintenant relire la formation depuis le début.","You can now reread the training from the beginning.","Ahora puedes repasar la formación desde el principio."), "info")
                             st.rerun()
 
         # --- Mes certificats ---
         with tabs[2]:
             st.header(t(" Mes certificats"," My Certificates"," Mis Certificados"))
-            # Récupère les formations validées
-            cur_test.execute(
-                "SELECT formation_id FROM tests WHERE email = ? AND passed = 1",
-                (user_email,)
-            )
-            passed = [r[0] for r in cur_test.fetchall()]
+            # Formations validées encore existantes, avec la révision et le jour de la tentative réussie
+            # (None pour un test validé avant le journal des tentatives)
+            infos_forms = {fid: (titre, rev) for fid, titre, _, _, _, rev in liste_formations()}
+            passed = [row for row in cur_res.execute("""
+                SELECT s.formation_id, t.revision, date(t.ts, 'unixepoch', 'localtime')
+                FROM tests s
+                LEFT JOIN tentatives t ON t.id = (
+                    SELECT MAX(id) FROM tentatives
+                    WHERE email = s.email AND formation_id = s.formation_id AND passed = 1
+                )
+                WHERE s.email = ? AND s.passed = 1
+            """, (user_email,)) if row[0] in infos_forms]
 
             if not passed:
                 st.info(t("Aucun certificat obtenu.","No certificates earned.","No hay certificados obtenidos."))
@@ -1346,20 +1731,32 @@ def main():
                 else:
                     full_name = user_email  # fallback
 
-                for fidc in passed:
-                    # Titre de la formation
-                    cur_form.execute("SELECT titre FROM formations WHERE id = ?", (fidc,))
-                    row = cur_form.fetchone()
-                    tit = row[0] if row else t("Formation inconnue","Unknown training","Formación desconocida")
-
-                    obt = date.today().strftime("%d/%m/%Y")
+                delivres = certificats.pour(user_email)
+                for fidc, rev_reussie, jour_reussite in passed:
+                    tit, rev = infos_forms[fidc]
+                    # Le certificat porte la révision sur laquelle le test a été passé, pas forcément la courante
+                    rev = rev_reussie or rev
+                    cert = delivres.get((fidc, rev))
+                    if cert is None:
+                        # Test validé avant le stockage des certificats : délivré à la date de la réussite
+                        certificats.programmer(
+                            user_email, fidc, rev, jour_reussite or date.today().isoformat(),
+                            full_name, tit, st.session_state.lang
+                        )
+                        cert = certificats.pour(user_email).get((fidc, rev))
+                    if cert is None:
+                        st.write(f"**{tit}**")
+                        st.info(t("Certificat en préparation…","Certificate being prepared…","Certificado en preparación…"))
+                        continue
+                    empreinte, delivre_le = cert
+                    obt = date.fromisoformat(delivre_le).strftime("%d/%m/%Y")
                     st.write(f"**{tit}** — {t('obtenu le','earned on','obtenido el')} {obt}")
-
-                    if st.button(t("Télécharger","Download","Descargar"), key=f"cert_{fidc}"):
-                        # On passe désormais full_name au lieu de user_email
-                        fn = creer_certificat(full_name, tit, date.today())
-                        with open(fn, "rb") as f:
-                            st.download_button("⬇️ PDF", f, file_name=fn)
+                    # PDF lu seulement au clic (pas à chaque rerun)
+                    st.download_button(
+                        t("Télécharger","Download","Descargar"), functools.partial(certificats.lire, empreinte),
+                        file_name=f"Certificat_{full_name.replace(' ', '_')}_{fidc}.pdf",
+                        mime="application/pdf", key=f"dl_cert_{fidc}"
+                    )
 
         # --- Paramètres utilisateur simple ---
         with tabs[3]:
@@ -1374,7 +1771,11 @@ def main():
             with col2:
                 photo = st.file_uploader(t("Photo de profil","Profile photo","Foto de perfil"), type=["png","jpg","jpeg"], key="param_photo")
                 if photo:
-                    st.image(photo, width=120)
+                    st.image(images.apercu(photo.getvalue(), 120), width=120)
+                else:
+                    cur_users.execute("SELECT photo_path, genre FROM utilisateurs WHERE email=?", (user_email,))
+                    ma_photo = cur_users.fetchone() or (None, None)
+                    st.image(images.photo_ou_avatar(ma_photo[0], 120, ma_photo[1] not in ("Femme","Female","Mujer")), width=120)
 
             st.markdown("---")
             # Sécurité & vie privée
@@ -1391,9 +1792,9 @@ def main():
                 index=["Français","English","Español"].index(st.session_state.lang),
                 key="param_lang"
             )
-            notif_form = st.checkbox(t("Formations","Trainings","Formaciones"), value=(get_param("notif_form","True")=="True"), key="param_notif_form")
-            notif_test = st.checkbox(t("Tests","Tests","Pruebas"), value=(get_param("notif_test","True")=="True"), key="param_notif_test")
-            notif_cert = st.checkbox(t("Certificats","Certificates","Certificados"), value=(get_param("notif_cert","True")=="True"), key="param_notif_cert")
+            notif_form = st.checkbox(t("Formations","Trainings","Formaciones"), value=parametres.get(user_email, "notif_form", True), key="param_notif_form")
+            notif_test = st.checkbox(t("Tests","Tests","Pruebas"), value=parametres.get(user_email, "notif_test", True), key="param_notif_test")
+            notif_cert = st.checkbox(t("Certificats","Certificates","Certificados"), value=parametres.get(user_email, "notif_cert", True), key="param_notif_cert")
 
             if st.button(t("💾 Sauvegarder","💾 Save","💾 Guardar")):
                 if ancien and nouveau:
@@ -1404,10 +1805,15 @@ def main():
                         st.success(t(" Mot de passe mis à jour"," Password updated"," Contraseña actualizada"))
                     else:
                         st.error(t("❌ Ancien mot de passe incorrect","❌ Old password incorrect","❌ Contraseña antigua incorrecta"))
-                save_param("lang", lang)
-                save_param("notif_form", notif_form)
-                save_param("notif_test", notif_test)
-                save_param("notif_cert", notif_cert)
+                if photo:
+                    cur_users.execute(
+                        "UPDATE utilisateurs SET photo_path=? WHERE email=?",
+                        (images.enregistrer_photo(photo.getvalue(), user_email), user_email)
+                    )
+                    conn_users.commit()
+                parametres.enregistrer(user_email, {
+                    "lang": lang, "notif_form": notif_form, "notif_test": notif_test, "notif_cert": notif_cert
+                })
                 st.session_state.lang = lang
                 st.success(t("✅ Paramètres sauvegardés","✅ Settings saved","✅ Ajustes guardados"))
 
@@ -1443,12 +1849,13 @@ def main():
         with tabs[4]:
             st.markdown(f"<h1 style='text-align:center'>{t('📊 Mes indicateurs','📊 My Metrics','📊 Mis Indicadores')}</h1>", unsafe_allow_html=True)
 
-            total_chap = cur_form.execute("SELECT COUNT(*) FROM chapitres").fetchone()[0]
-            chap_lus = cur_prog.execute("SELECT COUNT(*) FROM progress WHERE email=?", (user_email,)).fetchone()[0]
-            total_tests_user = cur_test.execute("SELECT COUNT(*) FROM tests WHERE email=?", (user_email,)).fetchone()[0]
-            passed_tests = cur_test.execute("SELECT COUNT(*) FROM tests WHERE email=? AND passed=1", (user_email,)).fetchone()[0]
-            total_forms = cur_form.execute("SELECT COUNT(*) FROM formations").fetchone()[0]
-            form_started = cur_prog.execute("SELECT COUNT(DISTINCT formation_id) FROM progress WHERE email=?", (user_email,)).fetchone()[0]
+            stats = stats_utilisateur(user_email)
+            total_chap = stats["total_chap"]
+            chap_lus = stats["chap_lus"]
+            total_tests_user = stats["total_tests"]
+            passed_tests = stats["passed_tests"]
+            total_forms = stats["total_forms"]
+            form_started = stats["form_started"]
             form_completed = passed_tests
 
             has_activity = (total_chap > 0 or total_tests_user > 0 or form_started > 0)
@@ -1481,13 +1888,8 @@ def main():
                 st.markdown("---")
 
                 # Répartition par type de contenu
-                chap_ids = [r[0] for r in cur_prog.execute("SELECT chapter_id FROM progress WHERE email=?", (user_email,)).fetchall()]
-                if chap_ids:
-                    placeholder = ",".join("?" for _ in chap_ids)
-                    q = f"SELECT type_contenu FROM chapitres WHERE id IN ({placeholder})"
-                    types = [r[0] for r in cur_form.execute(q, chap_ids).fetchall()]
-                    s = pd.Series(types)
-                    counts = s.value_counts()
+                if stats["par_format"]:
+                    counts = pd.Series(stats["par_format"])
                     pct = (counts / counts.sum() * 100).round(1)
                     df_fmt = pd.DataFrame({
                         "format": pct.index.tolist(),
@@ -1497,17 +1899,12 @@ def main():
                     df_fmt = pd.DataFrame(columns=["format","pct"])
 
                 # Chapitres lus par formation
-                data = cur_prog.execute(
-                    "SELECT formation_id, COUNT(*) FROM progress WHERE email=? GROUP BY formation_id",
-                    (user_email,)
-                ).fetchall()
-                if data:
-                    forms_cp = []
-                    for fid_cp, cnt in data:
-                        row_f = cur_form.execute("SELECT titre FROM formations WHERE id=?", (fid_cp,)).fetchone()
-                        titre_cp = row_f[0] if row_f else t("Formation inconnue","Unknown training","Formación desconocida")
-                        forms_cp.append({"titre": titre_cp, "lus": cnt})
-                    df_cp = pd.DataFrame(forms_cp) if forms_cp else pd.DataFrame(columns=["titre","lus"])
+                if stats["par_formation"]:
+                    forms_cp = [
+                        {"titre": titre_cp or t("Formation inconnue","Unknown training","Formación desconocida"), "lus": cnt}
+                        for titre_cp, cnt in stats["par_formation"]
+                    ]
+                    df_cp = pd.DataFrame(forms_cp)
                 else:
                     df_cp = pd.DataFrame(columns=["titre","lus"])
 
@@ -1576,9 +1973,9 @@ def main():
                 st.info(t("Pas encore d’activité sur votre compte.","No activity yet.","Sin actividad aún."))
 
     # Footer commun
-    footer_html = """
+    footer_html = f"""
     <style>
-    .footer {
+    .footer {{
         position: fixed;
         bottom: 0;
         left: 0;
@@ -1588,23 +1985,27 @@ def main():
         padding: 8px 0;
         font-size: 12px;
         z-index: 1000;
-    }
-    .footer img {
+    }}
+    .footer img {{
         height: 20px;
         vertical-align: middle;
         margin-right: 6px;
-    }
+    }}
     </style>
     <div class="footer">
-      <img src="https://upload.wikimedia.org/wikipedia/commons/thumb/1/1c/OCP_Group.svg/1606px-OCP_Group.svg.png" alt="Logo" />
+      <img src="{assets.url('logo_ocp.svg')}" alt="Logo" />
       © 2025 OCP Group. Tous droits réservés.
     </div>
     """
     st.markdown(footer_html, unsafe_allow_html=True)
 
 # Lancement
-if not st.session_state.authenticated:
-    login_page()
-    st.stop()
-else:
-    main()
+afficher_flash()
+try:
+    if not st.session_state.authenticated:
+        login_page()
+    else:
+        main()
+finally:
+    ctx = get_script_run_ctx()
+    memoire.fin(ctx.session_id if ctx else "?", st.session_state.get("email"), st.session_state)
@@ -0,0 +1,165 @@
+"""Source de données des tableaux de bord : jamais les connexions d'écriture des apprenants.
+
+Deux modes (paramètre global analytique_mode) :
+
+- "instantane" (défaut) : les lectures vont sur une copie de toutes les bases
+  dans analytique/<epoch>/, faite par sauvegarde.copier() et rafraîchie toutes
+  les analytique_intervalle secondes par la tâche "analytique". La copie est
+  ouverte en immutable (aucun verrou) ; les balayages lourds ne touchent ni
+  les fichiers ni le WAL des bases vivantes.
+- "direct" : connexions mode=ro dédiées sur les bases vivantes (WAL : les
+  lectures ne bloquent pas les écritures), données à la seconde près.
+
+fraicheur() donne l'heure des données affichées. Sans worker (jobs.py), la
+tâche planifiée ne tourne jamais : l'instantané est alors rafraîchi à la
+lecture, dans la session, dès qu'il a plus de analytique_intervalle secondes.
+Les connexions vers des instantanés remplacés sont fermées à la lecture
+suivante, dans chaque process (les fichiers supprimés libèrent leur place).
+"""
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import parametres
+import partitions
+import sauvegarde
+
+DOSSIER = os.environ.get("FM_ANALYTIQUE_DIR", "analytique")
+INTERVALLE_DEFAUT = 300
+
+_conns = {}
+_lock = threading.Lock()
+_rafraichissement = threading.Lock()
+
+
+def mode():
+    return parametres.get_param("analytique_mode", "instantane")
+
+
+def intervalle():
+    return int(parametres.get_param("analytique_intervalle", str(INTERVALLE_DEFAUT)))
+
+
+def _instantanes():
+    if not os.path.isdir(DOSSIER):
+        return []
+    return sorted((d for d in os.listdir(DOSSIER) if d.isdigit()), key=int, reverse=True)
+
+
+def rafraichir(attendre=True):
+    """Nouvelle copie de toutes les bases ; les anciennes sont supprimées. Renvoie son nom.
+
+    attendre=False : None si un rafraîchissement est déjà en cours dans le process.
+    """
+    if not _rafraichissement.acquire(blocking=attendre):
+        return None
+    try:
+        nom = str(int(time.time()))
+        tmp = os.path.join(DOSSIER, f".tmp-{nom}")
+        os.makedirs(tmp, exist_ok=True)
+        sauvegarde.copier(tmp, sauvegarde.bases(), sommes=False, journal="DELETE")
+        os.replace(tmp, os.path.join(DOSSIER, nom))
+        # On garde le précédent : une lecture commencée juste avant le rafraîchissement peut finir
+        for ancien in _instantanes()[2:]:
+            _fermer(os.path.join(DOSSIER, ancien))
+            shutil.rmtree(os.path.join(DOSSIER, ancien), ignore_errors=True)
+        for tmp in glob.glob(os.path.join(DOSSIER, ".tmp-*")):
+            if not tmp.endswith(nom):
+                shutil.rmtree(tmp, ignore_errors=True)
+        return nom
+    finally:
+        _rafraichissement.release()
+
+
+def _source():
+    """Dossier des bases lues (None : bases vivantes)."""
+    if mode() == "direct":
+        return None
+    instantanes = _instantanes()
+    if not instantanes:
+        return os.path.join(DOSSIER, rafraichir())
+    if time.time() - int(instantanes[0]) > intervalle():
+        import jobs  # import tardif : jobs.py référence ce module pour sa tâche
+        if not jobs.workers_actifs():
+            nom = rafraichir(attendre=False)
+            if nom:
+                return os.path.join(DOSSIER, nom)
+    return os.path.join(DOSSIER, instantanes[0])
+
+
+def fraicheur():
+    """(mode, horodatage epoch des données)."""
+    source = _source()
+    return mode(), time.time() if source is None else int(os.path.basename(source))
+
+
+def version():
+    """Identifiant des données lues : l'instantané courant, ou la minute courante en mode direct."""
+    source = _source()
+    return os.path.basename(source) if source is not None else f"direct-{int(time.time() // 60)}"
+
+
+def _fermer(source):
+    with _lock:
+        for cle in [c for c in _conns if c[0] == source]:
+            _conns.pop(cle).close()
+
+
+def connexion(fichier):
+    """Connexion en lecture seule sur fichier (chemin relatif, ex. "progress.db") dans la source courante."""
+    source = _source()
+    cle = (source, fichier)
+    # Sources encore lisibles : la courante, et l'instantané précédent (lectures en cours)
+    gardees = {source} if source is None else {source} | {os.path.join(DOSSIER, n) for n in _instantanes()[:2]}
+    with _lock:
+        for ancienne in [c for c in _conns if c[0] not in gardees]:
+            _conns.pop(ancienne).close()
+        conn = _conns.get(cle)
+        if conn is None:
+            if source is None:
+                uri = f"file:{os.path.abspath(fichier)}?mode=ro"
+            else:
+                uri = f"file:{os.path.abspath(os.path.join(source, fichier))}?mode=ro&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            _conns[cle] = conn
+    return conn
+
+
+def _fichiers(kind):
+    """Fichiers de partition présents dans la source (une partition créée après l'instantané n'y est pas)."""
+    source = _source() or "."
+    return [f for f in (partitions.chemin(kind, cle) for cle in partitions.partitions(kind))
+            if os.path.exists(os.path.join(source, f))]
+
+
+def fan_out(kind, sql, params=()):
+    """Comme partitions.fan_out, sur la source analytique."""
+    fichiers = _fichiers(kind)
+    if len(fichiers) <= 1:
+        return [connexion(f).execute(sql, params).fetchall() for f in fichiers]
+    with ThreadPoolExecutor(max_workers=min(8, len(fichiers))) as pool:
+        return list(pool.map(lambda f: connexion(f).execute(sql, params).fetchall(), fichiers))
+
+
+def curseurs(kind, sql, params=()):
+    """Un curseur par partition (lectures par lots)."""
+    return [connexion(f).execute(sql, params) for f in _fichiers(kind)]
+
+
+def tache():
+    """Tâche planifiée : rafraîchit l'instantané puis reprogramme la suivante."""
+    try:
+        if mode() != "direct":
+            return rafraichir()
+    finally:
+        programmer()
+
+
+def programmer():
+    """Sans worker, la tâche attend en file : _source() rafraîchit alors à la lecture."""
+    import jobs  # import tardif : jobs.py référence ce module pour sa tâche
+    return jobs.planifier("analytique", intervalle())
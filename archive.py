@@ -0,0 +1,168 @@
+"""Archivage des lignes froides de progress / tests en Parquet compressé.
+
+Les lignes de progress plus anciennes que l'horizon d'une formation dont
+l'apprenant a réussi le test, et toutes les lignes des formations retirées
+(liste explicite ou formations supprimées de formations.db), sont écrites dans
+archive/<table>/formation_id=<id>/mois=<AAAA-MM>/ puis supprimées des tables
+SQLite. Une formation en cours n'est jamais archivée : éligibilité au test,
+chapitres lus et reprise de lecture ne lisent que les tables vivantes. La
+table tests n'ayant pas d'horodatage, seules ses lignes de formations
+retirées sont archivées.
+
+    python archive.py --horizon 365 --retirees 3,5 [--vacuum]
+
+lire_progress() / lire_tests() renvoient l'union archive + données vivantes ;
+lire_archive() la seule partie archivée, pour les rapports qui lisent déjà
+les données vivantes par ailleurs (tableau de bord, entonnoir, statistiques).
+"""
+import argparse
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import cache
+import partitions
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow est optionnel : seul l'archivage en a besoin
+    pa = ds = pq = None
+
+DOSSIER = os.environ.get("FM_ARCHIVE_DIR", "archive")
+
+COLONNES = {
+    "progress": ["email", "formation_id", "chapter_id", "timestamp"],
+    "tests": ["email", "formation_id", "passed"],
+}
+
+
+def _exiger_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow est requis pour l'archivage (pip install pyarrow)")
+
+
+def _formations_existantes():
+    conn = sqlite3.connect("formations.db")
+    try:
+        return {r[0] for r in conn.execute("SELECT id FROM formations")}
+    finally:
+        conn.close()
+
+
+def _ecrire(table, rows):
+    cols = COLONNES[table]
+    df = pd.DataFrame(rows, columns=cols)
+    if table == "progress":
+        df["mois"] = df["timestamp"].str.slice(0, 7)
+    else:
+        df["mois"] = datetime.now().strftime("%Y-%m")
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        root_path=os.path.join(DOSSIER, table),
+        partition_cols=["formation_id", "mois"],
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        compression="zstd",
+    )
+
+
+def archiver(horizon_jours=365, formations_retirees=(), vacuum=False):
+    """Déplace les lignes froides vers l'archive ; renvoie le nombre de lignes archivées par table."""
+    _exiger_pyarrow()
+    limite = (datetime.now() - timedelta(days=horizon_jours)).isoformat()
+    # Listes d'ids passées en JSON : pas de limite sur le nombre de variables SQLite
+    params = [json.dumps(list(formations_retirees)), json.dumps(sorted(_formations_existantes()))]
+    bilan = {}
+    for table, cols in COLONNES.items():
+        retiree = """(formation_id IN (SELECT value FROM json_each(?))
+                      OR formation_id NOT IN (SELECT value FROM json_each(?)))"""
+        sql = f"SELECT rowid, {', '.join(cols)}, {retiree} FROM {table} WHERE {retiree}"
+        if table == "progress":
+            sql += " OR timestamp < ?"
+        total = 0
+        for cle in partitions.partitions(table):
+            conn = partitions.connexion(table, cle)
+            froides = conn.execute(sql, params + params + ([limite] if table == "progress" else [])).fetchall()
+            if table == "progress":
+                # Hors formations retirées, seules les formations réussies (même partition dans tests)
+                reussies = set(partitions.connexion("tests", cle).execute(
+                    "SELECT email, formation_id FROM tests WHERE passed=1"
+                ).fetchall())
+                froides = [r for r in froides if r[-1] or (r[1], r[2]) in reussies]
+            froides = [r[:-1] for r in froides]
+            if not froides:
+                continue
+            # On écrit le Parquet avant de supprimer : un crash laisse au pire un doublon, jamais une perte
+            _ecrire(table, [r[1:] for r in froides])
+            conn.executemany(f"DELETE FROM {table} WHERE rowid=?", [(r[0],) for r in froides])
+            conn.commit()
+            if vacuum:
+                conn.execute("VACUUM")
+            total += len(froides)
+        bilan[table] = total
+    if any(bilan.values()):
+        cache.invalider("progress")
+    return bilan
+
+
+def _filtre(email, formation_id, depuis):
+    expr = None
+    for cond in (
+        ds.field("email") == email if email is not None else None,
+        ds.field("formation_id") == formation_id if formation_id is not None else None,
+        ds.field("timestamp") >= depuis if depuis is not None else None,
+    ):
+        if cond is not None:
+            expr = cond if expr is None else expr & cond
+    return expr
+
+
+def lire_archive(table, email=None, formation_id=None, depuis=None, colonnes=None):
+    """Lignes archivées seulement (DataFrame vide sans archive ou sans pyarrow) ; colonnes : sous-ensemble lu."""
+    cols = colonnes or COLONNES[table]
+    racine = os.path.join(DOSSIER, table)
+    if pa is None or not os.path.isdir(racine):
+        return pd.DataFrame(columns=cols)
+    # Le filtre est poussé dans le scan : partitions formation_id/mois élaguées, row groups filtrés sur email
+    dataset = ds.dataset(racine, format="parquet", partitioning="hive")
+    archive = dataset.to_table(columns=cols, filter=_filtre(email, formation_id, depuis)).to_pandas()
+    if "formation_id" in archive:
+        archive["formation_id"] = archive["formation_id"].astype("int64")
+    return archive
+
+
+def _lire(table, email=None, formation_id=None, depuis=None):
+    cols = COLONNES[table]
+    where, params = [], []
+    for cond, valeur in (("email=?", email), ("formation_id=?", formation_id), ("timestamp>=?", depuis)):
+        if valeur is not None:
+            where.append(cond)
+            params.append(valeur)
+    sql = f"SELECT {', '.join(cols)} FROM {table}" + (f" WHERE {' AND '.join(where)}" if where else "")
+    vivant = [row for part in partitions.fan_out(table, sql, tuple(params)) for row in part]
+    frames = [pd.DataFrame(vivant, columns=cols), lire_archive(table, email, formation_id, depuis)]
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+
+
+def lire_progress(email=None, formation_id=None, depuis=None):
+    return _lire("progress", email, formation_id, depuis)
+
+
+def lire_tests(email=None, formation_id=None):
+    return _lire("tests", email, formation_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive les lignes froides de progress / tests en Parquet")
+    parser.add_argument("--horizon", type=int, default=365, help="âge en jours au-delà duquel progress est archivé")
+    parser.add_argument("--retirees", default="", help="ids de formations retirées, séparés par des virgules")
+    parser.add_argument("--vacuum", action="store_true", help="compacte les fichiers SQLite après suppression")
+    args = parser.parse_args()
+    ids = [int(x) for x in args.retirees.split(",") if x.strip()]
+    print(archiver(args.horizon, ids, args.vacuum))
@@ -0,0 +1,72 @@
+"""Ressources statiques locales (logos, fonds, avatars) servies par Streamlit depuis static/.
+
+Les sources sont dans assets/ ; la construction les copie dans static/ sous un
+nom contenant l'empreinte de leur contenu (logo_ocp.3f2a9c1e07.svg) et écrit
+static/manifest.json. L'application ne connaît que les noms logiques et passe
+par url() / chemin() : une ressource modifiée change d'URL, les navigateurs et
+le proxy peuvent donc garder les anciennes indéfiniment.
+
+    python assets.py        # reconstruit static/ après modification de assets/
+
+Streamlit envoie "Cache-Control: no-cache" sur app/static ; en production le
+proxy ajoute "Cache-Control: public, max-age=31536000, immutable" aux URL
+app/static/*.<empreinte>.* (leur contenu ne change jamais).
+"""
+import hashlib
+import json
+import os
+import shutil
+
+SOURCE = "assets"
+STATIC = "static"
+MANIFEST = os.path.join(STATIC, "manifest.json")
+PREFIXE_URL = "app/static/"
+
+_manifest = None
+
+
+def construire():
+    """Copie assets/ vers static/ avec noms à empreinte, supprime les anciennes versions, écrit le manifest."""
+    os.makedirs(STATIC, exist_ok=True)
+    manifest = {}
+    for nom in sorted(os.listdir(SOURCE)):
+        src = os.path.join(SOURCE, nom)
+        if not os.path.isfile(src):
+            continue
+        with open(src, "rb") as f:
+            empreinte = hashlib.sha256(f.read()).hexdigest()[:10]
+        base, ext = os.path.splitext(nom)
+        manifest[nom] = f"{base}.{empreinte}{ext}"
+        shutil.copyfile(src, os.path.join(STATIC, manifest[nom]))
+    a_garder = set(manifest.values()) | {"manifest.json"}
+    for nom in os.listdir(STATIC):
+        if nom not in a_garder:
+            os.remove(os.path.join(STATIC, nom))
+    with open(MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def manifest():
+    global _manifest
+    if _manifest is None:
+        if not os.path.exists(MANIFEST):
+            construire()
+        with open(MANIFEST, encoding="utf-8") as f:
+            _manifest = json.load(f)
+    return _manifest
+
+
+def url(nom):
+    """URL navigateur d'une ressource (à utiliser dans le HTML / CSS)."""
+    return PREFIXE_URL + manifest()[nom]
+
+
+def chemin(nom):
+    """Chemin disque d'une ressource (st.image, FPDF)."""
+    return os.path.join(STATIC, manifest()[nom])
+
+
+if __name__ == "__main__":
+    for logique, fichier in construire().items():
+        print(f"{logique} -> {STATIC}/{fichier}")
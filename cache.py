@@ -0,0 +1,158 @@
+"""Cache en mémoire des données de référence (formations, chapitres, employés).
+
+Chaque entrée est rangée sous (nom de la fonction, arguments, générations des
+entités lues). Toute écriture appelle invalider(entité), qui incrémente la
+génération de l'entité : les entrées qui en dépendent ne sont plus jamais
+retrouvées et sortent par éviction LRU (TAILLE entrées au plus pour tout le
+process). Les lectures par utilisateur (statistiques d'un apprenant) ont leur
+propre zone LRU de TAILLE_UTILISATEURS entrées, pour ne pas évincer les données
+de référence. Les valeurs renvoyées sont partagées entre les sessions : ne pas
+les modifier.
+
+Les générations sont partagées par tous les process (plusieurs serveurs
+Streamlit, workers de jobs.py) via la table generations de system.db.
+Avant chaque lecture, PRAGMA data_version dit si un autre process a écrit
+dans la base depuis la dernière vérification (aucune lecture de table sinon) ;
+seules les lignes modifiées depuis (colonne seq) sont relues, seules les
+entités dont la génération a changé sont invalidées, et les
+fonctions abonnées (abonner) à ces entités sont appelées pour vider leurs
+propres caches (paramètres, sites des utilisateurs...).
+
+Entités : formations, chapitres, prerequis, questions, employes, utilisateurs,
+parametres, progress (opérations en masse sur progress/tests : réinitialisation,
+suppression, archivage, changement de partition), progress:<email> (écritures
+d'un apprenant, qui n'invalident que ses propres statistiques).
+
+    @cache.reference("formations")
+    def formations():
+        return tuple(conn.execute("SELECT ...").fetchall())
+"""
+import functools
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DB = os.environ.get("FM_CACHE_DB", "system.db")
+TAILLE = int(os.environ.get("FM_CACHE_TAILLE", "512"))
+TAILLE_UTILISATEURS = int(os.environ.get("FM_CACHE_TAILLE_UTILISATEURS", "2048"))
+TAILLES = {"reference": TAILLE, "utilisateurs": TAILLE_UTILISATEURS}
+
+_conn = None
+_version = None
+_seq = -1
+_entrees = {zone: OrderedDict() for zone in TAILLES}
+_generations = {}
+_abonnes = {}
+_lock = threading.Lock()
+_lock_base = threading.Lock()
+_stats = {"succes": 0, "echecs": 0, "synchronisations": 0}
+
+
+def connexion():
+    global _conn
+    with _lock_base:
+        if _conn is None:
+            _conn = sqlite3.connect(DB, timeout=30, check_same_thread=False, isolation_level=None)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    entite TEXT PRIMARY KEY, valeur INTEGER NOT NULL, seq INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            if "seq" not in [r[1] for r in _conn.execute("PRAGMA table_info(generations)")]:
+                _conn.execute("ALTER TABLE generations ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            _conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_seq ON generations(seq)")
+    return _conn
+
+
+def abonner(entite, fonction):
+    """fonction() sera appelée à chaque changement de l'entité, local ou venu d'un autre process."""
+    _abonnes.setdefault(entite, []).append(fonction)
+
+
+def _prevenir(entites):
+    for entite in entites:
+        for fonction in _abonnes.get(entite, ()):
+            fonction()
+
+
+def synchroniser():
+    """Reprend les générations écrites par les autres process ; coût : un PRAGMA si rien n'a changé."""
+    global _version, _seq
+    conn = connexion()
+    with _lock_base:
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == _version:
+            return []
+        _version = version
+        lignes = conn.execute("SELECT entite, valeur, seq FROM generations WHERE seq > ?", (_seq,)).fetchall()
+        _seq = max([_seq] + [s for _, _, s in lignes])
+        distantes = {e: v for e, v, _ in lignes}
+    with _lock:
+        changees = [e for e, v in distantes.items() if _generations.get(e) != v]
+        _generations.update(distantes)
+        _stats["synchronisations"] += 1
+    _prevenir(changees)
+    return changees
+
+
+def generation(entite):
+    return _generations.get(entite, 0)
+
+
+def invalider(*entites):
+    """À appeler après toute écriture (commitée) sur ces entités, dans n'importe quel process."""
+    conn = connexion()
+    with _lock_base:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # seq croît à chaque écriture : les autres process ne relisent que les lignes plus récentes
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM generations").fetchone()[0]
+            valeurs = {e: conn.execute("""
+                INSERT INTO generations(entite, valeur, seq) VALUES(?, 1, ?)
+                ON CONFLICT(entite) DO UPDATE SET valeur = valeur + 1, seq = excluded.seq
+                RETURNING valeur
+            """, (e, seq)).fetchall()[0][0] for e in entites}
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    with _lock:
+        _generations.update(valeurs)
+    _prevenir(entites)
+
+
+def lire(cle, entites, calcul, zone="reference"):
+    """Valeur en cache pour cle, sinon calcul() ; valide tant que les entités ne changent pas."""
+    synchroniser()
+    cle = (cle, tuple(generation(e) for e in entites))
+    entrees = _entrees[zone]
+    with _lock:
+        if cle in entrees:
+            entrees.move_to_end(cle)
+            _stats["succes"] += 1
+            return entrees[cle]
+        _stats["echecs"] += 1
+    valeur = calcul()
+    with _lock:
+        entrees[cle] = valeur
+        entrees.move_to_end(cle)
+        while len(entrees) > TAILLES[zone]:
+            entrees.popitem(last=False)
+    return valeur
+
+
+def reference(*entites):
+    """Décorateur : met en cache le résultat de la fonction, par arguments, pour les entités données."""
+    def decorer(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(*args):
+            return lire((fonction.__qualname__,) + args, entites, lambda: fonction(*args))
+        return enveloppe
+    return decorer
+
+
+def stats():
+    with _lock:
+        return {**_stats, "entrees": {zone: len(e) for zone, e in _entrees.items()}, "generations": dict(_generations), "data_version": _version}
@@ -0,0 +1,218 @@
+"""Génération et stockage des certificats PDF (sans streamlit, utilisable depuis un worker).
+
+Un certificat est délivré une seule fois, au moment où le test est validé
+(tâche "certificat" de jobs.py) : le PDF est rangé dans DOSSIER sous
+l'empreinte sha256 de (email, formation, révision, date de délivrance), et
+ses métadonnées dans la table certificats (certificats.db). Les
+téléchargements suivants ne font que lire le fichier. Un PDF manquant (ex.
+après restauration des bases) est régénéré à l'identique depuis les
+métadonnées.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+from fpdf import FPDF
+
+import assets
+
+DB = os.environ.get("FM_CERT_DB", "certificats.db")
+DOSSIER = os.environ.get("FM_CERT_DIR", "certificats_delivres")
+
+_conn = None
+_lock = threading.Lock()
+
+
+def traduire(lang, fr, en, es):
+    if lang == "English":
+        return en
+    if lang == "Español":
+        return es
+    return fr
+
+
+# Génération de certificat PDF avec logo
+def creer_certificat(nom, formation, date_certif, lang="Français", filename=None):
+    def t(fr, en, es):
+        return traduire(lang, fr, en, es)
+
+    # Logo local (FPDF ne lit que PNG/JPEG)
+    logo_path = assets.chemin("logo_ocp.png")
+
+    pdf = FPDF()
+    pdf.add_page()
+
+    if logo_path and os.path.exists(logo_path):
+        logo_w = 50  # largeur du logo en mm
+        x_center = (pdf.w - logo_w) / 2
+        y_logo = 18
+        pdf.image(logo_path, x=x_center, y=y_logo, w=logo_w)
+
+    # Titre principal
+    pdf.set_font("Arial", "B", 26)
+    pdf.set_text_color(44, 110, 73)
+    pdf.ln(45)
+    pdf.cell(
+        0, 18,
+        t("CERTIFICAT DE FORMATION", "TRAINING CERTIFICATE", "CERTIFICADO DE FORMACIÓN"),
+        ln=1, align="C"
+    )
+    pdf.ln(5)
+
+    # Cadre
+    pdf.set_draw_color(44, 110, 73)
+    pdf.set_line_width(1)
+    pdf.rect(10, 30, 190, 240)
+
+    # Texte central
+    pdf.set_xy(20, 60)
+    pdf.set_font("Arial", "", 14)
+    pdf.set_text_color(0, 0, 0)
+
+    texte = f'''
+    {t("Ce certificat est décerné à :",
+    "This certificate is awarded to:",
+    "Este certificado se otorga a:")}
+
+    {nom}
+
+    {t("Pour avoir suivi avec succès la formation :",
+    "For successfully completing the training:",
+    "Por haber completado con éxito la formación:")}
+
+    "{formation}"
+
+    {t("Délivré le :",
+    "Issued on:",
+    "Emitido el:")} {date_certif.strftime("%d/%m/%Y")}
+
+    {t("Ce certificat atteste de la participation active, de l'assiduité et de l'engagement",
+    "This certificate certifies active participation, regular attendance, and commitment",
+    "Este certificado certifica la participación activa, la asistencia regular y el compromiso")}
+
+    {t("dans le cadre d'un programme de développement professionnel.",
+    "as part of a professional development program.",
+    "como parte de un programa de desarrollo profesional.")}
+    '''
+
+    # —————— Correction Unicode pour FPDF ——————
+    # Remplace les apostrophes typographiques ’ par '
+    texte = texte.replace("’", "'")
+
+    pdf.multi_cell(0, 10, texte, align="C")
+
+    # Signature RH
+    pdf.set_xy(120, 220)
+    pdf.set_font("Arial", "I", 12)
+    pdf.cell(0, 10, t("Signature RH","HR Signature","Firma RRHH"), ln=1)
+    pdf.set_xy(120, 230)
+    pdf.set_font("Arial", "", 16)
+    pdf.set_text_color(100, 100, 100)
+    pdf.cell(0, 10, t("/ abdelkebir RH /","/ abdelkebir HR /","/ abdelkebir RRHH /"), ln=1)
+
+    if filename is None:
+        filename = f"Certificat_{nom.replace(' ', '_')}.pdf"
+    pdf.output(filename)
+    return filename
+
+
+def connexion():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB, timeout=30, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.executescript("""
+                CREATE TABLE IF NOT EXISTS certificats (
+                    empreinte TEXT PRIMARY KEY,
+                    email TEXT NOT NULL, formation_id INTEGER NOT NULL, revision INTEGER NOT NULL,
+                    delivre_le TEXT NOT NULL,
+                    nom TEXT NOT NULL, formation TEXT NOT NULL, lang TEXT NOT NULL,
+                    taille INTEGER, cree_le REAL NOT NULL,
+                    UNIQUE(email, formation_id, revision)
+                ) WITHOUT ROWID;
+            """)
+    return _conn
+
+
+def empreinte(email, formation_id, revision, delivre_le):
+    cle = "\x1f".join((email.strip().lower(), str(formation_id), str(revision), delivre_le))
+    return hashlib.sha256(cle.encode("utf-8")).hexdigest()
+
+
+def chemin(empreinte_):
+    # Deux caractères de préfixe par sous-dossier : pas de dossier géant
+    return os.path.join(DOSSIER, empreinte_[:2], f"{empreinte_}.pdf")
+
+
+def _rendre(row):
+    empreinte_, nom, formation, delivre_le, lang = row
+    dest = chemin(empreinte_)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    creer_certificat(nom, formation, date.fromisoformat(delivre_le), lang, tmp)
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+
+def delivrer(email, formation_id, revision, delivre_le, nom, formation, lang="Français"):
+    """Délivre le certificat (une seule fois par email, formation et révision) ; renvoie son empreinte."""
+    conn = connexion()
+    with _lock:
+        conn.execute("""
+            INSERT OR IGNORE INTO certificats(empreinte, email, formation_id, revision, delivre_le, nom, formation, lang, cree_le)
+            VALUES(?,?,?,?,?,?,?,?,?)
+        """, (empreinte(email, formation_id, revision, delivre_le), email, formation_id, revision,
+              delivre_le, nom, formation, lang, time.time()))
+        conn.commit()
+        row = conn.execute(
+            "SELECT empreinte, nom, formation, delivre_le, lang FROM certificats WHERE email=? AND formation_id=? AND revision=?",
+            (email, formation_id, revision)
+        ).fetchone()
+    if not os.path.exists(chemin(row[0])):
+        taille = _rendre(row)
+        with _lock:
+            conn.execute("UPDATE certificats SET taille=? WHERE empreinte=?", (taille, row[0]))
+            conn.commit()
+    return row[0]
+
+
+def programmer(email, formation_id, revision, delivre_le, nom, formation, lang="Français"):
+    """Demande la délivrance (jobs.lancer), sauf si elle est déjà en file pour cet email, cette formation et cette révision."""
+    import jobs  # import tardif : jobs.py référence ce module pour sa tâche
+    if jobs.connexion().execute("""
+        SELECT 1 FROM jobs
+        WHERE type='certificat' AND statut IN ('en_attente','en_cours')
+          AND json_extract(payload, '$.email')=? AND json_extract(payload, '$.formation_id')=?
+          AND json_extract(payload, '$.revision')=?
+    """, (email, formation_id, revision)).fetchone():
+        return None
+    return jobs.lancer("certificat", {
+        "email": email, "formation_id": formation_id, "revision": revision, "delivre_le": delivre_le,
+        "nom": nom, "formation": formation, "lang": lang
+    })
+
+
+def pour(email):
+    """{(formation_id, revision): (empreinte, delivre_le)} des certificats de l'utilisateur."""
+    rows = connexion().execute(
+        "SELECT formation_id, revision, empreinte, delivre_le FROM certificats WHERE email=?", (email,)
+    ).fetchall()
+    return {(fid, rev): (emp, le) for fid, rev, emp, le in rows}
+
+
+def lire(empreinte_):
+    """Contenu du PDF ; régénéré depuis les métadonnées s'il manque. None si le certificat est inconnu."""
+    path = chemin(empreinte_)
+    if not os.path.exists(path):
+        row = connexion().execute(
+            "SELECT empreinte, nom, formation, delivre_le, lang FROM certificats WHERE empreinte=?", (empreinte_,)
+        ).fetchone()
+        if row is None:
+            return None
+        _rendre(row)
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,164 @@
+"""Analyse des parcours : entonnoir d'abandon par chapitre, délais entre chapitres, carte chapitre x semaine.
+
+progress est lu par lots (LOT lignes) sur toutes les partitions ; chaque lot est
+réduit à des tableaux NumPy compacts (formation, apprenant, position du
+chapitre, horodatage epoch, jour local), puis tous les calculs sont vectorisés.
+progress.timestamp est une heure locale sans fuseau : les délais sont calculés
+sur l'heure epoch correspondante, la carte regroupe par jour local (comme les
+agrégats de tentatives, partitions.py).
+Le résultat couvre toutes les formations en une passe et reste en cache
+DUREE_CACHE secondes, ou jusqu'à un changement des formations, des chapitres ou
+des progressions (invalider(), appelée aussi depuis les autres process via cache.py).
+Les lectures passent par analytique.py (instantané ou connexions en lecture
+seule), plus les progressions déjà archivées (archive.lire_archive).
+"""
+import gc
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import analytique
+import archive
+import cache
+
+LOT = 500_000
+DUREE_CACHE = 600
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _chapitres():
+    """DataFrame (chapter_id, formation_id, position, ordre, titre) ; position = rang 0..n-1 dans la formation."""
+    df = pd.read_sql_query(
+        "SELECT id AS chapter_id, formation_id, ordre, titre FROM chapitres ORDER BY formation_id, ordre, id",
+        analytique.connexion("formations.db")
+    )
+    df["position"] = df.groupby("formation_id").cumcount()
+    return df
+
+
+def _epoch(locales):
+    """Secondes epoch d'heures locales sans fuseau (Series datetime64), décalage du fuseau pris à midi de chaque jour."""
+    jours = locales.dt.normalize()
+    decalages = {
+        j: (j + pd.Timedelta(hours=12) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+           - int(time.mktime((j + pd.Timedelta(hours=12)).timetuple()))
+        for j in jours.dropna().unique()
+    }
+    return (locales - pd.Timestamp(0)) // pd.Timedelta(seconds=1) - jours.map(decalages)
+
+
+def _lire_progress(chapitres):
+    """Tableaux (formation, apprenant, position, ts epoch, jour local) de toutes les partitions, lus par lots."""
+    # Table de correspondance id de chapitre -> position (-1 : chapitre supprimé)
+    position = np.full(int(chapitres["chapter_id"].max()) + 1 if len(chapitres) else 1, -1, np.int64)
+    position[chapitres["chapter_id"].to_numpy()] = chapitres["position"].to_numpy()
+    emails = {}
+    morceaux = []
+
+    def lot(email, form, chap, ts, jour):
+        codes, uniques = pd.factorize(np.asarray(email, dtype=object))
+        globaux = np.array([emails.setdefault(e, len(emails)) for e in uniques], np.int64)
+        chap = np.fromiter(chap, np.int64, len(codes))
+        ts = pd.to_numeric(pd.Series(ts), errors="coerce").to_numpy()
+        jour = pd.to_numeric(pd.Series(jour), errors="coerce").to_numpy()
+        pos = np.where(chap < len(position), position[np.minimum(chap, len(position) - 1)], -1)
+        garde = (pos >= 0) & ~np.isnan(ts) & ~np.isnan(jour)
+        morceaux.append((
+            np.fromiter(form, np.int64, len(codes))[garde], globaux[codes][garde],
+            pos[garde], ts[garde].astype(np.int64), jour[garde].astype(np.int64),
+        ))
+
+    # Progressions archivées (formations réussies depuis longtemps, formations retirées) en premier :
+    # un chapitre relu depuis l'archivage garde sa première lecture
+    arch = archive.lire_archive("progress")
+    if len(arch):
+        locales = pd.to_datetime(arch["timestamp"], errors="coerce")
+        lot(arch["email"].to_numpy(), arch["formation_id"].to_numpy(), arch["chapter_id"].to_numpy(),
+            _epoch(locales), (locales.dt.normalize() - pd.Timestamp(0)) // pd.Timedelta(days=1))
+    gc.disable()   # des millions de tuples : le ramasse-miettes ralentirait la lecture sans rien libérer
+    try:
+        for cur in analytique.curseurs(
+            "progress",
+            "SELECT email, formation_id, chapter_id, unixepoch(timestamp, 'utc'), unixepoch(date(timestamp)) / 86400 FROM progress"
+        ):
+            while True:
+                rows = cur.fetchmany(LOT)
+                if not rows:
+                    break
+                lot(*zip(*rows))
+    finally:
+        gc.enable()
+    if not morceaux:
+        vide = np.empty(0, np.int64)
+        return vide, vide, vide, vide, vide
+    form, appr, pos, ts, jour = (np.concatenate(col) for col in zip(*morceaux))
+    if len(arch):
+        _, premieres = np.unique(np.stack([form, appr, pos]), axis=1, return_index=True)
+        premieres.sort()
+        form, appr, pos, ts, jour = form[premieres], appr[premieres], pos[premieres], ts[premieres], jour[premieres]
+    return form, appr, pos, ts, jour
+
+
+def calculer():
+    """{formation_id: {"entonnoir", "delais", "carte"}} (DataFrames) pour toutes les formations."""
+    chapitres = _chapitres()
+    form, appr, pos, ts, jour = _lire_progress(chapitres)
+
+    # Entonnoir : un apprenant "atteint" un chapitre s'il a lu celui-ci ou un chapitre plus loin
+    df = pd.DataFrame({"formation_id": form, "apprenant": appr, "position": pos})
+    plus_loin = df.groupby(["formation_id", "apprenant"], sort=False)["position"].max()
+    arrets = plus_loin.reset_index().groupby(["formation_id", "position"]).size()
+    lus = df.groupby(["formation_id", "position"]).size()
+
+    # Délais : lectures triées par (formation, apprenant, date) ; écart avec la lecture précédente
+    ordre = np.lexsort((ts, appr, form))
+    f_s, a_s, p_s, t_s = form[ordre], appr[ordre], pos[ordre], ts[ordre]
+    suite = (f_s[1:] == f_s[:-1]) & (a_s[1:] == a_s[:-1])
+    delais = pd.DataFrame({
+        "formation_id": f_s[1:][suite], "position": p_s[1:][suite],
+        "minutes": (t_s[1:] - t_s[:-1])[suite] / 60.0,
+    }).groupby(["formation_id", "position"])["minutes"].median()
+
+    # Carte chapitre x semaine (lundi local de la semaine de lecture)
+    semaine = (jour - (jour + 3) % 7) * 86400       # 1970-01-01 était un jeudi
+    carte = pd.DataFrame({"formation_id": form, "position": pos, "semaine": semaine}) \
+        .groupby(["formation_id", "position", "semaine"]).size().rename("lectures").reset_index()
+    carte["semaine"] = pd.to_datetime(carte["semaine"], unit="s")
+    cartes = dict(tuple(carte.groupby("formation_id")))
+
+    res = {}
+    for fid, chs in chapitres.groupby("formation_id"):
+        base = chs[["position", "ordre", "titre"]].reset_index(drop=True)
+        index = pd.MultiIndex.from_product([[fid], base["position"]])
+        # Atteints au chapitre k = apprenants arrêtés en k ou plus loin (somme cumulée inversée)
+        atteints = arrets.reindex(index, fill_value=0).to_numpy()[::-1].cumsum()[::-1]
+        ent = base.assign(atteints=atteints, lus=lus.reindex(index, fill_value=0).to_numpy())
+        ent["part"] = ent["atteints"] / atteints[0] if atteints[0] else 0.0
+        dl = base.assign(minutes_mediane=delais.reindex(index).to_numpy())
+        ct = cartes.get(fid, carte.iloc[:0]).merge(base, on="position")[["ordre", "titre", "semaine", "lectures"]]
+        res[fid] = {"entonnoir": ent, "delais": dl, "carte": ct}
+    return res
+
+
+def analyses(forcer=False):
+    """Résultat en cache : (calculé_le, {formation_id: ...})."""
+    cache.synchroniser()
+    with _lock:
+        entree = _cache.get("res")
+        if forcer or entree is None or time.time() - entree[0] > DUREE_CACHE:
+            entree = (time.time(), calculer())
+            _cache["res"] = entree
+        return entree
+
+
+def invalider():
+    _cache.pop("res", None)
+
+
+# Chapitres, formations ou progressions modifiés, y compris par un autre process (cache.py)
+for _entite in ("formations", "chapitres", "progress"):
+    cache.abonner(_entite, invalider)
@@ -0,0 +1,94 @@
+"""Photos de profil : variantes réduites générées à l'envoi et avatars par défaut locaux.
+
+Une photo envoyée est ramenée à TAILLE_MAX puis déclinée en vignettes carrées
+de 48, 120 et 200 px (WebP, JPEG en secours) : les listes et profils
+n'envoient jamais la photo d'origine au navigateur.
+
+    user_photos/selma.jpg        # photo bornée à TAILLE_MAX (valeur de photo_path)
+    user_photos/selma_120.webp   # vignette servie pour un affichage en 120 px
+"""
+import base64
+import io
+import os
+import re
+
+from PIL import Image, ImageOps
+
+import assets
+
+DOSSIER = "user_photos"
+TAILLES = (48, 120, 200)
+TAILLE_MAX = 800
+QUALITE = 82
+
+
+def _nom_fichier(email):
+    return re.sub(r"[^a-z0-9]+", "_", email.lower()).strip("_") or "photo"
+
+
+def _ouvrir(source):
+    img = Image.open(source)
+    img = ImageOps.exif_transpose(img)   # photos de téléphone prises en portrait
+    return img.convert("RGB")
+
+
+def _chemin_variante(photo_path, taille, ext):
+    base, _ = os.path.splitext(photo_path)
+    return f"{base}_{taille}.{ext}"
+
+
+def _ecrire_variantes(img, photo_path):
+    for taille in TAILLES:
+        vignette = ImageOps.fit(img, (taille, taille), Image.LANCZOS)
+        vignette.save(_chemin_variante(photo_path, taille, "webp"), "WEBP", quality=QUALITE, method=6)
+        vignette.save(_chemin_variante(photo_path, taille, "jpg"), "JPEG", quality=QUALITE, optimize=True)
+
+
+def enregistrer_photo(donnees, email):
+    """Enregistre une photo envoyée (bytes) et ses variantes ; renvoie le chemin à stocker dans photo_path."""
+    os.makedirs(DOSSIER, exist_ok=True)
+    img = _ouvrir(io.BytesIO(donnees))
+    img.thumbnail((TAILLE_MAX, TAILLE_MAX), Image.LANCZOS)
+    photo_path = os.path.join(DOSSIER, _nom_fichier(email) + ".jpg")
+    img.save(photo_path, "JPEG", quality=QUALITE, optimize=True, progressive=True)
+    _ecrire_variantes(img, photo_path)
+    return photo_path
+
+
+def variante(photo_path, taille, ext="webp"):
+    """Chemin de la plus petite variante >= taille ; générée au besoin (photos antérieures au pipeline)."""
+    if photo_path:
+        photo_path = photo_path.replace("\\", "/")   # chemins enregistrés sous Windows
+    if not photo_path or not os.path.exists(photo_path):
+        return None
+    taille = next((t for t in TAILLES if t >= taille), TAILLES[-1])
+    chemin = _chemin_variante(photo_path, taille, ext)
+    if not os.path.exists(chemin):
+        _ecrire_variantes(_ouvrir(photo_path), photo_path)
+    return chemin
+
+
+def avatar(genre_homme):
+    return assets.chemin("avatar_homme.svg" if genre_homme else "avatar_femme.svg")
+
+
+def photo_ou_avatar(photo_path, taille, genre_homme=True):
+    return variante(photo_path, taille) or avatar(genre_homme)
+
+
+def data_uri(photo_path, taille=48):
+    """Vignette embarquée (data URI) pour les colonnes image des tableaux ; None sans photo."""
+    chemin = variante(photo_path, taille)
+    if chemin is None:
+        return None
+    with open(chemin, "rb") as f:
+        return "data:image/webp;base64," + base64.b64encode(f.read()).decode()
+
+
+def apercu(donnees, taille=200):
+    """Aperçu réduit (bytes WebP) d'une photo pas encore enregistrée."""
+    img = _ouvrir(io.BytesIO(donnees))
+    img.thumbnail((taille, taille), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", quality=QUALITE)
+    return buf.getvalue()
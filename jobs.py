@@ -0,0 +1,289 @@
+"""File de tâches durable (jobs.db) et workers pour les opérations lourdes.
+
+L'application dépose une tâche avec lancer() et rend la main tout de suite ;
+les workers la réclament, l'exécutent puis l'acquittent. Sans worker actif,
+lancer() exécute la tâche dans la session ; les tâches planifiées
+(planifier() : sauvegardes, instantané analytique, digests, recommandations)
+restent en file jusqu'au démarrage d'un worker, et chaque appelant décide de
+ce qu'il fait en attendant (voir le module de la tâche). Pendant l'exécution,
+le worker prolonge son bail (délai de visibilité) toutes les HEARTBEAT
+secondes : une tâche longue (digest, archivage, sauvegarde) n'est pas
+reprise par un autre worker, alors qu'une tâche réclamée par un worker mort
+redevient visible après VISIBILITE secondes. Acquittement et échec ne
+valent que pour le worker qui détient le bail. Une tâche en erreur est
+retentée avec un délai croissant jusqu'à max_tentatives.
+
+    python jobs.py --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+import operations
+import certificats
+import analytique
+import recherche
+import sauvegarde
+
+DB = os.environ.get("FM_JOBS_DB", "jobs.db")
+VISIBILITE = 300        # secondes sans prolongation avant qu'une tâche réclamée redevienne visible
+HEARTBEAT = 10          # fréquence de signalement des workers et de prolongation des baux
+ATTENTE_VIDE = 1.0      # pause quand la file est vide
+
+
+def certificat(email, formation_id, revision, delivre_le, nom, formation, lang="Français"):
+    return certificats.delivrer(email, formation_id, revision, delivre_le, nom, formation, lang)
+
+
+def archiver(horizon_jours=365, formations_retirees=()):
+    import archive  # pyarrow n'est chargé que par les workers qui archivent
+    return archive.archiver(horizon_jours, formations_retirees)
+
+
+def recommander():
+    import recommandations  # numpy / scipy
+    return recommandations.rafraichir()
+
+
+def envoyer_notifications():
+    import notifications
+    return notifications.envoyer_digests()
+
+
+# Types de tâches : nom -> fonction appelée avec le payload en arguments nommés
+TACHES = {
+    "reinitialiser_indicateurs": operations.reinitialiser_indicateurs,
+    "supprimer_formation": operations.supprimer_formation,
+    "certificat": certificat,
+    "archiver": archiver,
+    "notifications": envoyer_notifications,
+    "indexer_chapitres": recherche.indexer,
+    "recommandations": recommander,
+    "sauvegarde": sauvegarde.tache,
+    "analytique": analytique.tache,
+}
+
+
+def get_conn():
+    conn = sqlite3.connect(DB, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL, payload TEXT NOT NULL,
+            statut TEXT NOT NULL DEFAULT 'en_attente',
+            tentatives INTEGER NOT NULL DEFAULT 0,
+            max_tentatives INTEGER NOT NULL DEFAULT 3,
+            visible_a REAL NOT NULL,
+            cree_le REAL NOT NULL, maj_le REAL NOT NULL,
+            worker TEXT, erreur TEXT, resultat TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_file ON jobs(statut, visible_a);
+        CREATE TABLE IF NOT EXISTS workers (
+            nom TEXT PRIMARY KEY, vu_le REAL NOT NULL
+        );
+    """)
+    return conn
+
+
+_conn = None
+_lock = threading.Lock()
+
+
+def connexion():
+    """Connexion partagée du process (l'application) ; chaque worker ouvre la sienne."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = get_conn()
+    return _conn
+
+
+def enqueue(type_, payload=None, delai=0, max_tentatives=3, conn=None):
+    if type_ not in TACHES:
+        raise ValueError(f"Type de tâche inconnu : {type_}")
+    conn = conn or connexion()
+    now = time.time()
+    cur = conn.execute(
+        "INSERT INTO jobs(type, payload, max_tentatives, visible_a, cree_le, maj_le) VALUES(?,?,?,?,?,?)",
+        (type_, json.dumps(payload or {}), max_tentatives, now + delai, now, now)
+    )
+    return cur.lastrowid
+
+
+def claim(worker, visibilite=VISIBILITE, conn=None):
+    """Réserve la plus ancienne tâche visible ; None si la file est vide."""
+    conn = conn or connexion()
+    now = time.time()
+    row = conn.execute("""
+        UPDATE jobs SET statut='en_cours', tentatives=tentatives+1,
+                        visible_a=?, maj_le=?, worker=?
+        WHERE id = (SELECT id FROM jobs
+                    WHERE statut IN ('en_attente','en_cours') AND visible_a <= ?
+                    ORDER BY visible_a, id LIMIT 1)
+        RETURNING id, type, payload, tentatives, max_tentatives
+    """, (now + visibilite, now, worker, now)).fetchone()
+    return row
+
+
+def prolonger(job_id, worker, visibilite=VISIBILITE, conn=None):
+    """Repousse la visibilité d'une tâche en cours ; False si le worker n'en détient plus le bail."""
+    conn = conn or connexion()
+    now = time.time()
+    return conn.execute(
+        "UPDATE jobs SET visible_a=?, maj_le=? WHERE id=? AND worker=? AND statut='en_cours'",
+        (now + visibilite, now, job_id, worker)
+    ).rowcount == 1
+
+
+def ack(job_id, worker, resultat=None, conn=None):
+    """Marque la tâche terminée ; False si le bail a été repris par un autre worker entre-temps."""
+    conn = conn or connexion()
+    return conn.execute(
+        "UPDATE jobs SET statut='termine', resultat=?, erreur=NULL, maj_le=? WHERE id=? AND worker=? AND statut='en_cours'",
+        (json.dumps(resultat, default=str), time.time(), job_id, worker)
+    ).rowcount == 1
+
+
+def nack(job_id, worker, erreur, tentatives, max_tentatives, conn=None):
+    """Échec de la tâche (nouvel essai ou échec définitif) ; False si le worker n'en détient plus le bail."""
+    conn = conn or connexion()
+    now = time.time()
+    if tentatives >= max_tentatives:
+        cur = conn.execute(
+            "UPDATE jobs SET statut='echec', erreur=?, maj_le=? WHERE id=? AND worker=? AND statut='en_cours'",
+            (erreur, now, job_id, worker)
+        )
+    else:
+        # Nouvel essai avec un délai croissant : 10 s, 40 s, 90 s...
+        cur = conn.execute(
+            "UPDATE jobs SET statut='en_attente', erreur=?, visible_a=?, maj_le=? WHERE id=? AND worker=? AND statut='en_cours'",
+            (erreur, now + 10 * tentatives ** 2, now, job_id, worker)
+        )
+    return cur.rowcount == 1
+
+
+def executer(type_, payload):
+    return TACHES[type_](**payload)
+
+
+def workers_actifs(conn=None):
+    conn = conn or connexion()
+    return conn.execute(
+        "SELECT COUNT(*) FROM workers WHERE vu_le >= ?", (time.time() - 3 * HEARTBEAT,)
+    ).fetchone()[0]
+
+
+def lancer(type_, payload=None):
+    """Dépose la tâche si un worker tourne ; sinon l'exécute tout de suite. Renvoie l'id ou None."""
+    conn = connexion()
+    if workers_actifs(conn):
+        return enqueue(type_, payload, conn=conn)
+    executer(type_, payload or {})
+    return None
+
+
+def planifier(type_, delai, payload=None, conn=None):
+    """Garantit une tâche type_ en attente (une seule à la fois), visible dans delai secondes.
+
+    Renvoie False si aucun worker ne tourne : la tâche attend alors en file et
+    l'appelant doit rattraper lui-même (exécution dans la session, à la lecture...).
+    """
+    conn = conn or connexion()
+    if not conn.execute("SELECT 1 FROM jobs WHERE type=? AND statut='en_attente'", (type_,)).fetchone():
+        enqueue(type_, payload, delai=delai, conn=conn)
+    return workers_actifs(conn) > 0
+
+
+def resume(conn=None):
+    conn = conn or connexion()
+    return dict(conn.execute("SELECT statut, COUNT(*) FROM jobs GROUP BY statut").fetchall())
+
+
+def dernieres(limite=50, conn=None):
+    conn = conn or connexion()
+    return conn.execute("""
+        SELECT id, type, statut, tentatives, datetime(cree_le, 'unixepoch', 'localtime'),
+               datetime(maj_le, 'unixepoch', 'localtime'), worker, erreur
+        FROM jobs ORDER BY id DESC LIMIT ?
+    """, (limite,)).fetchall()
+
+
+def relancer(job_id, conn=None):
+    conn = conn or connexion()
+    conn.execute(
+        "UPDATE jobs SET statut='en_attente', tentatives=0, visible_a=?, maj_le=? WHERE id=? AND statut='echec'",
+        (time.time(), time.time(), job_id)
+    )
+
+
+def _entretenir(job_id, nom, fini):
+    """Thread du worker pendant une tâche : prolonge son bail et signale le worker comme vivant."""
+    conn = get_conn()
+    try:
+        while not fini.wait(HEARTBEAT):
+            conn.execute("INSERT OR REPLACE INTO workers(nom, vu_le) VALUES(?,?)", (nom, time.time()))
+            if not prolonger(job_id, nom, conn=conn):
+                print(f"{nom} : bail de la tâche {job_id} perdu")
+                return
+    finally:
+        conn.close()
+
+
+def boucle(nom):
+    conn = get_conn()
+    dernier_signal = 0
+    while True:
+        if time.time() - dernier_signal > HEARTBEAT:
+            conn.execute("INSERT OR REPLACE INTO workers(nom, vu_le) VALUES(?,?)", (nom, time.time()))
+            dernier_signal = time.time()
+        job = claim(nom, conn=conn)
+        if job is None:
+            time.sleep(ATTENTE_VIDE)
+            continue
+        job_id, type_, payload, tentatives, max_tentatives = job
+        if tentatives > max_tentatives:
+            # Réclamée trop de fois par des workers morts en cours de route
+            nack(job_id, nom, "délai de visibilité dépassé", tentatives, max_tentatives, conn=conn)
+            continue
+        fini = threading.Event()
+        bail = threading.Thread(target=_entretenir, args=(job_id, nom, fini), daemon=True)
+        bail.start()
+        try:
+            resultat = executer(type_, json.loads(payload))
+        except Exception:
+            fini.set()
+            bail.join()
+            nack(job_id, nom, traceback.format_exc(limit=5), tentatives, max_tentatives, conn=conn)
+        else:
+            fini.set()
+            bail.join()
+            if not ack(job_id, nom, resultat, conn=conn):
+                print(f"{nom} : tâche {job_id} terminée après la perte de son bail, acquittement ignoré")
+        dernier_signal = time.time()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workers de la file de tâches Formation Manager")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FM_WORKERS", "2")))
+    args = parser.parse_args()
+    get_conn()
+    hote = socket.gethostname()
+    procs = [
+        multiprocessing.Process(target=boucle, args=(f"{hote}-{os.getpid()}-{i}",), daemon=True)
+        for i in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    print(f"{len(procs)} workers démarrés sur {DB}")
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        pass
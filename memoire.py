@@ -0,0 +1,188 @@
+"""Profilage mémoire optionnel (tracemalloc) : par rerun, par session, par onglet et par ligne de code.
+
+Désactivé par défaut : paramètre global memoire_profilage (onglet Tâches) ou
+FM_MEMOIRE=1 au démarrage. Une fois actif :
+
+- debut() / fin() encadrent chaque exécution du script : un instantané
+  tracemalloc avant et après donne les lignes de code qui ont le plus alloué
+  pendant le rerun (allocations encore vivantes à la fin) ;
+- onglets() enveloppe les onglets st.tabs : la mémoire allouée pendant le
+  rendu de chaque onglet est mesurée (compteurs tracemalloc, coût nul) ;
+- la taille de st.session_state est estimée à chaque rerun, par session.
+
+tracemalloc est global au process : quand plusieurs sessions exécutent le
+script en même temps, les écarts mesurés incluent une part de leurs
+allocations. rapport() renvoie le tout en dict (export JSON).
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import parametres
+
+CADRES = 1              # profondeur des piles conservées par tracemalloc (la ligne suffit)
+TOP = 15                # lignes conservées dans les classements
+EXPIRATION = 3600       # une session sans rerun depuis EXPIRATION secondes est oubliée
+
+_lock = threading.Lock()
+_local = threading.local()
+_sessions = {}
+_onglets = {}
+_lignes_rerun = {}
+_filtres = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def actif():
+    valeur = parametres.get_param("memoire_profilage", os.environ.get("FM_MEMOIRE", "0"))
+    return valeur in ("1", "True")
+
+
+def _demarrer():
+    """Démarre ou arrête tracemalloc selon le réglage ; renvoie True s'il tourne."""
+    if actif():
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(CADRES)
+        return True
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        with _lock:
+            _lignes_rerun.clear()
+            _onglets.clear()
+    return False
+
+
+def taille(objet, _vus=None, _profondeur=0):
+    """Estimation (octets) de la mémoire retenue par objet et ce qu'il contient."""
+    vus = _vus if _vus is not None else set()
+    if id(objet) in vus or _profondeur > 20:
+        return 0
+    vus.add(id(objet))
+    memory_usage = getattr(objet, "memory_usage", None)
+    if callable(memory_usage) and hasattr(objet, "columns"):   # DataFrame pandas
+        try:
+            return int(memory_usage(deep=True).sum())
+        except (TypeError, ValueError):
+            pass
+    total = sys.getsizeof(objet, 0)
+    if isinstance(objet, dict):
+        total += sum(taille(k, vus, _profondeur + 1) + taille(v, vus, _profondeur + 1) for k, v in objet.items())
+    elif isinstance(objet, (list, tuple, set, frozenset)):
+        total += sum(taille(v, vus, _profondeur + 1) for v in objet)
+    return total
+
+
+def rss():
+    """(RSS courant, pic de RSS) du process en octets ; None si indisponible."""
+    courant = pic = None
+    try:
+        with open("/proc/self/statm") as f:
+            courant = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # Ko sous Linux
+    except ImportError:   # Windows
+        pass
+    return courant, pic
+
+
+def debut():
+    """À appeler au début de chaque exécution du script."""
+    _local.avant = None
+    if _demarrer():
+        _local.avant = tracemalloc.take_snapshot().filter_traces(_filtres)
+        _local.t0 = time.perf_counter()
+
+
+def fin(session_id, email, etat):
+    """À appeler à la fin de l'exécution (etat : st.session_state)."""
+    avant = getattr(_local, "avant", None)
+    if avant is None or not tracemalloc.is_tracing():
+        return
+    _local.avant = None
+    apres = tracemalloc.take_snapshot().filter_traces(_filtres)
+    ecarts = [s for s in apres.compare_to(avant, "lineno") if s.size_diff > 0][:TOP]
+    octets_etat = taille({k: etat[k] for k in list(etat.keys())})
+    maintenant = time.time()
+    with _lock:
+        for stat in ecarts:
+            cadre = stat.traceback[0]
+            cle = f"{cadre.filename}:{cadre.lineno}"
+            ligne = _lignes_rerun.setdefault(cle, {"ligne": cle, "reruns": 0, "octets": 0, "max": 0})
+            ligne["reruns"] += 1
+            ligne["octets"] += stat.size_diff
+            ligne["max"] = max(ligne["max"], stat.size_diff)
+        session = _sessions.setdefault(session_id, {"session": session_id, "reruns": 0, "etat_max": 0})
+        session.update({
+            "email": email, "derniere": maintenant, "etat": octets_etat,
+            "etat_max": max(session["etat_max"], octets_etat),
+            "duree_ms": round((time.perf_counter() - _local.t0) * 1000, 1),
+            "rerun_octets": sum(s.size_diff for s in apres.compare_to(avant, "filename")),
+        })
+        session["reruns"] += 1
+        for cle in [c for c, s in _sessions.items() if maintenant - s["derniere"] > EXPIRATION]:
+            del _sessions[cle]
+
+
+class _Onglet:
+    """Onglet st.tabs dont le rendu est mesuré."""
+
+    def __init__(self, onglet, nom):
+        self.onglet, self.nom = onglet, nom
+
+    def __enter__(self):
+        self.onglet.__enter__()
+        self.avant = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        courant, pic = tracemalloc.get_traced_memory()
+        with _lock:
+            o = _onglets.setdefault(self.nom, {"onglet": self.nom, "rendus": 0, "retenu": 0, "pic_max": 0})
+            o["rendus"] += 1
+            o["retenu"] = courant - self.avant
+            o["pic_max"] = max(o["pic_max"], pic - self.avant)
+        return self.onglet.__exit__(*exc)
+
+    def __getattr__(self, nom):
+        return getattr(self.onglet, nom)
+
+
+def onglets(tabs, noms):
+    """Enveloppe les onglets pour mesurer chacun (sans effet si le profilage est inactif)."""
+    if not tracemalloc.is_tracing():
+        return tabs
+    return [_Onglet(o, n) for o, n in zip(tabs, noms)]
+
+
+def top_lignes(limite=TOP):
+    """Lignes de code qui retiennent le plus de mémoire maintenant (instantané complet)."""
+    if not tracemalloc.is_tracing():
+        return []
+    stats = tracemalloc.take_snapshot().filter_traces(_filtres).statistics("lineno")[:limite]
+    return [{"ligne": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "octets": s.size, "blocs": s.count}
+            for s in stats]
+
+
+def rapport(vivantes=False):
+    """État complet (sérialisable en JSON) ; vivantes : ajoute top_lignes(), instantané complet (une seconde ou plus)."""
+    courant, pic = rss()
+    traces = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+    with _lock:
+        return {
+            "horodatage": time.time(), "pid": os.getpid(), "actif": tracemalloc.is_tracing(),
+            "rss": courant, "rss_pic": pic, "trace": traces[0], "trace_pic": traces[1],
+            "sessions": sorted((dict(s) for s in _sessions.values()), key=lambda s: -s["etat"]),
+            "onglets": sorted((dict(o) for o in _onglets.values()), key=lambda o: -o["pic_max"]),
+            "lignes_rerun": sorted((dict(l) for l in _lignes_rerun.values()), key=lambda l: -l["octets"])[:TOP],
+            "lignes_vivantes": top_lignes() if vivantes else [],
+        }
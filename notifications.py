@@ -0,0 +1,202 @@
+"""Notifications par email : événements, digests par utilisateur et envoi SMTP.
+
+emettre() n'écrit qu'une ligne dans notifications.db (une seule pour une
+diffusion à tous) et programme une tâche "notifications" dans la file de
+jobs.py si aucune n'est déjà en attente : les événements arrivés pendant la
+fenêtre de regroupement partent dans le même digest. Sans worker actif
+(jobs.py), le digest part tout de suite dans la session, sans regroupement ;
+si le serveur SMTP ne répond pas, les événements restent en base pour le
+prochain envoi. L'envoi se fait ensuite à raison d'un email par utilisateur, sur une connexion SMTP réutilisée et à débit limité,
+en respectant ses préférences notif_form / notif_test / notif_cert.
+
+    python -m aiosmtpd -n -l localhost:8025      # serveur SMTP local de test
+    FM_SMTP_PORT=8025 python notifications.py    # envoie les digests en attente
+"""
+import os
+import smtplib
+import sqlite3
+import time
+from email.message import EmailMessage
+
+import parametres
+
+DB = os.environ.get("FM_NOTIF_DB", "notifications.db")
+FENETRE = int(os.environ.get("FM_NOTIF_FENETRE", "60"))   # secondes de regroupement
+
+SMTP_HOST = os.environ.get("FM_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("FM_SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("FM_SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("FM_SMTP_PASSWORD", "")
+SMTP_TLS = os.environ.get("FM_SMTP_TLS", "") == "1"
+SMTP_FROM = os.environ.get("FM_SMTP_FROM", "formation-manager@ocpgroup.ma")
+SMTP_DEBIT = float(os.environ.get("FM_SMTP_RATE", "50"))        # emails par seconde
+SMTP_PAR_CONNEXION = int(os.environ.get("FM_SMTP_PAR_CONNEXION", "500"))
+
+# Catégorie d'événement -> paramètre de préférence correspondant
+PREFERENCES = {"formation": "notif_form", "test": "notif_test", "certificat": "notif_cert"}
+
+TITRES = {"formation": "Nouvelles formations", "test": "Résultats de tests", "certificat": "Certificats"}
+
+
+def get_conn():
+    conn = sqlite3.connect(DB, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS evenements (
+            id INTEGER PRIMARY KEY,
+            categorie TEXT NOT NULL,
+            email TEXT,
+            sujet TEXT NOT NULL, corps TEXT NOT NULL,
+            cree_le REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_evenements_email ON evenements(email, id);
+        -- Dernier événement déjà envoyé à chaque utilisateur
+        CREATE TABLE IF NOT EXISTS curseurs (
+            email TEXT PRIMARY KEY, dernier_id INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """)
+    return conn
+
+
+def emettre(categorie, sujet, corps, email=None):
+    """Enregistre un événement (email=None : tous les utilisateurs) et programme l'envoi."""
+    conn = get_conn()
+    try:
+        conn.execute(
+            "INSERT INTO evenements(categorie, email, sujet, corps, cree_le) VALUES(?,?,?,?,?)",
+            (categorie, email, sujet, corps, time.time())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    import jobs  # import tardif : jobs.py référence ce module pour sa tâche d'envoi
+    if not jobs.planifier("notifications", FENETRE):
+        try:
+            envoyer_digests()
+        except (OSError, smtplib.SMTPException) as e:
+            # Curseurs non avancés : ces événements partiront avec le prochain envoi
+            print(f"Notifications non envoyées ({e})")
+
+
+def _destinataires():
+    """email -> catégories acceptées (préférences de l'utilisateur, sinon réglage global)."""
+    defaut = {p: parametres.get_param(p, "True") == "True" for p in PREFERENCES.values()}
+    propres = parametres.pour_tous(list(PREFERENCES.values()))
+    users = sqlite3.connect("users.db")
+    try:
+        emails = [r[0] for r in users.execute("SELECT email FROM utilisateurs")]
+    finally:
+        users.close()
+    res = {}
+    for email in emails:
+        prefs = {**defaut, **propres.get(email, {})}
+        res[email] = {c for c, p in PREFERENCES.items() if prefs[p]}
+    return res
+
+
+def _digest(email, evts):
+    msg = EmailMessage()
+    msg["From"] = SMTP_FROM
+    msg["To"] = email
+    msg["Subject"] = evts[0][1] if len(evts) == 1 else f"Formation Manager : {len(evts)} nouvelles notifications"
+    lignes = []
+    for categorie in PREFERENCES:
+        bloc = [(s, c) for cat, s, c in evts if cat == categorie]
+        if bloc:
+            lignes.append(f"== {TITRES[categorie]} ==")
+            lignes.extend(f"- {s}\n  {c}" for s, c in bloc)
+            lignes.append("")
+    msg.set_content("\n".join(lignes))
+    return msg
+
+
+class Expediteur:
+    """Connexion SMTP réutilisée, renouvelée tous les SMTP_PAR_CONNEXION messages, à débit limité."""
+
+    def __init__(self):
+        self.smtp = None
+        self.envoyes = 0
+        self.prochain = time.monotonic()
+
+    def _ouvrir(self):
+        self.fermer()
+        self.smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_TLS:
+            self.smtp.starttls()
+        if SMTP_USER:
+            self.smtp.login(SMTP_USER, SMTP_PASSWORD)
+        self.envoyes = 0
+
+    def envoyer(self, msg):
+        attente = self.prochain - time.monotonic()
+        if attente > 0:
+            time.sleep(attente)
+        self.prochain = max(self.prochain, time.monotonic()) + 1 / SMTP_DEBIT
+        if self.smtp is None or self.envoyes >= SMTP_PAR_CONNEXION:
+            self._ouvrir()
+        try:
+            self.smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._ouvrir()
+            self.smtp.send_message(msg)
+        self.envoyes += 1
+
+    def fermer(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self.smtp = None
+
+
+def envoyer_digests():
+    """Envoie à chaque utilisateur un digest des événements non encore envoyés ; renvoie le nombre d'emails."""
+    conn = get_conn()
+    try:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM evenements").fetchone()[0]
+        curseurs = dict(conn.execute("SELECT email, dernier_id FROM curseurs").fetchall())
+        destinataires = _destinataires()
+        # Un nouvel utilisateur reçoit les événements apparus depuis le dernier envoi ("*")
+        precedent = curseurs.pop("*", 0)
+        for email in destinataires:
+            curseurs.setdefault(email, precedent)
+        depuis = min(curseurs.values(), default=max_id)
+        diffusions = conn.execute(
+            "SELECT id, categorie, sujet, corps FROM evenements WHERE email IS NULL AND id > ? AND id <= ? ORDER BY id",
+            (depuis, max_id)
+        ).fetchall()
+        cibles = {}
+        for eid, email, categorie, sujet, corps in conn.execute(
+            "SELECT id, email, categorie, sujet, corps FROM evenements WHERE email IS NOT NULL AND id > ? AND id <= ? ORDER BY id",
+            (depuis, max_id)
+        ):
+            cibles.setdefault(email, []).append((eid, categorie, sujet, corps))
+
+        expediteur = Expediteur()
+        envoyes = 0
+        try:
+            for i, (email, acceptees) in enumerate(destinataires.items()):
+                curseur = curseurs[email]
+                evts = [e for e in diffusions if e[0] > curseur] + [e for e in cibles.get(email, []) if e[0] > curseur]
+                evts = [(cat, s, c) for _, cat, s, c in sorted(evts) if cat in acceptees]
+                conn.execute("INSERT OR REPLACE INTO curseurs(email, dernier_id) VALUES(?,?)", (email, max_id))
+                if evts:
+                    expediteur.envoyer(_digest(email, evts))
+                    envoyes += 1
+                # Curseur enregistré dès l'envoi : une reprise après erreur ne renvoie pas ce digest
+                if evts or i % 500 == 499:
+                    conn.commit()
+            # "*" n'avance qu'une fois tout le monde servi : après un arrêt en cours de route,
+            # les utilisateurs sans curseur propre reçoivent encore leurs événements à la reprise
+            conn.execute("INSERT OR REPLACE INTO curseurs(email, dernier_id) VALUES('*', ?)", (max_id,))
+            conn.commit()
+        finally:
+            expediteur.fermer()
+        return envoyes
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    print(f"{envoyer_digests()} digest(s) envoyé(s)")
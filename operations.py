@@ -0,0 +1,150 @@
+"""Opérations lourdes sur les données, partagées par l'application et les workers (jobs.py).
+
+Ce module n'importe pas streamlit : il doit pouvoir tourner dans un process worker.
+
+Les opérations qui touchent plusieurs bases passent par une seule connexion
+sur formations.db, les autres bases (tests.db, partitions de progress et de
+tests) étant attachées (ATTACH) : une seule transaction, un seul commit.
+Dans une même base, les dépendances sont des clés étrangères ON DELETE
+CASCADE (chapitres -> formations, options -> questions).
+
+En WAL, SQLite garantit l'atomicité de chaque base mais pas celle de
+l'ensemble en cas de coupure pendant le commit : les lignes dépendantes
+(progressions, tests et tentatives, questions) sont donc supprimées avant la formation,
+pour qu'un arrêt brutal laisse au pire une formation sans indicateurs,
+jamais des lignes orphelines.
+"""
+import sqlite3
+
+import cache
+import partitions
+import prerequis
+
+# Tables nettoyées dans chaque partition (reinitialiser_indicateurs)
+INDICATEURS = {
+    "progress": ("progress",),
+    "tests": ("tests", "sessions_test", "reponses_en_cours"),
+}
+
+# Historique gardé à la réinitialisation (nouvelle révision), supprimé avec la formation
+HISTORIQUE = {
+    "tests": ("tentatives", "tentatives_jour"),
+}
+
+
+def ajouter_cascade(conn, table, parent):
+    """Reconstruit table pour que sa clé étrangère vers parent soit ON DELETE CASCADE (migration idempotente).
+
+    Les lignes orphelines existantes sont supprimées ; index, triggers et
+    compteur AUTOINCREMENT sont conservés.
+    """
+    cles = conn.execute(f"PRAGMA foreign_key_list({table})").fetchall()
+    cle = next((c for c in cles if c[2] == parent), None)
+    if cle is None or cle[6] == "CASCADE":
+        return False
+    colonne, ref = cle[3], cle[4]
+    creation = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+    annexes = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name=? AND type IN ('index','trigger') AND sql IS NOT NULL", (table,)
+    )]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    creation = creation.replace(f"REFERENCES {parent}({ref})", f"REFERENCES {parent}({ref}) ON DELETE CASCADE", 1)
+    creation = creation.replace(table, f"{table}_migration", 1)
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys=OFF")   # sans effet dans une transaction
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"DELETE FROM {table} WHERE {colonne} IS NOT NULL AND {colonne} NOT IN (SELECT {ref} FROM {parent})")
+        conn.execute(creation)
+        conn.execute(f"INSERT INTO {table}_migration SELECT * FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_migration RENAME TO {table}")
+        for sql in annexes:
+            conn.execute(sql)
+        if sequence:
+            conn.execute("UPDATE sqlite_sequence SET seq=MAX(seq, ?) WHERE name=?", (sequence[0], table))
+        if conn.execute(f"PRAGMA foreign_key_check({table})").fetchone():
+            raise sqlite3.IntegrityError(f"{table} : clés étrangères invalides après migration")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    return True
+
+
+def _connexion():
+    conn = sqlite3.connect("formations.db", timeout=30, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys=ON")
+    prerequis.preparer(conn)
+    return conn
+
+
+def _bases_indicateurs():
+    """[(kind, chemin)] de toutes les partitions de progress et de tests (schéma créé si besoin)."""
+    bases = []
+    for kind in INDICATEURS:
+        for cle in partitions.partitions(kind):
+            partitions.connexion(kind, cle)
+            bases.append((kind, partitions.chemin(kind, cle)))
+    return bases
+
+
+def _en_une_transaction(conn, bases, formation_id, supprimer=False):
+    """Vide les indicateurs de la formation dans bases (attachées) ; supprimer : la formation aussi.
+
+    Au-delà de la limite d'ATTACH de SQLite, les partitions en trop sont
+    traitées par lots, avant la transaction finale qui contient la formation.
+    """
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    lots = [bases[i:i + limite] for i in range(0, len(bases), limite)] or [[]]
+    for n, lot in enumerate(lots):
+        dernier = n == len(lots) - 1
+        alias = [f"b{i}" for i in range(len(lot))]
+        for a, (_, chemin) in zip(alias, lot):
+            conn.execute(f"ATTACH DATABASE ? AS {a}", (chemin,))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for a, (kind, chemin) in zip(alias, lot):
+                    for table in INDICATEURS[kind] + (HISTORIQUE.get(kind, ()) if supprimer else ()):
+                        conn.execute(f"DELETE FROM {a}.{table} WHERE formation_id=?", (formation_id,))
+                    # Questions du test, dans tests.db seulement (les options suivent par cascade)
+                    if supprimer and chemin == partitions.chemin("tests") and conn.execute(
+                        f"SELECT 1 FROM {a}.sqlite_master WHERE name='questions'"
+                    ).fetchone():
+                        conn.execute(f"DELETE FROM {a}.questions WHERE formation_id=?", (formation_id,))
+                if supprimer and dernier:
+                    # Fermeture des prérequis des formations qui en dépendaient (prerequis.py)
+                    prerequis.retirer_formation(conn, formation_id)
+                    # Les chapitres suivent par ON DELETE CASCADE (et leur index de recherche par trigger)
+                    conn.execute("DELETE FROM main.formations WHERE id=?", (formation_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            for a in alias:
+                conn.execute(f"DETACH DATABASE {a}")
+
+
+def reinitialiser_indicateurs(formation_id):
+    """Efface progressions, résultats et tests en cours d'une formation sur toutes les partitions."""
+    conn = _connexion()
+    try:
+        _en_une_transaction(conn, _bases_indicateurs(), formation_id)
+    finally:
+        conn.close()
+    cache.invalider("progress")
+
+
+def supprimer_formation(formation_id):
+    """Supprime la formation, ses chapitres, ses prérequis, ses questions et tous ses indicateurs en une transaction."""
+    conn = _connexion()
+    try:
+        _en_une_transaction(conn, _bases_indicateurs(), formation_id, supprimer=True)
+    finally:
+        conn.close()
+    # Souvent exécuté par un worker : les serveurs Streamlit l'apprennent par cache.py
+    cache.invalider("formations", "chapitres", "questions", "prerequis", "progress")
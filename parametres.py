@@ -0,0 +1,144 @@
+"""Paramètres globaux (system_settings) et par utilisateur (user_settings), avec cache en mémoire.
+
+Les lectures sont servies depuis un cache partagé par tout le process et
+rechargé seulement après une écriture, ici ou dans un autre process (entité
+"parametres" de cache.py) : l'affichage des onglets Paramètres ne coûte plus
+aucune requête. Les valeurs par utilisateur sont typées (bool, int,
+float, str) ; sans valeur propre, un utilisateur hérite du paramètre global.
+"""
+import sqlite3
+import threading
+
+import cache
+
+DB = "system.db"
+
+_conn = None
+_lock = threading.Lock()
+_globaux = None
+_utilisateurs = {}
+
+_TYPES = {"bool": lambda v: v == "1", "int": int, "float": float, "str": str}
+
+
+def connexion():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.executescript("""
+                CREATE TABLE IF NOT EXISTS system_settings (
+                    param TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS user_settings (
+                    email TEXT NOT NULL, param TEXT NOT NULL,
+                    value TEXT, type TEXT NOT NULL,
+                    PRIMARY KEY(email, param)
+                ) WITHOUT ROWID;
+            """)
+    return _conn
+
+
+def _encoder(value):
+    if isinstance(value, bool):
+        return "1" if value else "0", "bool"
+    if isinstance(value, int):
+        return str(value), "int"
+    if isinstance(value, float):
+        return repr(value), "float"
+    return str(value), "str"
+
+
+def _decoder(value, type_):
+    return _TYPES.get(type_, str)(value)
+
+
+def _charger_globaux():
+    global _globaux
+    cache.synchroniser()
+    if _globaux is None:
+        _globaux = dict(connexion().execute("SELECT param, value FROM system_settings").fetchall())
+    return _globaux
+
+
+def get_param(param, default=None):
+    return _charger_globaux().get(param, default)
+
+
+def save_param(param, value):
+    conn = connexion()
+    with _lock:
+        conn.execute("""
+            INSERT INTO system_settings(param,value) VALUES(?,?)
+            ON CONFLICT(param) DO UPDATE SET value=excluded.value
+        """, (param, str(value)))
+        conn.commit()
+    cache.invalider("parametres")
+
+
+def invalider_globaux():
+    global _globaux
+    _globaux = None
+
+
+def _charger_utilisateur(email):
+    cache.synchroniser()
+    if email not in _utilisateurs:
+        rows = connexion().execute(
+            "SELECT param, value, type FROM user_settings WHERE email=?", (email,)
+        ).fetchall()
+        _utilisateurs[email] = {p: _decoder(v, ty) for p, v, ty in rows}
+    return _utilisateurs[email]
+
+
+def get(email, param, default=None):
+    """Valeur de l'utilisateur, sinon valeur globale convertie au type du défaut, sinon le défaut."""
+    propres = _charger_utilisateur(email)
+    if param in propres:
+        return propres[param]
+    globale = get_param(param)
+    if globale is None:
+        return default
+    if isinstance(default, bool):
+        return globale in ("True", "1")
+    return type(default)(globale) if default is not None else globale
+
+
+def enregistrer(email, valeurs):
+    """Sauvegarde tout un formulaire de paramètres en une seule transaction."""
+    conn = connexion()
+    with _lock:
+        conn.executemany("""
+            INSERT INTO user_settings(email, param, value, type) VALUES(?,?,?,?)
+            ON CONFLICT(email, param) DO UPDATE SET value=excluded.value, type=excluded.type
+        """, [(email, p) + _encoder(v) for p, v in valeurs.items()])
+        conn.commit()
+    cache.invalider("parametres")
+
+
+def invalider(email=None):
+    if email is None:
+        _utilisateurs.clear()
+    else:
+        _utilisateurs.pop(email, None)
+
+
+def _invalider_tout():
+    invalider_globaux()
+    invalider()
+
+
+cache.abonner("parametres", _invalider_tout)
+
+
+def pour_tous(params):
+    """{email: {param: valeur}} pour les utilisateurs ayant des valeurs propres (lecture en une requête)."""
+    marques = ",".join("?" for _ in params)
+    res = {}
+    for email, p, v, ty in connexion().execute(
+        f"SELECT email, param, value, type FROM user_settings WHERE param IN ({marques})", tuple(params)
+    ):
+        res.setdefault(email, {})[p] = _decoder(v, ty)
+    return res
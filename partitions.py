@@ -0,0 +1,283 @@
+"""Partitionnement optionnel des tables progress et tests.
+
+Par défaut (FM_PARTITION_MODE vide) tout reste dans progress.db et tests.db.
+Avec FM_PARTITION_MODE=site, chaque utilisateur est routé vers les fichiers de
+son site (colonne utilisateurs.site) ; avec FM_PARTITION_MODE=hash, vers l'un
+des FM_PARTITIONS fichiers selon un hash de son email.
+
+    python partitions.py repartir   # déplace les lignes existantes vers leur partition
+
+Relancer `repartir` après avoir activé le partitionnement ; un changement de
+site depuis l'application déplace aussitôt les lignes de l'utilisateur
+(deplacer_utilisateur).
+"""
+import glob
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+
+MODE = os.environ.get("FM_PARTITION_MODE", "")
+NB_PARTITIONS = int(os.environ.get("FM_PARTITIONS", "4"))
+DOSSIER = os.environ.get("FM_PARTITION_DIR", "partitions")
+
+# Agrégats par formation et par jour local (comme les dates affichées), tenus à jour à l'insertion
+# d'une tentative ; l'état courant (tests) suit toujours la dernière tentative
+TRIGGER_TENTATIVES = """
+        CREATE TRIGGER IF NOT EXISTS trg_tentatives_insert AFTER INSERT ON tentatives BEGIN
+            INSERT INTO tentatives_jour(formation_id, jour, tentatives, reussites, somme_scores)
+            VALUES (NEW.formation_id, date(NEW.ts, 'unixepoch', 'localtime'), 1, NEW.passed, NEW.score)
+            ON CONFLICT(formation_id, jour) DO UPDATE SET
+                tentatives = tentatives + 1,
+                reussites = reussites + excluded.reussites,
+                somme_scores = somme_scores + excluded.somme_scores;
+            INSERT INTO tests(email, formation_id, passed)
+            VALUES (NEW.email, NEW.formation_id, NEW.passed)
+            ON CONFLICT(email, formation_id) DO UPDATE SET passed = excluded.passed;
+        END;
+"""
+
+SCHEMAS = {
+    "progress": """
+        CREATE TABLE IF NOT EXISTS progress (
+            email TEXT, formation_id INTEGER,
+            chapter_id INTEGER, timestamp TEXT,
+            PRIMARY KEY(email,formation_id,chapter_id)
+        )
+    """,
+    "tests": """
+        -- État courant par apprenant et formation, écrit par trg_tentatives_insert ; vidé par
+        -- la réinitialisation d'une formation (operations.py) et par l'archivage (archive.py)
+        CREATE TABLE IF NOT EXISTS tests (
+            email TEXT, formation_id INTEGER, passed INTEGER,
+            PRIMARY KEY(email,formation_id)
+        );
+        -- Journal des tentatives, en ajout seul (score en pour mille, durée en secondes, ts en epoch)
+        CREATE TABLE IF NOT EXISTS tentatives (
+            id INTEGER PRIMARY KEY,
+            email TEXT NOT NULL, formation_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL, score INTEGER NOT NULL,
+            duree INTEGER, passed INTEGER NOT NULL, ts INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tentatives_derniere ON tentatives(email, formation_id, id);
+        -- Lus par le tableau de bord (tableau_de_bord.py)
+        CREATE TABLE IF NOT EXISTS tentatives_jour (
+            formation_id INTEGER, jour TEXT,
+            tentatives INTEGER NOT NULL, reussites INTEGER NOT NULL, somme_scores INTEGER NOT NULL,
+            PRIMARY KEY(formation_id, jour)
+        ) WITHOUT ROWID;
+""" + TRIGGER_TENTATIVES + """
+        CREATE TRIGGER IF NOT EXISTS trg_tentatives_update BEFORE UPDATE ON tentatives BEGIN
+            SELECT RAISE(ABORT, 'tentatives est en ajout seul');
+        END;
+        -- Test en cours : tirage des questions, page courante et réponses déjà saisies
+        CREATE TABLE IF NOT EXISTS sessions_test (
+            email TEXT, formation_id INTEGER,
+            seed INTEGER NOT NULL, debut INTEGER NOT NULL, page INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(email, formation_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS reponses_en_cours (
+            email TEXT, formation_id INTEGER, question_id INTEGER,
+            reponse TEXT NOT NULL,
+            PRIMARY KEY(email, formation_id, question_id)
+        ) WITHOUT ROWID;
+    """,
+}
+
+_conns = {}
+_sites = {}
+_lock = threading.Lock()
+
+
+def chemin(kind, cle=""):
+    # La partition "" correspond aux fichiers historiques progress.db / tests.db
+    if not cle:
+        return f"{kind}.db"
+    return os.path.join(DOSSIER, f"{kind}_{cle}.db")
+
+
+def connexion(kind, cle=""):
+    path = chemin(kind, cle)
+    with _lock:
+        conn = _conns.get(path)
+        if conn is None:
+            if cle:
+                os.makedirs(DOSSIER, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMAS[kind])
+            if kind == "tests":
+                _migrer_tentatives(conn)
+            _conns[path] = conn
+    return conn
+
+
+def _migrer_tentatives(conn):
+    """Bases dont le trigger regroupait les tentatives par jour UTC : trigger recréé, agrégats reconstruits."""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='trg_tentatives_insert'").fetchone()[0]
+    if "'localtime'" in sql:
+        return
+    conn.executescript("BEGIN IMMEDIATE;"
+                       "DROP TRIGGER IF EXISTS trg_tentatives_insert;"
+                       "DROP VIEW IF EXISTS derniere_tentative;"
+                       + TRIGGER_TENTATIVES + "COMMIT;")
+    reconstruire_rollups(conn)
+
+
+def _site(email):
+    if email not in _sites:
+        conn = sqlite3.connect("users.db")
+        try:
+            row = conn.execute("SELECT site FROM utilisateurs WHERE email=?", (email,)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        _sites[email] = (row[0] or "") if row else ""
+    return _sites[email]
+
+
+def invalider_site(email=None):
+    if email is None:
+        _sites.clear()
+    else:
+        _sites.pop(email, None)
+
+
+# Site modifié par un autre process : on relit tout
+cache.abonner("utilisateurs", invalider_site)
+
+
+def cle_partition(email):
+    if MODE == "hash":
+        return f"h{zlib.crc32(email.strip().lower().encode()) % NB_PARTITIONS}"
+    if MODE == "site":
+        return re.sub(r"[^a-z0-9]+", "_", _site(email).strip().lower()).strip("_")
+    return ""
+
+
+def conn_progress(email):
+    return connexion("progress", cle_partition(email))
+
+
+def conn_tests(email):
+    return connexion("tests", cle_partition(email))
+
+
+def partitions(kind):
+    cles = {""}
+    if MODE == "hash":
+        cles.update(f"h{i}" for i in range(NB_PARTITIONS))
+    for path in glob.glob(os.path.join(DOSSIER, f"{kind}_*.db")):
+        cles.add(os.path.basename(path)[len(kind) + 1:-3])
+    return sorted(cles)
+
+
+def fan_out(kind, sql, params=()):
+    """Exécute une lecture sur toutes les partitions en parallèle ; une liste de résultats par partition."""
+    cles = partitions(kind)
+    if len(cles) == 1:
+        return [connexion(kind, cles[0]).execute(sql, params).fetchall()]
+    with ThreadPoolExecutor(max_workers=min(8, len(cles))) as pool:
+        return list(pool.map(lambda cle: connexion(kind, cle).execute(sql, params).fetchall(), cles))
+
+
+def executer_partout(kind, sql, params=()):
+    """Applique une écriture (ex. réinitialisation d'une formation) à toutes les partitions."""
+    for cle in partitions(kind):
+        conn = connexion(kind, cle)
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def reconstruire_rollups(conn):
+    conn.execute("DELETE FROM tentatives_jour")
+    conn.execute("""
+        INSERT INTO tentatives_jour(formation_id, jour, tentatives, reussites, somme_scores)
+        SELECT formation_id, date(ts, 'unixepoch', 'localtime'), COUNT(*), SUM(passed), SUM(score)
+        FROM tentatives GROUP BY 1, 2
+    """)
+    conn.commit()
+
+
+# Tables déplacées d'une partition à l'autre, par fichier, dans cet ordre. Copier les
+# tentatives déclenche leur trigger, qui réécrit tests dans la cible : la copie de tests
+# qui suit remplace cet état par celui de la source (une formation réinitialisée garde
+# son journal mais pas son état). Les agrégats tentatives_jour sont reconstruits ensuite.
+DEPLACEES = {
+    "progress": [("progress", "email, formation_id, chapter_id, timestamp")],
+    "tests": [
+        ("tentatives", "email, formation_id, revision, score, duree, passed, ts"),
+        ("tests", "email, formation_id, passed"),
+    ],
+}
+
+
+def _deplacer(kind, email, cle_source, cle):
+    """Copie les lignes de email de cle_source vers cle puis les supprime de la source ; renvoie leur nombre.
+
+    Les lignes de email déjà présentes dans la cible (arrêt entre les deux commits d'un
+    déplacement précédent) sont remplacées : la source fait foi.
+    """
+    source = connexion(kind, cle_source)
+    lots = [(table, cols, source.execute(f"SELECT {cols} FROM {table} WHERE email=? ORDER BY rowid", (email,)).fetchall())
+            for table, cols in DEPLACEES[kind]]
+    if not any(rows for _, _, rows in lots):
+        return 0
+    cible = connexion(kind, cle)
+    try:
+        for table, cols, rows in lots:
+            marques = ",".join("?" for _ in cols.split(","))
+            cible.execute(f"DELETE FROM {table} WHERE email=?", (email,))
+            cible.executemany(f"INSERT INTO {table}({cols}) VALUES({marques})", rows)
+        cible.commit()
+    except Exception:
+        cible.rollback()
+        raise
+    for table, _ in DEPLACEES[kind]:
+        source.execute(f"DELETE FROM {table} WHERE email=?", (email,))
+    source.commit()
+    return sum(len(rows) for _, _, rows in lots)
+
+
+def deplacer_utilisateur(email, ancienne_cle):
+    """Après un changement de site : déplace les lignes de l'utilisateur vers sa nouvelle partition."""
+    invalider_site(email)
+    cle = cle_partition(email)
+    if cle == ancienne_cle:
+        return 0
+    deplaces = sum(_deplacer(kind, email, ancienne_cle, cle) for kind in DEPLACEES)
+    for c in (ancienne_cle, cle):
+        reconstruire_rollups(connexion("tests", c))
+    cache.invalider("progress")
+    return deplaces
+
+
+def repartir():
+    """Déplace chaque ligne vers la partition de son utilisateur (après activation du partitionnement)."""
+    invalider_site()
+    for kind, tables in DEPLACEES.items():
+        deplaces = 0
+        for cle_source in partitions(kind):
+            source = connexion(kind, cle_source)
+            emails = {r[0] for table, _ in tables for r in source.execute(f"SELECT DISTINCT email FROM {table}")}
+            for email in sorted(emails):
+                cle = cle_partition(email)
+                if cle != cle_source:
+                    deplaces += _deplacer(kind, email, cle_source, cle)
+        print(f"{kind} : {deplaces} lignes déplacées")
+    for cle in partitions("tests"):
+        reconstruire_rollups(connexion("tests", cle))
+    cache.invalider("progress")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["repartir"]:
+        repartir()
+    else:
+        print(__doc__)
@@ -0,0 +1,151 @@
+"""Prérequis entre formations (parcours) et leur fermeture transitive précalculée.
+
+prerequis contient les arcs saisis (formation_id exige requis_id) ;
+prerequis_fermeture tous les couples (formation, prérequis direct ou
+indirect). Elle est tenue à jour à chaque modification d'arc, sur les seules
+formations concernées :
+
+- ajout de F -> R : chaque formation qui exige F (et F elle-même) exige
+  désormais R et tout ce qu'exige R ;
+- retrait d'un arc ou d'une formation : la fermeture des formations qui en
+  dépendaient est recalculée depuis les arcs restants ;
+- remplacement de tous les prérequis d'une formation (remplacer) : tout ou
+  rien, en une transaction et un seul recalcul.
+
+Un arc qui fermerait un cycle (R exige déjà F, directement ou non) est refusé
+par une seule lecture de la fermeture. Savoir si une formation est
+débloquée revient à vérifier que ses prérequis dans la fermeture (lue une
+fois par génération de l'entité prerequis, cache.py) sont tous réussis :
+aucun parcours du graphe à l'affichage.
+
+Les tables sont dans formations.db : la suppression d'une formation
+(operations.supprimer_formation) retire ses arcs dans la même transaction.
+"""
+import json
+
+
+def preparer(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS prerequis (
+            formation_id INTEGER NOT NULL REFERENCES formations(id) ON DELETE CASCADE,
+            requis_id INTEGER NOT NULL REFERENCES formations(id) ON DELETE CASCADE,
+            PRIMARY KEY(formation_id, requis_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_prerequis_requis ON prerequis(requis_id);
+        CREATE TABLE IF NOT EXISTS prerequis_fermeture (
+            formation_id INTEGER NOT NULL REFERENCES formations(id) ON DELETE CASCADE,
+            requis_id INTEGER NOT NULL REFERENCES formations(id) ON DELETE CASCADE,
+            PRIMARY KEY(formation_id, requis_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_prerequis_fermeture_requis ON prerequis_fermeture(requis_id);
+    """)
+
+
+def _recalculer(conn, formations):
+    """Reconstruit la fermeture des formations données depuis les arcs (dans la transaction en cours)."""
+    ids = json.dumps(sorted(formations))
+    conn.execute("DELETE FROM prerequis_fermeture WHERE formation_id IN (SELECT value FROM json_each(?))", (ids,))
+    conn.execute("""
+        WITH RECURSIVE f(formation_id, requis_id) AS (
+            SELECT formation_id, requis_id FROM prerequis
+            WHERE formation_id IN (SELECT value FROM json_each(?))
+            UNION
+            SELECT f.formation_id, p.requis_id FROM f JOIN prerequis p ON p.formation_id = f.requis_id
+        )
+        INSERT OR IGNORE INTO prerequis_fermeture(formation_id, requis_id) SELECT formation_id, requis_id FROM f
+    """, (ids,))
+
+
+def _dependantes(conn, formation_id):
+    """La formation et toutes celles qui l'exigent (directement ou non)."""
+    return {formation_id} | {r[0] for r in conn.execute(
+        "SELECT formation_id FROM prerequis_fermeture WHERE requis_id=?", (formation_id,)
+    )}
+
+
+def ajouter(conn, formation_id, requis_id):
+    """formation_id exigera requis_id ; ValueError si l'arc créerait un cycle."""
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if formation_id == requis_id or conn.execute(
+            "SELECT 1 FROM prerequis_fermeture WHERE formation_id=? AND requis_id=?", (requis_id, formation_id)
+        ).fetchone():
+            raise ValueError(f"Cycle de prérequis : la formation {requis_id} exige déjà la formation {formation_id}")
+        if conn.execute(
+            "INSERT OR IGNORE INTO prerequis(formation_id, requis_id) VALUES(?,?)", (formation_id, requis_id)
+        ).rowcount:
+            conn.execute("""
+                INSERT OR IGNORE INTO prerequis_fermeture(formation_id, requis_id)
+                SELECT d.f, r.r FROM
+                    (SELECT ? AS f UNION SELECT formation_id FROM prerequis_fermeture WHERE requis_id=?) d,
+                    (SELECT ? AS r UNION SELECT requis_id FROM prerequis_fermeture WHERE formation_id=?) r
+            """, (formation_id, formation_id, requis_id, requis_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def retirer(conn, formation_id, requis_id):
+    """Supprime l'arc formation_id -> requis_id."""
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute(
+            "DELETE FROM prerequis WHERE formation_id=? AND requis_id=?", (formation_id, requis_id)
+        ).rowcount:
+            _recalculer(conn, _dependantes(conn, formation_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def retirer_formation(conn, formation_id):
+    """Retire tous les arcs d'une formation supprimée (à appeler dans la transaction de suppression)."""
+    dependantes = _dependantes(conn, formation_id) - {formation_id}
+    conn.execute("DELETE FROM prerequis WHERE formation_id=? OR requis_id=?", (formation_id, formation_id))
+    conn.execute("DELETE FROM prerequis_fermeture WHERE formation_id=? OR requis_id=?", (formation_id, formation_id))
+    if dependantes:
+        _recalculer(conn, dependantes)
+
+
+def remplacer(conn, formation_id, requis_ids):
+    """Les prérequis saisis de formation_id deviennent requis_ids ; ValueError (rien n'est écrit) en cas de cycle.
+
+    R ferme un cycle s'il exige déjà formation_id : un chemin de R vers formation_id
+    ne passe pas par les arcs de formation_id, que l'on remplace.
+    """
+    requis_ids = sorted(set(requis_ids))
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cycles = [r for r in requis_ids if r == formation_id] + [r[0] for r in conn.execute("""
+            SELECT formation_id FROM prerequis_fermeture
+            WHERE requis_id = ? AND formation_id IN (SELECT value FROM json_each(?))
+        """, (formation_id, json.dumps(requis_ids)))]
+        if cycles:
+            raise ValueError(f"Cycle de prérequis : les formations {sorted(cycles)} exigent déjà la formation {formation_id}")
+        conn.execute("DELETE FROM prerequis WHERE formation_id=?", (formation_id,))
+        conn.executemany("INSERT INTO prerequis(formation_id, requis_id) VALUES(?,?)",
+                         [(formation_id, r) for r in requis_ids])
+        _recalculer(conn, _dependantes(conn, formation_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def directs(conn, formation_id):
+    """Ids des prérequis saisis pour la formation."""
+    return [r[0] for r in conn.execute("SELECT requis_id FROM prerequis WHERE formation_id=?", (formation_id,))]
+
+
+def fermeture(conn):
+    """{formation_id: frozenset des prérequis directs et indirects}, formations sans prérequis absentes."""
+    res = {}
+    for fid, rid in conn.execute("SELECT formation_id, requis_id FROM prerequis_fermeture"):
+        res.setdefault(fid, set()).add(rid)
+    return {fid: frozenset(ids) for fid, ids in res.items()}
+
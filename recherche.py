@@ -0,0 +1,190 @@
+"""Recherche plein texte (SQLite FTS5) sur les chapitres : titres, textes, PDF et PPTX.
+
+L'index vit dans formations.db, à côté des chapitres. L'extraction du texte
+des fichiers est faite par la tâche "indexer_chapitres" (jobs.py), jamais
+pendant l'affichage ; la suppression d'un chapitre retire ses lignes de
+l'index par trigger. Chaque chapitre indexé garde une signature (titre, type,
+contenu, date du fichier) : une réindexation complète ne retraite que ce qui
+a changé. Un fichier dont le texte n'a pas pu être extrait (fichier illisible,
+pypdf absent) est indexé par son titre, avec l'erreur, affichée dans l'onglet
+Tâches (erreurs()) ; il est retraité à chaque indexation complète.
+
+    python recherche.py      # (ré)indexe les chapitres modifiés ou absents de l'index
+"""
+import html
+import json
+import os
+import re
+import sqlite3
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # requirements.txt ; sans lui, chaque PDF est signalé en erreur (erreurs())
+    PdfReader = None
+
+DB = "formations.db"
+
+_DEBUT, _FIN = "\x02", "\x03"
+
+
+def preparer(conn):
+    conn.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chapitres_fts USING fts5(
+            titre, corps, tokenize = 'unicode61 remove_diacritics 2'
+        );
+        -- Dernière version indexée de chaque chapitre (rowid de chapitres_fts = id du chapitre)
+        CREATE TABLE IF NOT EXISTS chapitres_indexes (
+            chapter_id INTEGER PRIMARY KEY, signature TEXT NOT NULL, erreur TEXT
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_chapitres_fts_delete AFTER DELETE ON chapitres BEGIN
+            DELETE FROM chapitres_fts WHERE rowid = old.id;
+            DELETE FROM chapitres_indexes WHERE chapter_id = old.id;
+        END;
+    """)
+    if "erreur" not in [r[1] for r in conn.execute("PRAGMA table_info(chapitres_indexes)")]:
+        conn.execute("ALTER TABLE chapitres_indexes ADD COLUMN erreur TEXT")
+        # PDF indexés avant le signalement des erreurs : peut-être par leur seul titre, on les reprend
+        conn.execute("""
+            UPDATE chapitres_indexes SET signature = ''
+            WHERE chapter_id IN (SELECT id FROM chapitres WHERE type_contenu = 'pdf')
+        """)
+        conn.commit()
+
+
+def _chemin(contenu):
+    return contenu.replace("\\", "/")   # chemins enregistrés sous Windows
+
+
+def _signature(titre, type_contenu, contenu):
+    mtime = ""
+    if type_contenu != "texte" and os.path.exists(_chemin(contenu)):
+        mtime = str(os.path.getmtime(_chemin(contenu)))
+    return "\x1f".join((titre, type_contenu, contenu, mtime))
+
+
+def _texte_pptx(chemin):
+    textes = []
+    with zipfile.ZipFile(chemin) as z:
+        slides = [n for n in z.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)]
+        for nom in sorted(slides, key=lambda n: int(re.search(r"\d+", n).group())):
+            racine = ET.fromstring(z.read(nom))
+            # Texte des zones : éléments <a:t> (DrawingML)
+            textes.extend(e.text for e in racine.iter() if e.tag.endswith("}t") and e.text)
+    return "\n".join(textes)
+
+
+def _texte_pdf(chemin):
+    if PdfReader is None:
+        raise RuntimeError("pypdf n'est pas installé (pip install -r requirements.txt)")
+    return "\n".join(page.extract_text() or "" for page in PdfReader(chemin).pages)
+
+
+def extraire_texte(type_contenu, contenu):
+    """Texte du chapitre ; lève une exception si le fichier existe mais ne peut pas être lu."""
+    if type_contenu == "texte":
+        return contenu
+    chemin = _chemin(contenu)
+    if not os.path.exists(chemin):
+        return ""
+    if type_contenu == "pdf":
+        return _texte_pdf(chemin)
+    if type_contenu == "ppt" and chemin.lower().endswith(".pptx"):
+        return _texte_pptx(chemin)
+    return ""
+
+
+def indexer(chapter_ids=None):
+    """Indexe les chapitres donnés, ou tous ceux dont la signature a changé ; renvoie le nombre indexé."""
+    conn = sqlite3.connect(DB, timeout=30)
+    try:
+        preparer(conn)
+        sql = """
+            SELECT c.id, c.titre, c.type_contenu, c.contenu, i.signature
+            FROM chapitres c LEFT JOIN chapitres_indexes i ON i.chapter_id = c.id
+        """
+        params = ()
+        if chapter_ids is not None:
+            sql += " WHERE c.id IN (SELECT value FROM json_each(?))"
+            params = (json.dumps([int(i) for i in chapter_ids]),)
+        n = 0
+        for cid, titre, type_contenu, contenu, ancienne in conn.execute(sql, params).fetchall():
+            signature = _signature(titre, type_contenu, contenu)
+            if chapter_ids is None and signature == ancienne:
+                continue
+            try:
+                corps, erreur = extraire_texte(type_contenu, contenu), None
+            except Exception as e:  # le chapitre reste trouvable par son titre
+                corps, erreur = "", f"{type(e).__name__} : {e}"
+            conn.execute("DELETE FROM chapitres_fts WHERE rowid=?", (cid,))
+            conn.execute("INSERT INTO chapitres_fts(rowid, titre, corps) VALUES(?,?,?)", (cid, titre, corps))
+            # Signature vide après une erreur : la prochaine indexation complète réessaie
+            conn.execute(
+                "INSERT OR REPLACE INTO chapitres_indexes(chapter_id, signature, erreur) VALUES(?,?,?)",
+                (cid, "" if erreur else signature, erreur)
+            )
+            n += 1
+            if n % 100 == 0:
+                conn.commit()
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+
+def a_indexer(conn):
+    """Nombre de chapitres encore absents de l'index."""
+    return conn.execute("""
+        SELECT COUNT(*) FROM chapitres c
+        WHERE NOT EXISTS (SELECT 1 FROM chapitres_indexes i WHERE i.chapter_id = c.id)
+    """).fetchone()[0]
+
+
+def erreurs(conn):
+    """[(chapter_id, titre, erreur)] des chapitres dont le texte n'a pas pu être extrait."""
+    return conn.execute("""
+        SELECT c.id, c.titre, i.erreur FROM chapitres_indexes i JOIN chapitres c ON c.id = i.chapter_id
+        WHERE i.erreur IS NOT NULL ORDER BY c.id
+    """).fetchall()
+
+
+def _surligner(texte):
+    return html.escape(texte).replace(_DEBUT, "<mark>").replace(_FIN, "</mark>")
+
+
+def rechercher(conn, requete, limite=20):
+    """Chapitres correspondant à la requête, du plus pertinent au moins pertinent.
+
+    Renvoie des dicts (chapter_id, formation_id, formation, chapitre, extrait) ;
+    chapitre et extrait sont du HTML échappé où les termes trouvés sont en <mark>,
+    formation est le titre brut.
+    """
+    termes = re.findall(r"\w+", requete)
+    if not termes:
+        return []
+    # Chaque mot est cherché tel quel (entre guillemets) et en préfixe
+    match = " ".join(f'"{m}"*' for m in termes)
+    rows = conn.execute("""
+        SELECT c.id, c.formation_id, f.titre,
+               highlight(chapitres_fts, 0, ?, ?),
+               snippet(chapitres_fts, 1, ?, ?, '…', 16)
+        FROM chapitres_fts
+        JOIN chapitres c ON c.id = chapitres_fts.rowid
+        JOIN formations f ON f.id = c.formation_id
+        WHERE chapitres_fts MATCH ?
+        ORDER BY bm25(chapitres_fts, 5.0, 1.0)
+        LIMIT ?
+    """, (_DEBUT, _FIN, _DEBUT, _FIN, match, limite)).fetchall()
+    return [
+        {"chapter_id": cid, "formation_id": fid, "formation": ftitre,
+         "chapitre": _surligner(titre), "extrait": _surligner(extrait)}
+        for cid, fid, ftitre, titre, extrait in rows
+    ]
+
+
+if __name__ == "__main__":
+    print(f"{indexer()} chapitre(s) indexé(s)")
+    for cid, titre, erreur in erreurs(sqlite3.connect(DB)):
+        print(f"  chapitre {cid} ({titre}) : {erreur}", file=sys.stderr)
@@ -0,0 +1,200 @@
+"""Recommandations de formations : co-complétion et popularité par fonction métier.
+
+Le modèle est recalculé en lot par la tâche "recommandations" (jobs.py) :
+
+- matrice creuse utilisateurs x formations (1 = formation commencée, 2 = test réussi)
+  construite depuis progress/tests sur toutes les partitions ;
+- similarité cosinus formation x formation (co-complétion) ;
+- popularité des formations parmi les collègues de même fonction (table employes,
+  rapprochée des utilisateurs par nom et prénom), puis popularité globale.
+
+Les TOP_K meilleures formations non encore commencées de chaque utilisateur sont
+écrites dans la table recommandations de formations.db ; l'affichage ne fait
+qu'une lecture indexée. Seules les lignes qui ont changé sont réécrites, et le
+calcul est sauté si les données d'entrée n'ont pas bougé depuis le dernier lot.
+
+    python recommandations.py
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+from scipy import sparse
+
+import partitions
+
+DB = "formations.db"
+TOP_K = 5
+POIDS_FONCTION = 0.5    # poids de la popularité chez les collègues de même fonction
+POIDS_GLOBAL = 0.1      # poids de la popularité globale (départage et démarrage à froid)
+DELAI = int(os.environ.get("FM_RECO_DELAI", "300"))   # regroupement des recalculs (secondes)
+ARRONDI = 6             # décimales des scores comparées avant réécriture
+TOUS = "*"              # clé des recommandations par défaut (utilisateur encore inconnu)
+
+
+def preparer(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS recommandations (
+            cle TEXT NOT NULL, rang INTEGER NOT NULL,
+            formation_id INTEGER NOT NULL, score REAL NOT NULL,
+            PRIMARY KEY(cle, rang)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS recommandations_etat (
+            param TEXT PRIMARY KEY, value TEXT
+        );
+    """)
+
+
+def _interactions():
+    """{(email, formation_id): poids} sur toutes les partitions."""
+    poids = {}
+    for rows in partitions.fan_out("progress", "SELECT DISTINCT email, formation_id FROM progress"):
+        for email, fid in rows:
+            poids[(email, fid)] = 1.0
+    for rows in partitions.fan_out("tests", "SELECT email, formation_id FROM tests WHERE passed=1"):
+        for email, fid in rows:
+            poids[(email, fid)] = 2.0
+    return poids
+
+
+def _utilisateurs():
+    """({email: fonction métier}, [emails]) ; la fonction vient d'employes (même nom et prénom, casse ignorée)."""
+    conn = sqlite3.connect("users.db")
+    try:
+        return dict(conn.execute("""
+            SELECT u.email, MIN(e.fonction)
+            FROM utilisateurs u
+            JOIN employes e ON lower(trim(e.nom)) = lower(trim(u.nom))
+                           AND lower(trim(e.prenom)) = lower(trim(u.prenom))
+            GROUP BY u.email
+        """).fetchall()), [r[0] for r in conn.execute("SELECT email FROM utilisateurs")]
+    finally:
+        conn.close()
+
+
+def _normaliser(v):
+    m = v.max() if v.size else 0
+    return v / m if m > 0 else v
+
+
+def calculer(interactions, fonctions, emails, formation_ids, top_k=TOP_K):
+    """{cle: [(formation_id, score), ...]} pour chaque email et pour TOUS."""
+    emails = sorted(set(emails) | {e for e, _ in interactions})
+    ui = {e: i for i, e in enumerate(emails)}
+    fi = {f: j for j, f in enumerate(formation_ids)}
+    paires = [(ui[e], fi[f], p) for (e, f), p in interactions.items() if f in fi]
+    lignes, cols, vals = zip(*paires) if paires else ((), (), ())
+    R = sparse.csr_matrix((vals, (lignes, cols)), shape=(len(emails), len(formation_ids)))
+
+    # Similarité cosinus entre formations, sans la diagonale
+    normes = np.sqrt(np.asarray(R.multiply(R).sum(axis=0))).ravel()
+    normes[normes == 0] = 1.0
+    Rn = R @ sparse.diags(1.0 / normes)
+    S = (Rn.T @ Rn).tolil()
+    S.setdiag(0)
+    scores = (R @ S.tocsr()).toarray()
+
+    # Popularité (part des utilisateurs ayant suivi la formation), globale et par fonction
+    B = (R > 0).astype(np.float64)
+    global_ = _normaliser(np.asarray(B.sum(axis=0)).ravel())
+    par_fonction = {}
+    codes = np.array([fonctions.get(e, "") for e in emails])
+    for f in set(codes) - {""}:
+        par_fonction[f] = _normaliser(np.asarray(B[codes == f].sum(axis=0)).ravel())
+
+    lignes_max = scores.max(axis=1, keepdims=True)
+    lignes_max[lignes_max == 0] = 1.0
+    scores = scores / lignes_max + POIDS_GLOBAL * global_
+    for f, pop in par_fonction.items():
+        scores[codes == f] += POIDS_FONCTION * pop
+    scores[B.toarray() > 0] = -np.inf     # déjà commencées : pas recommandées
+
+    res = {}
+    k = min(top_k, len(formation_ids))
+    for e, i in ui.items():
+        meilleurs = np.argsort(-scores[i], kind="stable")[:k]
+        res[e] = [(formation_ids[j], float(scores[i, j])) for j in meilleurs if np.isfinite(scores[i, j])]
+    ordre = np.argsort(-global_, kind="stable")[:k]
+    res[TOUS] = [(formation_ids[j], float(global_[j])) for j in ordre]
+    return res
+
+
+def rafraichir(force=False):
+    """Recalcule le modèle et met à jour la table ; renvoie le nombre de clés réécrites."""
+    interactions = _interactions()
+    fonctions, emails = _utilisateurs()
+    conn = sqlite3.connect(DB, timeout=30)
+    try:
+        preparer(conn)
+        formation_ids = [r[0] for r in conn.execute("SELECT id FROM formations ORDER BY id")]
+        empreinte = hashlib.sha256(repr((
+            sorted(interactions.items()), sorted(fonctions.items()), sorted(emails), formation_ids
+        )).encode()).hexdigest()
+        row = conn.execute("SELECT value FROM recommandations_etat WHERE param='empreinte'").fetchone()
+        if not force and row and row[0] == empreinte:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO recommandations_etat(param, value) VALUES('maj_le', ?)", (str(time.time()),))
+            return 0
+        nouveau = calculer(interactions, fonctions, emails, formation_ids)
+
+        existant = {}
+        for cle, fid, score in conn.execute("SELECT cle, formation_id, score FROM recommandations ORDER BY cle, rang"):
+            existant.setdefault(cle, []).append((fid, score))
+        # Une clé est réécrite si l'ordre ou un score a bougé (scores comparés à ARRONDI décimales)
+        a_ecrire = [cle for cle, recos in nouveau.items()
+                    if [(f, round(s, ARRONDI)) for f, s in recos]
+                    != [(f, round(s, ARRONDI)) for f, s in existant.get(cle, [])]]
+        a_effacer = set(existant) - set(nouveau)
+        with conn:
+            conn.executemany("DELETE FROM recommandations WHERE cle=?", [(c,) for c in list(a_effacer) + a_ecrire])
+            conn.executemany(
+                "INSERT INTO recommandations(cle, rang, formation_id, score) VALUES(?,?,?,?)",
+                [(cle, rang, fid, score) for cle in a_ecrire for rang, (fid, score) in enumerate(nouveau[cle])]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO recommandations_etat(param, value) VALUES(?,?)",
+                [("empreinte", empreinte), ("maj_le", str(time.time()))]
+            )
+        return len(a_ecrire) + len(a_effacer)
+    finally:
+        conn.close()
+
+
+def programmer():
+    """Demande un recalcul groupé (une seule tâche en attente à la fois).
+
+    Sans worker, recalcule dans la session, au plus une fois toutes les DELAI secondes.
+    """
+    import jobs  # import tardif : jobs.py référence ce module pour sa tâche
+    if jobs.planifier("recommandations", DELAI):
+        return
+    conn = sqlite3.connect(DB, timeout=30)
+    try:
+        maj_le = conn.execute("SELECT value FROM recommandations_etat WHERE param='maj_le'").fetchone()
+    finally:
+        conn.close()
+    if maj_le is None or time.time() - float(maj_le[0]) > DELAI:
+        rafraichir()
+
+
+def pour(conn, email, commencees=frozenset()):
+    """[(formation_id, titre)] recommandées à l'utilisateur (ou par défaut), en une lecture indexée.
+
+    commencees : formations déjà commencées par l'utilisateur, retirées de la liste (la liste par
+    défaut ne les exclut pas, et celle de l'utilisateur date du dernier recalcul).
+    """
+    rows = conn.execute("""
+        SELECT r.cle, r.formation_id, f.titre
+        FROM recommandations r JOIN formations f ON f.id = r.formation_id
+        WHERE r.cle IN (?, ?)
+        ORDER BY r.cle = ?, r.rang
+    """, (email, TOUS, TOUS)).fetchall()
+    if not rows:
+        return []
+    return [(fid, titre) for cle, fid, titre in rows if cle == rows[0][0] and fid not in commencees]
+
+
+if __name__ == "__main__":
+    print(f"{rafraichir(force=True)} recommandation(s) mise(s) à jour")
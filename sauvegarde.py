@@ -0,0 +1,221 @@
+"""Sauvegardes à chaud de toutes les bases (API de sauvegarde en ligne de SQLite).
+
+Un jeu de sauvegarde est un dossier sauvegardes/<AAAAMMJJ-HHMMSS>/ contenant une
+copie de chaque base et un manifest.json (taille, pages, sha256 de chaque
+fichier). Les bases sont en WAL : une transaction de lecture est ouverte sur
+toutes les bases avant de commencer, ce qui fige le même instant pour tout le
+jeu, puis chaque base est copiée par paquets de PAGES pages. Les écritures des
+apprenants continuent pendant la copie (WAL : les lecteurs ne bloquent pas
+les écrivains) et la copie ne redémarre jamais.
+
+Le jeu n'apparaît sous son nom définitif qu'une fois complet (renommage du
+dossier temporaire). La tâche "sauvegarde" (jobs.py) se reprogramme toutes les
+INTERVALLE secondes, ce qui suppose un worker : sans worker, aucune sauvegarde
+planifiée n'a lieu et en_retard() le signale (onglet Tâches) ; GARDER jeux récents plus un par jour sur JOURS jours sont
+conservés.
+
+    python sauvegarde.py                     # crée un jeu maintenant
+    python sauvegarde.py liste
+    python sauvegarde.py verifier <jeu>      # sha256 + PRAGMA quick_check
+    python sauvegarde.py restaurer <jeu>     # application et workers arrêtés
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import partitions
+
+DOSSIER = os.environ.get("FM_BACKUP_DIR", "sauvegardes")
+INTERVALLE = int(os.environ.get("FM_BACKUP_INTERVALLE", "3600"))
+GARDER = int(os.environ.get("FM_BACKUP_GARDER", "24"))
+JOURS = int(os.environ.get("FM_BACKUP_JOURS", "7"))
+PAGES = 4096            # pages copiées par étape (16 Mo avec des pages de 4 Ko)
+PAUSE = 0.005           # pause entre deux étapes pour laisser passer les écrivains
+
+BASES = ["system.db", "users.db", "formations.db", "progress.db", "tests.db", "jobs.db", "notifications.db", "certificats.db"]
+
+
+def bases():
+    """Fichiers à sauvegarder : bases principales et partitions existantes."""
+    fichiers = [b for b in BASES if os.path.exists(b)]
+    fichiers += sorted(glob.glob(os.path.join(partitions.DOSSIER, "*.db")))
+    return fichiers
+
+
+def _sha256(chemin):
+    h = hashlib.sha256()
+    with open(chemin, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+def _figer(chemin):
+    """Connexion source avec une transaction de lecture ouverte (instantané WAL)."""
+    conn = sqlite3.connect(chemin, timeout=30, isolation_level=None)
+    wal = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0] == "wal"
+    if wal:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    # Sans WAL (base verrouillée au moment du passage) : copie simple, qui recommence si la base change
+    return conn
+
+
+def copier(dossier, fichiers, sommes=True, journal=None):
+    """Copie cohérente (même instant) des bases dans dossier ; renvoie {chemin: infos}.
+
+    journal : mode de journal imposé aux copies (ex. "DELETE" pour des copies ouvertes en lecture seule).
+    """
+    sources = {chemin: _figer(chemin) for chemin in fichiers}
+    infos = {}
+    try:
+        for chemin, src in sources.items():
+            dest = os.path.join(dossier, chemin)
+            os.makedirs(os.path.dirname(dest) or dossier, exist_ok=True)
+            dst = sqlite3.connect(dest)
+            try:
+                debut = time.time()
+                src.backup(dst, pages=PAGES, sleep=PAUSE)
+                if journal:
+                    dst.execute(f"PRAGMA journal_mode={journal}")
+                pages = dst.execute("PRAGMA page_count").fetchone()[0]
+            finally:
+                dst.close()
+            infos[chemin] = {"taille": os.path.getsize(dest), "pages": pages, "secondes": round(time.time() - debut, 3)}
+            if sommes:
+                infos[chemin]["sha256"] = _sha256(dest)
+    finally:
+        for src in sources.values():
+            src.close()
+    return infos
+
+
+def sauvegarder():
+    """Crée un jeu de sauvegarde complet ; renvoie son nom."""
+    nom = datetime.now().strftime("%Y%m%d-%H%M%S")
+    tmp = os.path.join(DOSSIER, f".tmp-{nom}")
+    os.makedirs(tmp, exist_ok=True)
+    manifest = {"nom": nom, "cree_le": time.time(), "fichiers": copier(tmp, bases())}
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(DOSSIER, nom))
+    purger()
+    return nom
+
+
+def liste():
+    """Jeux complets, du plus récent au plus ancien."""
+    if not os.path.isdir(DOSSIER):
+        return []
+    return sorted(
+        (d for d in os.listdir(DOSSIER)
+         if not d.startswith(".") and os.path.exists(os.path.join(DOSSIER, d, "manifest.json"))),
+        reverse=True
+    )
+
+
+def manifest(nom):
+    with open(os.path.join(DOSSIER, nom, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def purger():
+    """Garde les GARDER jeux les plus récents et le plus récent de chacun des JOURS derniers jours."""
+    jeux = liste()
+    garder = set(jeux[:GARDER])
+    jours = {}
+    for nom in jeux:
+        jours.setdefault(nom[:8], nom)   # liste() est triée du plus récent au plus ancien
+    garder.update(sorted(jours.values(), reverse=True)[:JOURS])
+    for nom in jeux:
+        if nom not in garder:
+            shutil.rmtree(os.path.join(DOSSIER, nom))
+    # Jeux interrompus (process tué pendant la copie)
+    for tmp in glob.glob(os.path.join(DOSSIER, ".tmp-*")):
+        if time.time() - os.path.getmtime(tmp) > INTERVALLE:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def verifier(nom):
+    """Liste des anomalies du jeu (vide si tout est correct)."""
+    erreurs = []
+    for chemin, info in manifest(nom)["fichiers"].items():
+        copie = os.path.join(DOSSIER, nom, chemin)
+        if not os.path.exists(copie):
+            erreurs.append(f"{chemin} : fichier manquant")
+        elif _sha256(copie) != info["sha256"]:
+            erreurs.append(f"{chemin} : somme de contrôle différente")
+        else:
+            conn = sqlite3.connect(f"file:{copie}?mode=ro", uri=True)
+            try:
+                etat = conn.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                conn.close()
+            if etat != "ok":
+                erreurs.append(f"{chemin} : {etat}")
+    return erreurs
+
+
+def restaurer(nom):
+    """Remet chaque base dans l'état du jeu (après vérification), via l'API de sauvegarde."""
+    erreurs = verifier(nom)
+    if erreurs:
+        raise RuntimeError("Jeu de sauvegarde invalide : " + "; ".join(erreurs))
+    for chemin in manifest(nom)["fichiers"]:
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+        src = sqlite3.connect(f"file:{os.path.join(DOSSIER, nom, chemin)}?mode=ro", uri=True)
+        dst = sqlite3.connect(chemin, timeout=30)
+        try:
+            src.backup(dst, pages=PAGES)
+        finally:
+            src.close()
+            dst.close()
+
+
+def tache():
+    """Tâche planifiée : sauvegarde puis reprogrammation de la suivante."""
+    try:
+        return sauvegarder()
+    finally:
+        programmer()
+
+
+def programmer():
+    """Garantit qu'une sauvegarde est en attente dans la file ; False si aucun worker ne l'exécutera."""
+    import jobs  # import tardif : jobs.py référence ce module pour sa tâche
+    return jobs.planifier("sauvegarde", INTERVALLE)
+
+
+def en_retard():
+    """Secondes depuis le dernier jeu si la sauvegarde planifiée aurait dû passer (None : à l'heure)."""
+    jeux = liste()
+    age = time.time() - manifest(jeux[0])["cree_le"] if jeux else float("inf")
+    return age if age > INTERVALLE * 1.5 else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sauvegardes des bases Formation Manager")
+    parser.add_argument("commande", nargs="?", default="sauvegarder",
+                        choices=["sauvegarder", "liste", "verifier", "restaurer"])
+    parser.add_argument("jeu", nargs="?")
+    args = parser.parse_args()
+    if args.commande == "sauvegarder":
+        print(f"Jeu créé : {sauvegarder()}")
+    elif args.commande == "liste":
+        for nom in liste():
+            m = manifest(nom)
+            print(nom, f"{sum(f['taille'] for f in m['fichiers'].values()) / 1e6:.1f} Mo", len(m["fichiers"]), "bases")
+    elif args.jeu is None:
+        parser.error("indiquer le jeu de sauvegarde")
+    elif args.commande == "verifier":
+        erreurs = verifier(args.jeu)
+        print("\n".join(erreurs) or "OK")
+    else:
+        restaurer(args.jeu)
+        print(f"Bases restaurées depuis {args.jeu}")
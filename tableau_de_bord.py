@@ -0,0 +1,162 @@
+"""Données et graphiques du tableau de bord admin, agrégés côté serveur et mis en cache.
+
+Les agrégats sont calculés sur la source analytique (analytique.py) plus les
+lignes archivées (archive.py) ; les tentatives de test viennent des agrégats
+par jour tenus par trigger (tentatives_jour, partitions.py). Ils sont bornés : MOIS_MAX derniers mois pour les
+séries mensuelles, CATEGORIES_MAX catégories (le reste regroupé) pour les
+répartitions. Les spécifications
+Vega-Lite sont sérialisées une fois par version des données analytiques et
+par langue (cache.py) : tant que l'instantané ne change pas, aucun graphique
+n'est reconstruit.
+"""
+import altair as alt
+import pandas as pd
+
+import analytique
+import archive
+import cache
+
+MOIS_MAX = 36
+CATEGORIES_MAX = 10
+TAILLE = 250
+
+
+def _mois(rows):
+    """[(mois 'AAAA-MM', n)] additionnés, limités aux MOIS_MAX derniers mois."""
+    total = {}
+    for mois, n in rows:
+        if mois:
+            total[mois] = total.get(mois, 0) + n
+    return sorted(total.items())[-MOIS_MAX:]
+
+
+def _categories(rows, autres):
+    """[(catégorie, n)] triés ; au-delà de CATEGORIES_MAX, le reste devient une seule catégorie autres."""
+    rows = sorted(rows, key=lambda r: -r[1])
+    if len(rows) > CATEGORIES_MAX:
+        rows = rows[:CATEGORIES_MAX - 1] + [(autres, sum(n for _, n in rows[CATEGORIES_MAX - 1:]))]
+    return rows
+
+
+def _libelle(fonction):
+    return (fonction or "—").replace("_", " ").title()
+
+
+def _calculer():
+    a_form = analytique.connexion("formations.db")
+    a_users = analytique.connexion("users.db")
+    d = {
+        "formations": a_form.execute("SELECT COUNT(*) FROM formations").fetchone()[0],
+        "chapitres": a_form.execute("SELECT COUNT(*) FROM chapitres").fetchone()[0],
+        "employes": a_users.execute("SELECT COUNT(*) FROM employes").fetchone()[0],
+        "utilisateurs": a_users.execute("SELECT COUNT(*) FROM utilisateurs").fetchone()[0],
+        "formations_mois": _mois(a_form.execute(
+            "SELECT substr(date,1,7), COUNT(*) FROM formations GROUP BY 1"
+        ).fetchall()),
+        "chapitres_type": a_form.execute(
+            "SELECT type_contenu, COUNT(*) FROM chapitres GROUP BY 1"
+        ).fetchall(),
+        "employes_fonction": [(_libelle(f), n) for f, n in a_users.execute(
+            "SELECT fonction, COUNT(*) FROM employes GROUP BY 1"
+        )],
+        "utilisateurs_fonction": [(_libelle(f), n) for f, n in a_users.execute(
+            "SELECT fonction, COUNT(*) FROM utilisateurs GROUP BY 1"
+        )],
+    }
+    # Agrégats calculés sur chaque partition en parallèle puis additionnés, plus les
+    # lignes archivées (archive.py) : un apprenant peut avoir des lignes des deux côtés,
+    # les emails distincts sont donc réunis en ensembles
+    arch_prog = archive.lire_archive("progress", colonnes=["email", "timestamp"])
+    arch_test = archive.lire_archive("tests", colonnes=["email", "passed"])
+    agg_prog = analytique.fan_out("progress", "SELECT COUNT(*) FROM progress")
+    agg_test = analytique.fan_out("tests", "SELECT COUNT(*), COALESCE(SUM(passed=1), 0) FROM tests")
+    actifs = set(arch_prog["email"])
+    for rows in analytique.fan_out("progress", "SELECT DISTINCT email FROM progress"):
+        actifs.update(r[0] for r in rows)
+    reussis = set(arch_test.loc[arch_test["passed"] == 1, "email"])
+    for rows in analytique.fan_out("tests", "SELECT DISTINCT email FROM tests WHERE passed=1"):
+        reussis.update(r[0] for r in rows)
+    d["progressions"] = sum(r[0][0] for r in agg_prog) + len(arch_prog)
+    d["actifs"] = len(actifs)
+    d["tests"] = sum(r[0][0] for r in agg_test) + len(arch_test)
+    d["reussis"] = sum(r[0][1] for r in agg_test) + int((arch_test["passed"] == 1).sum())
+    d["employes_reussis"] = len(reussis)
+    d["progress_mois"] = _mois(
+        [row for rows in analytique.fan_out("progress", "SELECT substr(timestamp,1,7), COUNT(*) FROM progress GROUP BY 1")
+         for row in rows]
+        + list(arch_prog["timestamp"].str.slice(0, 7).value_counts().items())
+    )
+    # Tentatives et réussites par mois, depuis les agrégats par jour (aucun balayage du journal) ;
+    # les formations supprimées avant que leurs agrégats ne le soient avec elles sont écartées
+    existantes = {r[0] for r in a_form.execute("SELECT id FROM formations")}
+    tentatives = {}
+    for rows in analytique.fan_out(
+        "tests", "SELECT formation_id, substr(jour,1,7), SUM(tentatives), SUM(reussites) FROM tentatives_jour GROUP BY 1, 2"
+    ):
+        for fid, mois, n, ok in rows:
+            if fid not in existantes:
+                continue
+            total, reussies = tentatives.get(mois, (0, 0))
+            tentatives[mois] = (total + n, reussies + ok)
+    d["tentatives_mois"] = [(mois, n, ok) for mois, (n, ok) in sorted(tentatives.items())[-MOIS_MAX:]]
+    return d
+
+
+def donnees():
+    """Indicateurs et séries agrégées pour la version courante des données analytiques."""
+    return cache.lire(("tableau_de_bord", analytique.version()), (), _calculer)
+
+
+def _barres(rows, categorie, mark="bar"):
+    df = pd.DataFrame(rows, columns=[categorie, "n"])
+    chart = alt.Chart(df)
+    if mark == "bar":
+        chart = chart.mark_bar(color="#2E4053", cornerRadiusTopLeft=3, cornerRadiusTopRight=3)
+    else:
+        chart = chart.mark_circle(size=100, color="#2E4053")
+    return chart.encode(x=alt.X(f"{categorie}:N", sort="-y", title=None), y=alt.Y("n:Q", title=None))
+
+
+def _anneau(rows):
+    return alt.Chart(pd.DataFrame(rows, columns=["cat", "n"])) \
+        .mark_arc(innerRadius=50, outerRadius=100) \
+        .encode(theta="n:Q", color=alt.Color("cat:N", legend=None), tooltip=["cat:N", "n:Q"])
+
+
+def _specs(d, t):
+    mois_formations = pd.DataFrame(d["formations_mois"], columns=["mois", "n"])
+    mois_progress = pd.DataFrame(d["progress_mois"], columns=["mois", "n"])
+    autres = t("Autres", "Others", "Otros")
+    passes, echoues = t("Passés", "Passed", "Aprobados"), t("Échoués", "Failed", "Fallidos")
+    tests = [(passes, d["reussis"]), (echoues, d["tests"] - d["reussis"])]
+    mois_tentatives = pd.DataFrame(
+        [(mois, passes, ok) for mois, _, ok in d["tentatives_mois"]]
+        + [(mois, echoues, n - ok) for mois, n, ok in d["tentatives_mois"]],
+        columns=["mois", "cat", "n"]
+    )
+    graphiques = [
+        alt.Chart(mois_formations)
+            .mark_line(color="#2E4053", interpolate="monotone", strokeWidth=3, point=True)
+            .encode(x=alt.X("mois:T", title=None), y=alt.Y("n:Q", title=None)),
+        _barres(_categories(d["employes_fonction"], autres), "fonction"),
+        _barres(_categories(d["utilisateurs_fonction"], autres), "fonction"),
+        _barres(_categories(d["chapitres_type"], autres), "type", mark="circle"),
+        alt.Chart(mois_progress)
+            .mark_bar(opacity=0.5, color="#2E4053")
+            .encode(x=alt.X("mois:T", title=None), y=alt.Y("n:Q", title=None)),
+        _anneau(tests),
+        _anneau([(t("Actifs", "Active", "Activos"), d["actifs"]),
+                 (t("Inactifs", "Inactive", "Inactivos"), d["employes"] - d["actifs"])]),
+        _anneau([(t("Ont réussi", "Passed", "Aprobados"), d["employes_reussis"]),
+                 (t("Sans réussite", "Not passed", "Sin aprobar"), d["employes"] - d["employes_reussis"])]),
+        alt.Chart(mois_tentatives)
+            .mark_bar()
+            .encode(x=alt.X("yearmonth(mois):T", title=None), y=alt.Y("sum(n):Q", title=None),
+                    color=alt.Color("cat:N", legend=None), tooltip=["mois:N", "cat:N", "n:Q"]),
+    ]
+    return [g.properties(width=TAILLE, height=TAILLE).to_dict() for g in graphiques]
+
+
+def specs(lang, t):
+    """Spécifications Vega-Lite des neuf graphiques, sérialisées une fois par version des données et langue."""
+    return cache.lire(("tableau_de_bord_specs", analytique.version(), lang), (), lambda: _specs(donnees(), t))